@@ -0,0 +1,251 @@
+"""
+    Synthetic MIME corpus used by the benchmarks, built only with the stdlib email package.
+
+    KINDS:
+        plain           single text/plain part
+        alternative     multipart/alternative with text and html
+        nested          a mail with a .eml attachment, which carries a .eml attachment itself
+        zip             a mail with a zip attachment holding pdf/xml/txt members
+        p7m             a mail with a signed (CMS SignedData, unverified) xml invoice
+        thread_ita      a reply chain quoted with the italian Outlook headers (Da:/Inviato:/A:/Oggetto:)
+        thread_eng      a reply chain quoted with the english Outlook headers (From:/Sent:/To:/Subject:)
+"""
+import io
+import random
+import zipfile
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from email.utils import format_datetime
+from typing import List, Callable, Dict
+
+KINDS = ["plain", "alternative", "nested", "zip", "p7m", "thread_ita", "thread_eng"]
+
+# approximate size in bytes of the body text of a message
+SIZES = {
+    "small": 1_000,
+    "medium": 20_000,
+    "large": 250_000,
+}
+
+_WORDS = (
+    "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore "
+    "et dolore magna aliqua fattura ordine consegna pagamento contratto allegato riunione progetto "
+    "invoice order delivery payment contract attachment meeting project"
+).split()
+_NAMES = ["Mario Rossi", "Luigi Bianchi", "Anna Verdi", "Giulia Neri", "John Smith", "Jane Doe", "Paolo Gialli"]
+
+_WEEKDAYS_ITA = ["lunedì", "martedì", "mercoledì", "giovedì", "venerdì", "sabato", "domenica"]
+_MONTHS_ITA = [
+    "gennaio", "febbraio", "marzo", "aprile", "maggio", "giugno",
+    "luglio", "agosto", "settembre", "ottobre", "novembre", "dicembre"
+]
+
+
+def _address(
+        rnd: random.Random
+) -> str:
+    name = rnd.choice(_NAMES)
+    return f"{name} <{name.lower().replace(' ', '.')}@example.it>"
+
+
+def _text(
+        rnd: random.Random,
+        size: int
+) -> str:
+    words, length = [], 0
+    while length < size:
+        word = rnd.choice(_WORDS)
+        words.append(word)
+        length += len(word) + 1
+    lines = [" ".join(words[i:i + 12]) for i in range(0, len(words), 12)]
+    return "\n".join(lines) + "\n"
+
+
+def _headers(
+        rnd: random.Random,
+        message: EmailMessage,
+        subject: str
+):
+    message["From"] = _address(rnd)
+    message["To"] = ", ".join(_address(rnd) for _ in range(rnd.randint(1, 3)))
+    message["Cc"] = _address(rnd)
+    message["Subject"] = subject
+    message["Date"] = format_datetime(datetime(2024, 1, 1, 9, 0) + timedelta(minutes=rnd.randint(0, 500_000)))
+
+
+def _der(
+        tag: int,
+        content: bytes
+) -> bytes:
+    length = len(content)
+    if length < 0x80:
+        return bytes([tag, length]) + content
+    size = (length.bit_length() + 7) // 8
+    return bytes([tag, 0x80 | size]) + length.to_bytes(size, "big") + content
+
+
+def signed_data(
+        content: bytes
+) -> bytes:
+    """
+        DER encoded CMS SignedData with content attached and no signer, enough to exercise p7m unwrapping
+    """
+    oid_signed_data = _der(0x06, bytes.fromhex("2a864886f70d010702"))
+    oid_data = _der(0x06, bytes.fromhex("2a864886f70d010701"))
+    encap_content_info = _der(0x30, oid_data + _der(0xA0, _der(0x04, content)))
+    signed = _der(0x30, _der(0x02, b"\x01") + _der(0x31, b"") + encap_content_info + _der(0x31, b""))
+    return _der(0x30, oid_signed_data + _der(0xA0, signed))
+
+
+def plain(
+        rnd: random.Random,
+        size: int
+) -> EmailMessage:
+    message = EmailMessage()
+    _headers(rnd, message, "Plain message")
+    message.set_content(_text(rnd, size))
+    return message
+
+
+def alternative(
+        rnd: random.Random,
+        size: int
+) -> EmailMessage:
+    message = EmailMessage()
+    _headers(rnd, message, "Alternative message")
+    text = _text(rnd, size // 2)
+    message.set_content(text)
+    message.add_alternative("<html><body><p>" + text.replace("\n", "</p><p>") + "</p></body></html>", subtype="html")
+    return message
+
+
+def nested(
+        rnd: random.Random,
+        size: int
+) -> EmailMessage:
+    inner = alternative(rnd, size // 3)
+    inner.add_attachment(
+        plain(rnd, size // 3).as_bytes(), maintype="application", subtype="octet-stream", filename="inner.eml"
+    )
+    message = alternative(rnd, size // 3)
+    message.replace_header("Subject", "Fwd: nested message")
+    message.add_attachment(inner.as_bytes(), maintype="application", subtype="octet-stream", filename="forward.eml")
+    return message
+
+
+def zipped(
+        rnd: random.Random,
+        size: int
+) -> EmailMessage:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("docs/invoice.pdf", b"%PDF-1.4\n" + rnd.randbytes(size // 2))
+        archive.writestr("docs/invoice.xml", "<fattura>" + _text(rnd, size // 4) + "</fattura>")
+        archive.writestr("readme.txt", _text(rnd, size // 4))
+    message = alternative(rnd, 1_000)
+    message.add_attachment(buffer.getvalue(), maintype="application", subtype="zip", filename="documents.zip")
+    return message
+
+
+def p7m(
+        rnd: random.Random,
+        size: int
+) -> EmailMessage:
+    invoice = ("<fattura>" + _text(rnd, size) + "</fattura>").encode()
+    message = alternative(rnd, 1_000)
+    message.add_attachment(
+        signed_data(invoice), maintype="application", subtype="pkcs7-mime", filename="IT01234567890_00001.xml.p7m"
+    )
+    return message
+
+
+def _quoted_ita(
+        rnd: random.Random,
+        when: datetime,
+        size: int
+) -> str:
+    return (
+        f"Da: {_address(rnd)}\n"
+        f"Inviato: {_WEEKDAYS_ITA[when.weekday()]} {when.day} {_MONTHS_ITA[when.month - 1]} {when.year} "
+        f"{when:%H:%M}\n"
+        f"A: {_address(rnd)}\n"
+        f"Cc: {_address(rnd)}\n"
+        f"Oggetto: R: progetto\n"
+        f"\n{_text(rnd, size)}\n"
+    )
+
+
+def _quoted_eng(
+        rnd: random.Random,
+        when: datetime,
+        size: int
+) -> str:
+    return (
+        f"From: {_address(rnd)}\n"
+        f"Sent: {when:%A, %B %d, %Y %I:%M:%S %p}\n"
+        f"To: {_address(rnd)}\n"
+        f"Cc: {_address(rnd)}\n"
+        f"Subject: RE: project\n"
+        f"\n{_text(rnd, size)}\n"
+    )
+
+
+def _thread(
+        rnd: random.Random,
+        size: int,
+        quote: Callable[[random.Random, datetime, int], str]
+) -> EmailMessage:
+    replies = max(size // 2_000, 2)
+    when = datetime(2024, 3, 1, 8, 0)
+    chunks = []
+    for _ in range(replies):
+        when -= timedelta(hours=rnd.randint(1, 48))
+        chunks.append(quote(rnd, when, size // replies))
+    message = EmailMessage()
+    _headers(rnd, message, "Re: thread")
+    message.set_content(_text(rnd, 300) + "\n" + "".join(chunks))
+    return message
+
+
+def thread_ita(
+        rnd: random.Random,
+        size: int
+) -> EmailMessage:
+    return _thread(rnd, size, _quoted_ita)
+
+
+def thread_eng(
+        rnd: random.Random,
+        size: int
+) -> EmailMessage:
+    return _thread(rnd, size, _quoted_eng)
+
+
+GENERATORS: Dict[str, Callable[[random.Random, int], EmailMessage]] = {
+    "plain": plain,
+    "alternative": alternative,
+    "nested": nested,
+    "zip": zipped,
+    "p7m": p7m,
+    "thread_ita": thread_ita,
+    "thread_eng": thread_eng,
+}
+
+
+def generate_corpus(
+        kind: str,
+        size: int,
+        count: int,
+        seed: int = 0
+) -> List[bytes]:
+    """
+        Generate a list of raw mails
+        :param kind: one of KINDS
+        :param size: approximate size in bytes of the body of every mail
+        :param count: number of mails
+        :param seed: seed of the generator, the same seed gives the same corpus
+        :return: the raw bytes of the mails
+    """
+    rnd = random.Random(f"{kind}-{size}-{seed}")
+    generator = GENERATORS[kind]
+    return [generator(rnd, size).as_bytes() for _ in range(count)]
@@ -0,0 +1,196 @@
+"""
+    Benchmark harness of the parsers.
+
+    Usage, from the root of the repository:
+        python -m benchmarks.run
+        python -m benchmarks.run --kinds plain zip --sizes small large --count 500
+        python -m benchmarks.run --json results.json
+        python -m benchmarks.run --baseline results.json --tolerance 0.15
+
+    For every benchmark, corpus kind and size it reports the throughput in msgs/sec,
+    the p50/p99 latency and the peak RSS of the process after the run.
+    With --baseline the exit status is 1 when a throughput drops more than --tolerance
+    below the one recorded in the baseline.
+"""
+import argparse
+import json
+import sys
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from benchmarks.corpus import KINDS, SIZES, generate_corpus
+from parsed.converters.toEmailMessage import ConverterToEmailMessage
+from parsed.mail.parser import parse_mail_byte
+from parsed.mail.parsing_utils import get_body
+from parsed.thread.parser import thread_from_mail, split_thread_text
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+THREAD_KINDS = ["nested", "thread_ita", "thread_eng"]
+
+
+class Benchmark(NamedTuple):
+    name: str
+    # turns the raw corpus into the inputs of run
+    prepare: Callable[[List[bytes]], List[Any]]
+    run: Callable[[Any], Any]
+    kinds: List[str]
+
+
+def _parsed(
+        corpus: List[bytes],
+        flatted: bool = False
+) -> List[Any]:
+    return [parse_mail_byte(mail, flatted=flatted) for mail in corpus]
+
+
+def _texts(
+        corpus: List[bytes]
+) -> List[str]:
+    return [get_body(mail, "text/plain") or "" for mail in _parsed(corpus)]
+
+
+_converter = ConverterToEmailMessage()
+
+BENCHMARKS = [
+    Benchmark("parse_mail_byte", list, parse_mail_byte, KINDS),
+    Benchmark("parse_mail_byte[flatted]", list, lambda mail: parse_mail_byte(mail, flatted=True), KINDS),
+    Benchmark("thread_from_mail", _parsed, thread_from_mail, THREAD_KINDS),
+    Benchmark("split_thread_text", _texts, split_thread_text, THREAD_KINDS),
+    Benchmark("ConverterToEmailMessage.convert", lambda corpus: _parsed(corpus, True), _converter.convert, KINDS),
+]
+
+
+def peak_rss() -> Optional[int]:
+    """
+        Peak resident set size of the process in bytes, None where it cannot be read
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _percentile(
+        ordered: List[int],
+        percentile: float
+) -> int:
+    index = min(int(round(percentile * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def run_benchmark(
+        benchmark: Benchmark,
+        inputs: List[Any]
+) -> Dict[str, Any]:
+    latencies, errors = [], 0
+    run = benchmark.run
+    start = time.perf_counter_ns()
+    for element in inputs:
+        begin = time.perf_counter_ns()
+        try:
+            run(element)
+        except Exception:
+            errors += 1
+        latencies.append(time.perf_counter_ns() - begin)
+    total = time.perf_counter_ns() - start
+    latencies.sort()
+    return {
+        "messages": len(inputs),
+        "errors": errors,
+        "msgs_per_sec": len(inputs) / (total / 1e9) if total else 0.0,
+        "p50_ms": _percentile(latencies, 0.50) / 1e6,
+        "p99_ms": _percentile(latencies, 0.99) / 1e6,
+        "peak_rss_mb": (peak_rss() or 0) / 2 ** 20,
+    }
+
+
+def run_all(
+        kinds: List[str],
+        sizes: List[str],
+        count: int,
+        names: Optional[List[str]] = None
+) -> List[Dict[str, Any]]:
+    results = []
+    for kind in kinds:
+        for size in sizes:
+            corpus = generate_corpus(kind, SIZES[size], count)
+            mail_bytes = sum(map(len, corpus)) // len(corpus)
+            for benchmark in BENCHMARKS:
+                if kind not in benchmark.kinds or (names and benchmark.name not in names):
+                    continue
+                result = run_benchmark(benchmark, benchmark.prepare(corpus))
+                result.update(benchmark=benchmark.name, kind=kind, size=size, mail_bytes=mail_bytes)
+                results.append(result)
+                print(_format(result), flush=True)
+    return results
+
+
+def _key(
+        result: Dict[str, Any]
+) -> str:
+    return f"{result['benchmark']}|{result['kind']}|{result['size']}"
+
+
+def _format(
+        result: Dict[str, Any]
+) -> str:
+    return (
+        f"{result['benchmark']:<34}{result['kind']:<13}{result['size']:<8}{result['mail_bytes']:>9} B"
+        f"{result['msgs_per_sec']:>11.1f} msg/s{result['p50_ms']:>9.3f} ms p50{result['p99_ms']:>9.3f} ms p99"
+        f"{result['peak_rss_mb']:>8.1f} MB rss{result['errors']:>6} err"
+    )
+
+
+def regressions(
+        results: List[Dict[str, Any]],
+        baseline: List[Dict[str, Any]],
+        tolerance: float
+) -> List[str]:
+    """
+        Compare the throughput of the results with a baseline
+        :return: a description of every benchmark slower than the baseline by more than tolerance
+    """
+    reference = {_key(result): result for result in baseline}
+    slower = []
+    for result in results:
+        previous = reference.get(_key(result))
+        if previous and result["msgs_per_sec"] < previous["msgs_per_sec"] * (1 - tolerance):
+            slower.append(
+                f"{_key(result)}: {result['msgs_per_sec']:.1f} msg/s, baseline {previous['msgs_per_sec']:.1f} msg/s"
+            )
+    return slower
+
+
+def main(
+        argv: Optional[List[str]] = None
+) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--kinds", nargs="+", choices=KINDS, default=KINDS)
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES), default=["small", "medium"])
+    parser.add_argument("--count", type=int, default=200, help="messages generated for every kind and size")
+    parser.add_argument("--benchmarks", nargs="+", choices=[b.name for b in BENCHMARKS], default=None)
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed throughput drop, 0.2 is 20%%")
+    args = parser.parse_args(argv)
+
+    results = run_all(args.kinds, args.sizes, args.count, args.benchmarks)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            slower = regressions(results, json.load(f), args.tolerance)
+        for line in slower:
+            print(f"REGRESSION {line}")
+        return 1 if slower else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
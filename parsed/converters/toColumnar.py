@@ -0,0 +1,223 @@
+"""
+    Export of parsed mails to columnar batches, for analytics tables.
+
+    With pyarrow installed the batches are pyarrow.RecordBatch and can be written to Parquet or Arrow IPC
+    files chunk by chunk, without holding the whole table in memory.
+    Without pyarrow the batches are dicts of NumPy arrays, or of lists when NumPy is missing too.
+"""
+from datetime import datetime, timezone
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Optional, Union
+
+from parsed.mail import MailObject, MailFile, EmailAddress
+from parsed.mail.model import FlattedBody
+from parsed.mail.parsing_utils import get_body
+from parsed.thread.model import MailThread
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:
+    pyarrow = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+DEFAULT_BATCH_SIZE = 10_000
+
+COLUMNS = [
+    "sender",
+    "sender_name",
+    "recipients",
+    "cc",
+    "subject",
+    "received",
+    "text_body",
+    "html_body",
+    "attachment_names",
+    "attachment_sizes",
+    "thread_id",
+]
+
+if pyarrow is not None:
+    SCHEMA = pyarrow.schema([
+        ("sender", pyarrow.string()),
+        ("sender_name", pyarrow.string()),
+        ("recipients", pyarrow.list_(pyarrow.string())),
+        ("cc", pyarrow.list_(pyarrow.string())),
+        ("subject", pyarrow.string()),
+        ("received", pyarrow.timestamp("us", tz="UTC")),
+        ("text_body", pyarrow.string()),
+        ("html_body", pyarrow.string()),
+        ("attachment_names", pyarrow.list_(pyarrow.string())),
+        ("attachment_sizes", pyarrow.list_(pyarrow.int64())),
+        ("thread_id", pyarrow.string()),
+    ])
+else:
+    SCHEMA = None
+
+MailSource = Union[MailObject, MailFile, MailThread]
+
+
+def _addresses(
+        addresses: Optional[Union[List[EmailAddress], EmailAddress]]
+) -> List[str]:
+    if addresses is None:
+        return []
+    if isinstance(addresses, EmailAddress):
+        addresses = [addresses]
+    return [address.address for address in addresses if address.address]
+
+
+def _received(
+        received: Optional[Union[datetime, str]]
+) -> Optional[datetime]:
+    if not isinstance(received, datetime):
+        return None
+    if received.tzinfo is not None:
+        return received.astimezone(timezone.utc)
+    # naive dates, as the ones read from the quoted threads, are taken as UTC
+    return received.replace(tzinfo=timezone.utc)
+
+
+def _mails(
+        mails: Iterable[MailSource]
+) -> Iterator[MailObject]:
+    for mail in mails:
+        if isinstance(mail, MailThread):
+            yield from _mails(mail.thread)
+        elif isinstance(mail, MailFile):
+            # an attached mail that could not be parsed has no row
+            if mail.parsed_obj is not None:
+                yield mail.parsed_obj
+        elif mail is not None:
+            yield mail
+
+
+class ConverterToColumnar:
+    """
+        Converts a stream of MailObject, MailFile or MailThread to columnar batches of at most batch_size rows
+
+            converter = ConverterToColumnar()
+            converter.write_parquet(iter_mbox("archive.mbox"), "mails.parquet")
+    """
+
+    def __init__(
+            self,
+            batch_size: int = DEFAULT_BATCH_SIZE
+    ):
+        """
+            :param batch_size: maximum number of rows of a batch, bounds the memory used while writing
+        """
+        self.batch_size = batch_size
+
+    @staticmethod
+    def _append(
+            columns: Dict[str, list],
+            mail: MailObject
+    ):
+        header, body = mail.header, mail.body
+        columns["sender"].append(header.From.address)
+        columns["sender_name"].append(header.From.name or None)
+        columns["recipients"].append(_addresses(header.To))
+        columns["cc"].append(_addresses(header.Cc))
+        columns["subject"].append(header.Subject)
+        columns["received"].append(_received(header.Received))
+        if isinstance(body, FlattedBody):
+            columns["text_body"].append(body.text_body or None)
+            columns["html_body"].append(body.html_body or None)
+            attachments = (body.attachments or []) + (body.inline_file or [])
+        else:
+            columns["text_body"].append(get_body(mail, "text/plain"))
+            columns["html_body"].append(get_body(mail, "text/html"))
+            attachments = body.attachments
+        columns["attachment_names"].append([attachment.filename for attachment in attachments])
+        columns["attachment_sizes"].append([attachment.size for attachment in attachments])
+        columns["thread_id"].append(None if mail.thread_id is None else str(mail.thread_id))
+
+    @staticmethod
+    def _batch(
+            columns: Dict[str, list]
+    ) -> Any:
+        if pyarrow is not None:
+            return pyarrow.RecordBatch.from_pydict(columns, schema=SCHEMA)
+        if numpy is not None:
+            batch = {}
+            for name, values in columns.items():
+                array = numpy.empty(len(values), dtype=object)
+                array[:] = values
+                batch[name] = array
+            return batch
+        return columns
+
+    def convert(
+            self,
+            mails: Iterable[MailSource]
+    ) -> Iterator[Any]:
+        """
+            Convert mails to batches, the mails are read from the iterable only as the batches are consumed
+            :param mails: MailObject, MailFile or MailThread, the mails of a thread are exported one per row
+            :return: iterator of pyarrow.RecordBatch, or of dicts of columns without pyarrow
+        """
+        columns = {name: [] for name in COLUMNS}
+        rows = 0
+        for mail in _mails(mails):
+            self._append(columns, mail)
+            rows += 1
+            if rows == self.batch_size:
+                yield self._batch(columns)
+                columns = {name: [] for name in COLUMNS}
+                rows = 0
+        if rows:
+            yield self._batch(columns)
+
+    @staticmethod
+    def _require_pyarrow():
+        if pyarrow is None:
+            raise ImportError("pyarrow is required to write Parquet and Arrow IPC files: pip install pyarrow")
+
+    def write_parquet(
+            self,
+            mails: Iterable[MailSource],
+            where: Union[str, BinaryIO],
+            **kwargs
+    ) -> int:
+        """
+            Write mails to a Parquet file, one row group per batch
+            :param mails: MailObject, MailFile or MailThread
+            :param where: path or binary file object
+            :param kwargs: options of pyarrow.parquet.ParquetWriter, as compression
+            :return: the number of rows written
+        """
+        self._require_pyarrow()
+        import pyarrow.parquet
+
+        rows = 0
+        with pyarrow.parquet.ParquetWriter(where, SCHEMA, **kwargs) as writer:
+            for batch in self.convert(mails):
+                writer.write_batch(batch)
+                rows += batch.num_rows
+        return rows
+
+    def write_ipc(
+            self,
+            mails: Iterable[MailSource],
+            where: Union[str, BinaryIO],
+            stream: bool = False
+    ) -> int:
+        """
+            Write mails to an Arrow IPC file
+            :param mails: MailObject, MailFile or MailThread
+            :param where: path or binary file object, as a socket file
+            :param stream: if True the IPC streaming format is written, readable before it is complete
+            :return: the number of rows written
+        """
+        self._require_pyarrow()
+        new_writer = pyarrow.ipc.new_stream if stream else pyarrow.ipc.new_file
+        rows = 0
+        with new_writer(where, SCHEMA) as writer:
+            for batch in self.convert(mails):
+                writer.write_batch(batch)
+                rows += batch.num_rows
+        return rows
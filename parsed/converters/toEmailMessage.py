@@ -1,23 +1,178 @@
+import base64
+import binascii
+import io
+import mimetypes
+import os
+import re
+import uuid
+from datetime import datetime
+from email import message_from_bytes
+from email.errors import HeaderParseError
 from email.headerregistry import Address
 from email.message import EmailMessage
+from email.policy import default, EmailPolicy
+from email.utils import format_datetime, formataddr
+from typing import BinaryIO, Iterable, Iterator, List, Optional, Union
 
-from parsed.mail import MailObject, EmailAddress
+from parsed.file.model import File
+from parsed.mail import MailObject, MailFile, EmailAddress, BodyParts
 from parsed.mail.model import FlattedBody
 
+# input bytes of a base64 chunk, a whole number of 76 characters lines
+BASE64_CHUNK_SIZE = 57 * 16384
+MAX_LINE_LENGTH = 998
+
+_mboxrd_from = re.compile(rb"^(>*From )", re.MULTILINE)
+_line_end = re.compile(rb"\r\n|\r|\n")
+
+MailPart = Union[BodyParts, File, MailFile, str, bytes, list]
+
+
+class _Counter:
+    """
+        Forwards the writes to a binary file object, counting the bytes
+    """
+
+    def __init__(self, fp: BinaryIO):
+        self.fp = fp
+        self.written = 0
+
+    def write(self, data: bytes):
+        self.fp.write(data)
+        self.written += len(data)
+
+
+class _MboxWriter:
+    """
+        Quotes the lines starting with ">*From " (mboxrd) of what is written, holding back the last partial line
+    """
+
+    def __init__(self, fp: BinaryIO):
+        self.fp = fp
+        self.rest = b""
+
+    def write(self, data: bytes):
+        data = self.rest + data
+        end = data.rfind(b"\n") + 1
+        self.rest = data[end:]
+        if end:
+            self.fp.write(_mboxrd_from.sub(rb">\1", data[:end]))
+
+    def close(self):
+        if self.rest:
+            self.fp.write(_mboxrd_from.sub(rb">\1", self.rest))
+            self.rest = b""
+
 
 class ConverterToEmailMessage:
+    """
+        Converts a MailObject back to a RFC 5322 message: headers, Cc and thread headers included, the
+        multipart tree of a Body or of a FlattedBody, inline files, attachments and attached mails.
+
+        write streams the message to a binary file object, as a socket file, encoding the attachments chunk
+        by chunk from File.open, so neither the message nor the encoded attachments are held in memory.
+
+            converter = ConverterToEmailMessage()
+            with open("mail.eml", "wb") as f:
+                converter.write(mail, f)
+            converter.write_mbox(iter_mbox("archive.mbox"), "copy.mbox")
+    """
+
+    def __init__(
+            self,
+            policy: EmailPolicy = default
+    ):
+        """
+            :param policy: the email policy folding the headers, its linesep ends every line
+        """
+        self.policy = policy
+        self._linesep = policy.linesep.encode()
+
+    # ----- public API
+
     def convert(self, mail: MailObject) -> EmailMessage:
-        email_message = EmailMessage()
-        email_message["To"] = self.convertAddressHeader(mail.header.To)
-        email_message["From"] = self.convertAddressHeader(mail.header.From)
-        email_message["Subject"] = mail.header.Subject
-        # email_message["Cc"] = self.convertAddressHeader(mail.header.Cc)
-        if isinstance(mail.body, FlattedBody):
-            email_message.set_content(mail.body.text_body)
-            email_message.add_alternative(mail.body.html_body)
-        else:
-            email_message.set_content(mail.body)
-        return email_message
+        """
+            Build the EmailMessage of a mail, parsing the serialized message
+        """
+        return message_from_bytes(self.to_bytes(mail), policy=self.policy)
+
+    def convert_many(
+            self,
+            mails: Iterable[Union[MailObject, MailFile]]
+    ) -> Iterator[EmailMessage]:
+        for mail in mails:
+            yield self.convert(mail.parsed_obj if isinstance(mail, MailFile) else mail)
+
+    def to_bytes(self, mail: MailObject) -> bytes:
+        buffer = io.BytesIO()
+        self._write_mail(mail, buffer)
+        return buffer.getvalue()
+
+    def write(
+            self,
+            mail: MailObject,
+            fp: BinaryIO
+    ) -> int:
+        """
+            Stream the serialized mail to a binary file object
+            :param mail: the mail
+            :param fp: the file object, only written sequentially
+            :return: the number of bytes written
+        """
+        counter = _Counter(fp)
+        self._write_mail(mail, counter)
+        return counter.written
+
+    def write_mbox(
+            self,
+            mails: Iterable[Union[MailObject, MailFile]],
+            where: Union[str, os.PathLike, BinaryIO]
+    ) -> int:
+        """
+            Write many mails to a mbox, the lines starting with "From " are quoted as mboxrd, as
+            iter_mbox_messages expects
+            :param mails: MailObject or MailFile
+            :param where: path of the mbox, appended to, or a binary file object
+            :return: the number of mails written
+        """
+        if isinstance(where, (str, os.PathLike)):
+            with open(where, "ab") as f:
+                return self.write_mbox(mails, f)
+        written = 0
+        for mail in mails:
+            if isinstance(mail, MailFile):
+                mail = mail.parsed_obj
+            sender = mail.header.From.address if mail.header.From else None
+            date = mail.header.Received if isinstance(mail.header.Received, datetime) else datetime.now()
+            where.write(f"From {sender or 'MAILER-DAEMON'} {date.strftime('%a %b %d %H:%M:%S %Y')}\n".encode())
+            writer = _MboxWriter(where)
+            self._write_mail(mail, writer)
+            writer.close()
+            where.write(b"\n")
+            written += 1
+        return written
+
+    def write_many(
+            self,
+            mails: Iterable[Union[MailObject, MailFile]],
+            directory: str,
+            name: str = "{index}.eml"
+    ) -> List[str]:
+        """
+            Write every mail to its own file
+            :param mails: MailObject or MailFile
+            :param directory: directory of the files, created if missing
+            :param name: format of the file names, with the position of the mail as index
+            :return: the paths written
+        """
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        for index, mail in enumerate(mails):
+            path = os.path.join(directory, name.format(index=index))
+            with open(path, "wb") as f:
+                self.write(mail.parsed_obj if isinstance(mail, MailFile) else mail, f)
+            paths.append(path)
+        return paths
 
     def convertAddressHeader(self, header):
         if isinstance(header, list):
@@ -28,9 +183,318 @@ class ConverterToEmailMessage:
             return self._EmailAddressToAddress(header)
 
     def _EmailAddressToAddress(self, addr: EmailAddress) -> Address:
-        username, domain = addr.address.split("@")
         return Address(
             display_name=addr.name or "",
-            username=username,
-            domain=domain
+            addr_spec=addr.address or ""
         )
+
+    # ----- headers
+
+    def _address_value(
+            self,
+            addresses: Union[List[EmailAddress], EmailAddress]
+    ) -> str:
+        if isinstance(addresses, EmailAddress):
+            addresses = [addresses]
+        values = []
+        for address in addresses:
+            if not isinstance(self.policy, EmailPolicy):
+                # compat32 would encode the address with the name, only the name is encoded
+                values.append(formataddr((address.name or "", address.address or ""), "utf-8"))
+                continue
+            try:
+                values.append(str(self._EmailAddressToAddress(address)))
+            except (HeaderParseError, ValueError, IndexError):
+                # an address the parser took but Address refuses, written as it came
+                values.append(formataddr((address.name or "", address.address or "")))
+        return ", ".join(values)
+
+    def _header(
+            self,
+            out,
+            name: str,
+            value: str
+    ):
+        if value.isascii() and len(name) + len(value) < 76 and "\n" not in value and "\r" not in value:
+            out.write(f"{name}: {value}".encode() + self._linesep)
+        elif isinstance(self.policy, EmailPolicy):
+            # the header objects encode the non ascii text as RFC 2047 encoded-words, unless the policy is utf8
+            out.write(self.policy.header_factory(name, value).fold(policy=self.policy).encode("utf-8"))
+        else:
+            out.write(self.policy.fold(name, value).encode("ascii", "surrogateescape"))
+
+    def _write_mail(
+            self,
+            mail: MailObject,
+            out
+    ):
+        header = mail.header
+        self._header(out, "From", self._address_value(header.From))
+        if header.To:
+            self._header(out, "To", self._address_value(header.To))
+        if header.Cc:
+            self._header(out, "Cc", self._address_value(header.Cc))
+        if header.Subject is not None:
+            self._header(out, "Subject", header.Subject)
+        if isinstance(header.Received, datetime):
+            self._header(out, "Date", format_datetime(header.Received))
+        elif header.Received:
+            self._header(out, "Date", header.Received)
+        if header.MessageID:
+            self._header(out, "Message-ID", f"<{header.MessageID}>")
+        if header.InReplyTo:
+            self._header(out, "In-Reply-To", f"<{header.InReplyTo}>")
+        if header.References:
+            self._header(out, "References", " ".join(f"<{reference}>" for reference in header.References))
+        self._header(out, "MIME-Version", "1.0")
+        self._write_part(self._body_tree(mail.body), out)
+
+    # ----- body tree
+
+    @staticmethod
+    def _flat(parts: Iterable) -> list:
+        flat = []
+        for part in parts or []:
+            if isinstance(part, list):
+                flat.extend(ConverterToEmailMessage._flat(part))
+            elif part is not None:
+                flat.append(part)
+        return flat
+
+    def _body_tree(
+            self,
+            body
+    ) -> MailPart:
+        """
+            The body as a tree of BodyParts and files, the multiparts as BodyParts holding a list
+        """
+        if isinstance(body, FlattedBody):
+            text = [
+                BodyParts.model_construct(content=content, content_type=content_type)
+                for content, content_type in ((body.text_body, "text/plain"), (body.html_body, "text/html"))
+                if content
+            ]
+            main = self._multipart(text, "multipart/alternative")
+            inline = self._flat(body.inline_file)
+            if inline:
+                main = self._multipart(([main] if main is not None else []) + inline, "multipart/related")
+            return self._multipart(
+                ([main] if main is not None else []) + self._attached(body.attachments),
+                "multipart/mixed"
+            ) or BodyParts.model_construct(content="", content_type="text/plain")
+        content = self._flat(body.content)
+        attachments = self._attached(body.attachments)
+        if not attachments and len(content) > 1 and all(
+                isinstance(part, BodyParts) and not isinstance(part.content, list)
+                and part.content_type in ("text/plain", "text/html") for part in content
+        ) and len({part.content_type for part in content}) == len(content):
+            # the text and html versions of a multipart/alternative message
+            return self._multipart(content, "multipart/alternative")
+        return self._multipart(content + attachments, "multipart/mixed") or BodyParts.model_construct(
+            content="", content_type="text/plain"
+        )
+
+    @staticmethod
+    def _multipart(
+            parts: list,
+            content_type: str
+    ) -> Optional[MailPart]:
+        if not parts:
+            return None
+        if len(parts) == 1:
+            return parts[0]
+        return BodyParts.model_construct(content=parts, content_type=content_type)
+
+    def _attached(
+            self,
+            attachments: Optional[list]
+    ) -> list:
+        # the attachments are told from the inline files by their place, marked while the tree is written
+        return [_Attachment(attachment) for attachment in self._flat(attachments)]
+
+    # ----- writing
+
+    def _write_part(
+            self,
+            part: MailPart,
+            out
+    ):
+        disposition = "inline"
+        if isinstance(part, _Attachment):
+            part, disposition = part.file, "attachment"
+        if isinstance(part, MailFile):
+            self._write_mail_file(part, out, disposition)
+        elif isinstance(part, File):
+            self._write_file(part, out, disposition)
+        elif isinstance(part, BodyParts) and isinstance(part.content, list):
+            self._write_multipart(part, out)
+        elif isinstance(part, BodyParts):
+            self._write_leaf(part.content, part.content_type or "text/plain", out)
+        else:
+            self._write_leaf(part, "text/plain", out)
+
+    def _write_multipart(
+            self,
+            part: BodyParts,
+            out
+    ):
+        content_type = part.content_type if (part.content_type or "").startswith("multipart/") else "multipart/mixed"
+        boundary = f"==============={uuid.uuid4().hex}=="
+        linesep = self._linesep
+        self._header(out, "Content-Type", f'{content_type}; boundary="{boundary}"')
+        out.write(linesep)
+        for child in self._flat(part.content):
+            out.write(f"--{boundary}".encode() + linesep)
+            self._write_part(child, out)
+            out.write(linesep)
+        out.write(f"--{boundary}--".encode() + linesep)
+
+    def _write_leaf(
+            self,
+            content: Optional[Union[str, bytes]],
+            content_type: str,
+            out
+    ):
+        if isinstance(content, str) or content is None:
+            self._write_text(content or "", content_type, out)
+        elif content_type.startswith("text/"):
+            try:
+                self._write_text(content.decode(), content_type, out)
+            except UnicodeDecodeError:
+                self._write_base64(content_type, None, "inline", _chunks(content), out)
+        else:
+            self._write_base64(content_type, None, "inline", _chunks(content), out)
+
+    def _write_text(
+            self,
+            text: str,
+            content_type: str,
+            out
+    ):
+        data = text.encode("utf-8", "surrogateescape")
+        lines = _line_end.split(data)
+        self._header(out, "Content-Type", f'{content_type}; charset="utf-8"')
+        if data.isascii() and all(len(line) <= MAX_LINE_LENGTH for line in lines):
+            self._header(out, "Content-Transfer-Encoding", "7bit")
+            out.write(self._linesep)
+            body = self._linesep.join(lines)
+        else:
+            self._header(out, "Content-Transfer-Encoding", "quoted-printable")
+            out.write(self._linesep)
+            body = binascii.b2a_qp(b"\n".join(lines), istext=True).replace(b"\n", self._linesep)
+        # the line break closing the text belongs to the boundary that follows
+        out.write(body)
+
+    def _content_type(
+            self,
+            file: File,
+            fallback: str = "application/octet-stream"
+    ) -> str:
+        if file.content_type and "/" in file.content_type:
+            return file.content_type
+        return mimetypes.guess_type(file.filename or "")[0] or fallback
+
+    def _disposition(
+            self,
+            out,
+            disposition: str,
+            filename: Optional[str]
+    ):
+        if filename:
+            quoted = filename.replace("\\", "\\\\").replace('"', '\\"')
+            self._header(out, "Content-Disposition", f'{disposition}; filename="{quoted}"')
+        else:
+            self._header(out, "Content-Disposition", disposition)
+
+    def _write_base64(
+            self,
+            content_type: str,
+            filename: Optional[str],
+            disposition: str,
+            chunks: Iterator[bytes],
+            out
+    ):
+        self._header(out, "Content-Type", content_type)
+        self._header(out, "Content-Transfer-Encoding", "base64")
+        self._disposition(out, disposition, filename)
+        out.write(self._linesep)
+        crlf = self._linesep != b"\n"
+        for chunk in chunks:
+            encoded = base64.encodebytes(chunk)
+            out.write(encoded.replace(b"\n", self._linesep) if crlf else encoded)
+
+    def _write_file(
+            self,
+            file: File,
+            out,
+            disposition: str
+    ):
+        content_type = self._content_type(file)
+        if content_type.lower().startswith("text/") and "charset=" not in content_type.lower() \
+                and isinstance(file.content, str):
+            # a decoded text is written as utf-8, the charset it came with no longer applies
+            content_type += '; charset="utf-8"'
+        if str(file.encoding or "").strip().lower() == "quoted-printable":
+            # kept as it came, the whole content is encoded at once
+            content = file.content
+            if isinstance(content, str):
+                content = content.encode()
+            self._header(out, "Content-Type", content_type)
+            self._header(out, "Content-Transfer-Encoding", "quoted-printable")
+            self._disposition(out, disposition, file.filename)
+            out.write(self._linesep)
+            out.write(binascii.b2a_qp(content or b"").replace(b"\n", self._linesep))
+            return
+        self._write_base64(content_type, file.filename, disposition, _file_chunks(file), out)
+
+    def _write_mail_file(
+            self,
+            file: MailFile,
+            out,
+            disposition: str
+    ):
+        if file.loaded and not file.content and file.parsed_obj is not None:
+            # only the parsed mail is left, it is serialized again
+            self._header(out, "Content-Type", "message/rfc822")
+            self._disposition(out, disposition, file.filename)
+            out.write(self._linesep)
+            self._write_mail(file.parsed_obj, out)
+            return
+        if str(file.encoding or "").strip().lower() == "base64":
+            # some clients attach the mails as encoded files, they are written as they came
+            self._write_base64("application/octet-stream", file.filename, disposition, _file_chunks(file), out)
+            return
+        self._header(out, "Content-Type", "message/rfc822")
+        self._disposition(out, disposition, file.filename)
+        out.write(self._linesep)
+        last = b""
+        for chunk in _file_chunks(file):
+            out.write(chunk)
+            last = chunk
+        if not last.endswith(b"\n"):
+            out.write(self._linesep)
+
+
+class _Attachment:
+    """
+        A file of the attachments of a body, written with the attachment disposition
+    """
+    __slots__ = ("file",)
+
+    def __init__(self, file: Union[File, MailFile]):
+        self.file = file
+
+
+def _chunks(
+        data: bytes
+) -> Iterator[bytes]:
+    for start in range(0, len(data), BASE64_CHUNK_SIZE):
+        yield data[start:start + BASE64_CHUNK_SIZE]
+
+
+def _file_chunks(
+        file: File
+) -> Iterator[bytes]:
+    with file.open() as f:
+        while chunk := f.read(BASE64_CHUNK_SIZE):
+            yield chunk
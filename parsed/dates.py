@@ -0,0 +1,233 @@
+import math
+import re
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Hashable, List, Optional, Union
+
+MONTHS = {
+    "january": ["gennaio", "janvier", "januar", "jänner", "enero", "jan"],
+    "february": ["febbraio", "février", "fevrier", "februar", "febrero", "feb"],
+    "march": ["marzo", "mars", "märz", "maerz", "mar"],
+    "april": ["aprile", "avril", "abril", "apr"],
+    "may": ["maggio", "mai", "mayo"],
+    "june": ["giugno", "juin", "juni", "junio", "jun"],
+    "july": ["luglio", "juillet", "juli", "julio", "jul"],
+    "august": ["agosto", "août", "aout", "aug"],
+    "september": ["settembre", "septembre", "septiembre", "setiembre", "sep", "sept"],
+    "october": ["ottobre", "octobre", "oktober", "octubre", "oct"],
+    "november": ["novembre", "noviembre", "nov"],
+    "december": ["dicembre", "décembre", "decembre", "dezember", "diciembre", "dec"],
+}
+
+WEEKDAYS = [
+    "monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday",
+    "mon", "tue", "wed", "thu", "fri", "sat", "sun",
+    "lunedì", "martedì", "mercoledì", "giovedì", "venerdì", "sabato", "domenica",
+    "lunedi", "martedi", "mercoledi", "giovedi", "venerdi",
+    "lundi", "mardi", "mercredi", "jeudi", "vendredi", "samedi", "dimanche",
+    "montag", "dienstag", "mittwoch", "donnerstag", "freitag", "samstag", "sonnabend", "sonntag",
+    "lunes", "martes", "miércoles", "miercoles", "jueves", "viernes", "sábado", "sabado", "domingo",
+]
+
+# words joining the pieces of a date: "4 de marzo de 2024", "4 mars 2024 à 10:15", "um 10:15 Uhr"
+CONNECTORS = ["de", "del", "à", "a", "las", "um", "uhr", "alle", "ore", "at"]
+
+# the formats tried on the normalized date, only the directives of _DIRECTIVES
+DATE_FORMATS = [
+    "%d %B %Y %H:%M",
+    "%B %d %Y %I:%M:%S %p",
+    "%B %d %Y %I:%M %p",
+    "%d %B %Y %H:%M:%S",
+    "%B %d %Y %H:%M",
+    "%B %d %Y %H:%M:%S",
+    "%d %B %Y %I:%M %p",
+    "%d %B %Y %I:%M:%S %p",
+    "%d/%m/%Y %H:%M",
+    "%d/%m/%Y %H:%M:%S",
+    "%m/%d/%Y %I:%M %p",
+    "%m/%d/%Y %I:%M:%S %p",
+    "%Y-%m-%d %H:%M",
+    "%Y-%m-%d %H:%M:%S",
+    "%d.%m.%Y %H:%M",
+    "%d %B %Y",
+    "%B %d %Y",
+]
+
+_MONTH_NUMBERS = {month: number for number, month in enumerate(MONTHS, 1)}
+
+_translation: Dict[str, str] = {
+    **{name: month for month, names in MONTHS.items() for name in names},
+    **{word: "" for word in WEEKDAYS + CONNECTORS},
+}
+
+
+def normalize_date(
+        text: str
+) -> str:
+    """
+        Translate the month names to english and drop weekdays, connectors and punctuation, word by word
+        :param text: a date as written by a mail client, in english, italian, french, german or spanish
+        :return: the normalized date, as "4 march 2024 10:15"
+    """
+    words = []
+    for word in text.replace(",", " ").split():
+        key = word.rstrip(".").lower()
+        if key in _translation:
+            word = _translation[key]
+            if not word:
+                continue
+        elif word[-1] == "." and key.isdigit():
+            # "4." of the german dates
+            word = key
+        words.append(word)
+    return " ".join(words)
+
+
+_DIRECTIVES = {
+    "d": r"(?P<day>\d{1,2})",
+    "m": r"(?P<month>\d{1,2})",
+    "B": r"(?P<month_name>[a-z]+)",
+    "Y": r"(?P<year>\d{4})",
+    "H": r"(?P<hour>\d{1,2})",
+    "I": r"(?P<hour12>\d{1,2})",
+    "M": r"(?P<minute>\d{2})",
+    "S": r"(?P<second>\d{2})",
+    "p": r"(?P<ampm>[AaPp]\.?[Mm]\.?)",
+}
+_directive = re.compile(r"%(.)")
+
+
+class DateFormat:
+    """
+        A strptime format compiled once to a regex, much faster than datetime.strptime
+    """
+
+    def __init__(
+            self,
+            _format: str
+    ):
+        self.format = _format
+        parts, last = [], 0
+        for match in _directive.finditer(_format):
+            parts.append(re.escape(_format[last:match.start()]))
+            parts.append(_DIRECTIVES[match.group(1)])
+            last = match.end()
+        parts.append(re.escape(_format[last:]))
+        self._match = re.compile("".join(parts), re.IGNORECASE).fullmatch
+
+    def parse(
+            self,
+            text: str
+    ) -> Optional[datetime]:
+        match = self._match(text)
+        if match is None:
+            return None
+        fields = match.groupdict()
+        if fields.get("month_name") is not None:
+            month = _MONTH_NUMBERS.get(fields["month_name"].lower())
+            if month is None:
+                return None
+        else:
+            month = int(fields["month"])
+        if fields.get("hour12") is not None:
+            hour = int(fields["hour12"]) % 12 + (12 if fields["ampm"][0] in "Pp" else 0)
+        else:
+            hour = int(fields.get("hour") or 0)
+        try:
+            return datetime(
+                int(fields["year"]), month, int(fields["day"]),
+                hour, int(fields.get("minute") or 0), int(fields.get("second") or 0)
+            )
+        except ValueError:
+            return None
+
+    def __repr__(self):
+        return f"DateFormat({self.format!r})"
+
+
+class DateParser:
+    """
+        Parses the dates of the quoted headers of a thread ("Inviato:", "Sent:", "Envoyé :", "Gesendet:",
+        "Enviado el:") without raising.
+
+        The format that succeeded last is remembered for every source, as the sender of the mail quoting
+        a thread, whose client wrote the quoted dates, and tried first on its next date.
+    """
+
+    def __init__(
+            self,
+            formats: Optional[List[str]] = None,
+            max_sources: int = 65_536
+    ):
+        """
+            :param formats: the candidate formats, applied to the normalized date, DATE_FORMATS if None
+            :param max_sources: number of sources remembered, the memory is emptied when it is exceeded
+        """
+        self.formats = [DateFormat(_format) for _format in formats or DATE_FORMATS]
+        self.max_sources = max_sources
+        self._last_format: Dict[Hashable, DateFormat] = {}
+
+    def parse(
+            self,
+            text: Optional[str],
+            source: Hashable = None
+    ) -> Optional[datetime]:
+        """
+            Parse a date
+            :param text: the date
+            :param source: where the date comes from, its last successful format is tried first
+            :return: the datetime, naive as written in the thread, or None if no format matches
+        """
+        if not text:
+            return None
+        normalized = normalize_date(text)
+        last = self._last_format.get(source)
+        if last is not None:
+            parsed = last.parse(normalized)
+            if parsed is not None:
+                return parsed
+        for _format in self.formats:
+            if _format is last:
+                continue
+            parsed = _format.parse(normalized)
+            if parsed is None:
+                continue
+            if len(self._last_format) >= self.max_sources:
+                self._last_format.clear()
+            self._last_format[source] = _format
+            return parsed
+        # a RFC 2822 date copied in the quote
+        try:
+            return parsedate_to_datetime(text)
+        except (TypeError, ValueError, IndexError):
+            return None
+
+
+default_date_parser = DateParser()
+
+
+def parse_date(
+        text: Optional[str],
+        source: Hashable = None
+) -> Optional[datetime]:
+    """
+        Parse a date with the shared DateParser, None if it cannot be parsed
+    """
+    return default_date_parser.parse(text, source)
+
+
+def received_timestamp(
+        received: Optional[Union[datetime, str]]
+) -> float:
+    """
+        Normalized sort key of a Received date: POSIX timestamp, the naive dates taken as UTC
+        :param received: datetime, date string as read from a quoted thread, or None
+        :return: the timestamp, math.inf for missing or unparsable dates, so that they sort last
+    """
+    if isinstance(received, str):
+        received = parse_date(received)
+    if not isinstance(received, datetime):
+        return math.inf
+    if received.tzinfo is None:
+        received = received.replace(tzinfo=timezone.utc)
+    return received.timestamp()
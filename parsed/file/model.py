@@ -1,22 +1,158 @@
+import io
 import os
+import shutil
 from abc import ABC
-from typing import Optional, Union, Any
+from typing import Optional, Union, Any, Callable, BinaryIO
 
-from pydantic import BaseModel, computed_field
+from pydantic import BaseModel, PrivateAttr, computed_field, model_serializer
+
+from parsed.file.storage import Payload, CHUNK_SIZE
+
+Content = Optional[Union[str, bytes]]
 
 
 class File(BaseModel):
+    """
+        A file, usually an attachment of a mail
+        FILENAME:
+            name of the file
+        CONTENT:
+            decoded content of the file, for a lazy file it is produced on first access and then cached
+        CONTENT_TYPE:
+            mime type of the file
+        SIZE:
+            size in bytes of the content, estimated from the encoded payload until a lazy file is loaded
+        ENCODING:
+            Content-Transfer-Encoding of the payload the file comes from
+    """
     filename: str
-    content: Optional[Union[str, bytes]] = None
+    content: Content = None
+    content_type: Optional[str] = None
+    size: Optional[int] = None
     encoding: Optional[str] = None
 
+    _loader: Optional[Callable[[], Content]] = PrivateAttr(default=None)
+    _payload: Optional[Payload] = PrivateAttr(default=None)
+    _digest: Optional[str] = PrivateAttr(default=None)
+
+    @classmethod
+    def lazy(
+            cls,
+            loader: Callable[[], Content],
+            **kwargs
+    ):
+        """
+            Build a file whose content is produced by loader on first access, the fields are not validated
+            :param loader: callable returning the content of the file
+            :return: the lazy file
+        """
+        file = cls.model_construct(**kwargs)
+        file._loader = loader
+        del file.__dict__["content"]
+        return file
+
+    @classmethod
+    def from_payload(
+            cls,
+            payload: Payload,
+            **kwargs
+    ):
+        """
+            Build a file backed by a payload, the content is read from it only on first access
+            :param payload: the decoded bytes of the file
+            :return: the file
+        """
+        file = cls.lazy(payload.read, size=payload.size, **kwargs)
+        file._payload = payload
+        return file
+
     @computed_field
     @property
     def extension(self) -> str:
         return os.path.splitext(self.filename)[-1].lower()
 
+    @property
+    def digest(self) -> Optional[str]:
+        """
+            Digest of the content in the AttachmentStore the file comes from, None if it is not stored
+        """
+        return self._digest
+
+    @property
+    def loaded(self) -> bool:
+        return self._loader is None
+
+    def defer(
+            self,
+            transform: Callable[[Content], Content]
+    ):
+        """
+            Apply transform to the content, on first access if the file is still lazy
+            :param transform: callable receiving the current content and returning the new one
+        """
+        loader = self._loader
+        if loader is None:
+            self.content = transform(self.content)
+        else:
+            self._loader = lambda: transform(loader())
+
+    def load(self) -> Content:
+        loader = self._loader
+        if loader is not None:
+            content = loader()
+            self.__dict__["content"] = content
+            self._loader = None
+            self._payload = None
+            if isinstance(content, (str, bytes)):
+                self.size = len(content)
+        return self.__dict__.get("content")
+
+    def open(self) -> BinaryIO:
+        """
+            A binary reader of the content, reading the payload without loading it while the content is untouched
+        """
+        if self._loader is not None and self._payload is not None and self._loader == self._payload.read:
+            return self._payload.open()
+        content = self.content
+        if isinstance(content, str):
+            content = content.encode()
+        return io.BytesIO(content or b"")
+
+    def write_to(
+            self,
+            fp: BinaryIO,
+            chunk_size: int = CHUNK_SIZE
+    ):
+        """
+            Copy the content to a binary file object, chunk by chunk
+        """
+        with self.open() as f:
+            shutil.copyfileobj(f, fp, chunk_size)
+
+    def __getattr__(self, item):
+        if item == "content" and self._loader is not None:
+            return self.load()
+        return super().__getattr__(item)
+
+    def __setattr__(self, name, value):
+        if name == "content":
+            self._loader = None
+            self._digest = None
+        super().__setattr__(name, value)
+
+    def __getstate__(self):
+        self.load()
+        state = super().__getstate__()
+        # the content carries the bytes, the payload may be a file of this process
+        state["__pydantic_private__"] = {**state["__pydantic_private__"], "_payload": None}
+        return state
+
+    @model_serializer(mode="wrap")
+    def _serialize(self, handler):
+        self.load()
+        return handler(self)
+
 
 class ParsableFile(File, ABC):
     parsed_obj: Any
 
-
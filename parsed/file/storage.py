@@ -0,0 +1,216 @@
+import binascii
+import io
+import os
+import shutil
+import weakref
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from contextvars import ContextVar
+from email.message import Message
+from tempfile import mkstemp
+from typing import BinaryIO, Optional, Union
+
+DEFAULT_SPILL_THRESHOLD = 8 * 2 ** 20
+CHUNK_SIZE = 2 ** 20
+
+_current_storage: ContextVar[Optional["PayloadStorage"]] = ContextVar("parsed_payload_storage", default=None)
+
+_whitespace = {ord(c): None for c in " \t\r\n"}
+
+
+def current_storage() -> Optional["PayloadStorage"]:
+    """
+        The payload storage activated in the current context, None if there is none
+    """
+    return _current_storage.get()
+
+
+class Payload(ABC):
+    """
+        The decoded bytes of an attachment, read without copying them into new bytes objects
+    """
+    size: int
+
+    @abstractmethod
+    def open(self) -> BinaryIO:
+        """
+            A binary reader of the payload
+        """
+
+    def read(self) -> bytes:
+        with self.open() as f:
+            return f.read()
+
+    def write_to(
+            self,
+            fp: BinaryIO,
+            chunk_size: int = CHUNK_SIZE
+    ):
+        """
+            Copy the payload to a binary file object, chunk by chunk
+        """
+        with self.open() as f:
+            shutil.copyfileobj(f, fp, chunk_size)
+
+    def __len__(self):
+        return self.size
+
+
+class MemoryPayload(Payload):
+    """
+        A payload held in memory, slices and readers share its buffer
+    """
+
+    def __init__(self, data: Union[bytes, bytearray, memoryview]):
+        self.data = memoryview(data)
+        self.size = self.data.nbytes
+
+    def open(self) -> BinaryIO:
+        # BytesIO shares the buffer of a bytes object until it is written
+        return io.BytesIO(self.data.obj if self.data.nbytes == len(self.data.obj) else self.data)
+
+    def read(self) -> bytes:
+        data = self.data.obj
+        if isinstance(data, bytes) and len(data) == self.size:
+            return data
+        return self.data.tobytes()
+
+    def view(
+            self,
+            start: int = 0,
+            end: Optional[int] = None
+    ) -> memoryview:
+        return self.data[start:end]
+
+    def __reduce__(self):
+        return MemoryPayload, (self.read(),)
+
+
+class TempFilePayload(Payload):
+    """
+        A payload spilled to a temporary file, removed when the payload is garbage collected
+    """
+
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.size = size
+        self._finalizer = weakref.finalize(self, _remove, path)
+
+    def open(self) -> BinaryIO:
+        return open(self.path, "rb")
+
+    def __reduce__(self):
+        # the temporary file belongs to this process, a copy carries the bytes
+        return MemoryPayload, (self.read(),)
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class _PayloadWriter:
+    """
+        Accumulates bytes in memory and moves them to a temporary file once they exceed the threshold
+    """
+
+    def __init__(self, storage: "PayloadStorage"):
+        self.storage = storage
+        self.buffer = bytearray()
+        self.file = None
+        self.path = None
+        self.size = 0
+
+    def write(self, data: bytes):
+        self.size += len(data)
+        if self.file is None:
+            self.buffer += data
+            if len(self.buffer) > self.storage.spill_threshold:
+                handle, self.path = mkstemp(prefix="parsed-", dir=self.storage.directory)
+                self.file = os.fdopen(handle, "wb")
+                self.file.write(self.buffer)
+                self.buffer = bytearray()
+        else:
+            self.file.write(data)
+
+    def close(self) -> Payload:
+        if self.file is None:
+            return MemoryPayload(bytes(self.buffer))
+        self.file.close()
+        return TempFilePayload(self.path, self.size)
+
+
+class PayloadStorage:
+    """
+        Decides where the decoded attachments live: in memory up to spill_threshold bytes,
+        in a temporary file above it.
+
+        While a storage is active (with storage.activate(): ...) the parser decodes the attachments
+        into payloads, streaming the base64 decoding, and the File objects read them on demand
+        through File.open() instead of holding a bytes copy.
+    """
+
+    def __init__(
+            self,
+            spill_threshold: int = DEFAULT_SPILL_THRESHOLD,
+            directory: Optional[str] = None
+    ):
+        """
+            :param spill_threshold: size in bytes above which a payload is moved to a temporary file
+            :param directory: directory of the temporary files, the system one if None
+        """
+        self.spill_threshold = spill_threshold
+        self.directory = directory
+
+    def store(
+            self,
+            data: Union[bytes, bytearray, memoryview, BinaryIO]
+    ) -> Payload:
+        """
+            Store bytes or the content of a binary reader
+        """
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            if len(data) <= self.spill_threshold:
+                return MemoryPayload(data)
+            data = io.BytesIO(data)
+        writer = _PayloadWriter(self)
+        while chunk := data.read(CHUNK_SIZE):
+            writer.write(chunk)
+        return writer.close()
+
+    def decode(
+            self,
+            mime: Message
+    ) -> Payload:
+        """
+            Decode the payload of a non multipart mime, base64 is decoded chunk by chunk
+        """
+        payload = mime._payload
+        if not isinstance(payload, str) or mime.get("Content-Transfer-Encoding", "").strip().lower() != "base64":
+            content = mime.get_payload(decode=True)
+            return self.store(content or b"")
+        writer = _PayloadWriter(self)
+        rest = ""
+        for start in range(0, len(payload), CHUNK_SIZE):
+            chunk = rest + payload[start:start + CHUNK_SIZE].translate(_whitespace)
+            aligned = len(chunk) - len(chunk) % 4
+            rest = chunk[aligned:]
+            if aligned:
+                writer.write(binascii.a2b_base64(chunk[:aligned]))
+        if rest:
+            # tolerate a missing padding, as the email package does
+            writer.write(binascii.a2b_base64(rest + "=" * (-len(rest) % 4)))
+        return writer.close()
+
+    @contextmanager
+    def activate(self):
+        """
+            Make this storage the one used by the parser in the current context
+        """
+        token = _current_storage.set(self)
+        try:
+            yield self
+        finally:
+            _current_storage.reset(token)
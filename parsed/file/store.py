@@ -0,0 +1,319 @@
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from email.message import Message
+from typing import Callable, Dict, List, Optional, Union
+
+from parsed.enums import FileExtension
+from parsed.file.model import File
+from parsed.file.storage import Payload, MemoryPayload
+from parsed.limits import complete, current_limits
+
+_current_store: ContextVar[Optional["AttachmentStore"]] = ContextVar("parsed_attachment_store", default=None)
+
+# a File of an expansion: filename, content_type, encoding, digest of the content, True if the content is text
+Entry = List[Union[str, bool, None]]
+
+
+def current_store() -> Optional["AttachmentStore"]:
+    """
+        The attachment store activated in the current context, None if there is none
+    """
+    return _current_store.get()
+
+
+def content_digest(
+        data: Union[bytes, bytearray, memoryview]
+) -> str:
+    return hashlib.blake2b(data, digest_size=32).hexdigest()
+
+
+class PooledPayload(MemoryPayload):
+    """
+        A payload of the in-memory pool, shared by all the files with the same content
+    """
+
+    def __init__(self, data: bytes, digest: str):
+        super().__init__(data)
+        self.digest = digest
+        self._text = None
+
+    def text(self) -> str:
+        """
+            The content decoded as utf-8, decoded once and shared as the bytes
+        """
+        if self._text is None:
+            self._text = self.read().decode()
+        return self._text
+
+    def __reduce__(self):
+        return PooledPayload, (self.read(), self.digest)
+
+
+class BlobPayload(Payload):
+    """
+        A payload kept in the blob directory of a store, named by its digest
+    """
+
+    def __init__(self, path: str, size: int, digest: str):
+        self.path = path
+        self.size = size
+        self.digest = digest
+
+    def open(self):
+        return open(self.path, "rb")
+
+
+def _signed(
+        obj: Union[File, list]
+) -> bool:
+    """
+        True if a file of an expansion is a p7m left signed
+    """
+    if isinstance(obj, list):
+        return any(_signed(element) for element in obj)
+    return obj.extension == FileExtension.P7M.value
+
+
+def _write_atomic(
+        path: str,
+        data: bytes
+):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+
+class AttachmentStore:
+    """
+        Content-addressed store of the decoded attachments.
+
+        While a store is active (with store.activate(): ...) an attachment is looked up by the digest of its
+        encoded payload and of its filename: the first time it is decoded, its archives expanded and its p7m
+        unwrapped, the next times the resulting files are rebuilt from the store without decoding anything.
+        The contents are kept once per digest, in memory or, with a directory, in one file per digest, and
+        the File objects read them through a payload carrying the digest, so identical attachments of
+        thousands of mails share one copy.
+
+        With a directory the expansions are saved too, and the store can be reopened by other processes.
+        The expansions are keyed by the active ParseLimits too. The incomplete expansions are not stored: those
+        degraded by the limits and those with a p7m left signed, as while the openssl fallback is disabled.
+        The mails attached as .eml are left to the MailCache.
+    """
+
+    def __init__(
+            self,
+            directory: Optional[str] = None
+    ):
+        """
+            :param directory: directory of the blobs and of the expansions, None to keep them in memory
+        """
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self.blobs = 0
+        self.size = 0
+        self.shared_size = 0
+        self._blobs: Dict[str, Payload] = {}
+        self._expansions: Dict[str, Union[Entry, list]] = {}
+        self._lock = threading.Lock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(
+            mime: Message,
+            filename: str,
+            context: str = ""
+    ) -> str:
+        """
+            Digest of the encoded payload of a mime, of the name that decides how it is expanded and of the
+            context of the parse that changes the expansion
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(
+            f"{filename}\0{mime.get('Content-Transfer-Encoding', '')}\0{context}\0".encode("utf-8", "surrogateescape")
+        )
+        payload = mime._payload
+        if isinstance(payload, str):
+            digest.update(payload.encode("ascii", "surrogateescape"))
+        elif isinstance(payload, bytes):
+            digest.update(payload)
+        return digest.hexdigest()
+
+    def _path(
+            self,
+            kind: str,
+            name: str
+    ) -> str:
+        return os.path.join(self.directory, kind, name[:2], name)
+
+    def _blob(
+            self,
+            digest: str
+    ) -> Optional[Payload]:
+        payload = self._blobs.get(digest)
+        if payload is None and self.directory is not None:
+            path = self._path("blobs", digest)
+            if os.path.exists(path):
+                payload = self._blobs[digest] = BlobPayload(path, os.path.getsize(path), digest)
+        return payload
+
+    def put(
+            self,
+            data: Union[bytes, bytearray, memoryview]
+    ) -> Payload:
+        """
+            Store a content, a content already in the store is not stored again
+            :return: the payload of the content, whose digest attribute names it
+        """
+        digest = content_digest(data)
+        with self._lock:
+            payload = self._blob(digest)
+            if payload is not None:
+                self.shared_size += payload.size
+                return payload
+            if self.directory is not None:
+                path = self._path("blobs", digest)
+                _write_atomic(path, data)
+                payload = BlobPayload(path, len(data), digest)
+            else:
+                payload = PooledPayload(bytes(data), digest)
+            self._blobs[digest] = payload
+            self.blobs += 1
+            self.size += payload.size
+            return payload
+
+    def get(
+            self,
+            digest: str
+    ) -> Optional[Payload]:
+        """
+            The payload of a digest, None if it is not in the store
+        """
+        with self._lock:
+            return self._blob(digest)
+
+    def _file(
+            self,
+            entry: Entry
+    ) -> Optional[File]:
+        filename, content_type, encoding, digest, text = entry
+        payload = self.get(digest)
+        if payload is None:
+            return None
+        file = File.from_payload(payload, filename=filename, content_type=content_type, encoding=encoding)
+        file._digest = digest
+        if text and isinstance(payload, PooledPayload):
+            file._loader = payload.text
+        elif text:
+            file.defer(bytes.decode)
+        return file
+
+    def _rebuild(
+            self,
+            expansion: Union[Entry, list]
+    ) -> Optional[Union[File, list]]:
+        if expansion and isinstance(expansion[0], list):
+            files = [self._rebuild(element) for element in expansion]
+            return None if any(file is None for file in files) else files
+        if not expansion:
+            return []
+        return self._file(expansion)
+
+    def _intern(
+            self,
+            obj: Union[File, list]
+    ) -> Union[Entry, list]:
+        if isinstance(obj, list):
+            return [self._intern(element) for element in obj]
+        content = obj.content
+        text = isinstance(content, str)
+        payload = self.put(content.encode() if text else content or b"")
+        return [obj.filename, obj.content_type, obj.encoding, payload.digest, text]
+
+    def _expansion(
+            self,
+            key: str
+    ) -> Optional[Union[Entry, list]]:
+        expansion = self._expansions.get(key)
+        if expansion is None and self.directory is not None:
+            try:
+                with open(self._path("expansions", key), "rb") as f:
+                    expansion = self._expansions[key] = json.loads(f.read())
+            except FileNotFoundError:
+                pass
+        return expansion
+
+    def attachment(
+            self,
+            mime: Message,
+            filename: str,
+            expand: Callable[[], Union[File, list]]
+    ) -> Union[File, list]:
+        """
+            The files of an attachment, built by expand only if the same payload was never seen
+            :param mime: the attachment mime
+            :param filename: its name
+            :param expand: decodes and expands the attachment, as flatten_attachment(mime_file(...))
+            :return: a File or the nested lists of File of the archives, backed by the store
+        """
+        key = self.key(mime, filename, self._context())
+        with self._lock:
+            expansion = self._expansion(key)
+        if expansion is not None:
+            obj = self._rebuild(expansion)
+            if obj is not None:
+                with self._lock:
+                    self.hits += 1
+                return obj
+        obj, whole = complete(expand)
+        with self._lock:
+            self.misses += 1
+        if not whole or _signed(obj):
+            # returned as it is, another context may expand it further
+            return obj
+        expansion = self._intern(obj)
+        with self._lock:
+            self._expansions[key] = expansion
+        if self.directory is not None:
+            _write_atomic(self._path("expansions", key), json.dumps(expansion).encode())
+        return self._rebuild(expansion)
+
+    @staticmethod
+    def _context() -> str:
+        limits = current_limits()
+        return "" if limits is None else repr(limits)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "blobs": self.blobs,
+            "bytes": self.size,
+            "shared_bytes": self.shared_size,
+        }
+
+    def clear(self):
+        """
+            Forget the contents and the expansions held in memory, the directory is left untouched
+        """
+        with self._lock:
+            self._blobs.clear()
+            self._expansions.clear()
+
+    @contextmanager
+    def activate(self):
+        """
+            Make this store the one used by the parser in the current context
+        """
+        token = _current_store.set(self)
+        try:
+            yield self
+        finally:
+            _current_store.reset(token)
@@ -0,0 +1,260 @@
+"""
+    Opt-in instrumentation of the parsing: time spent in every stage, bytes decoded and attachments by type.
+
+        stats = Instrumentation()
+        with stats.activate():
+            for mail in mails:
+                parse_mail_byte(mail)
+        print(stats.report())
+
+    While no Instrumentation is active the instrumented functions only test a module counter before running.
+"""
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable, Dict, Optional, Tuple, TypeVar
+
+_current_instrumentation: ContextVar[Optional["Instrumentation"]] = ContextVar(
+    "parsed_instrumentation", default=None
+)
+# number of Instrumentation active in any context, 0 keeps the instrumented functions on their fast path
+_active = 0
+_active_lock = threading.Lock()
+
+F = TypeVar("F", bound=Callable)
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def current_instrumentation() -> Optional["Instrumentation"]:
+    """
+        The instrumentation activated in the current context, None if there is none
+    """
+    if not _active:
+        return None
+    return _current_instrumentation.get()
+
+
+class StageStats:
+    """
+        Calls and time of a stage; the time of a stage includes the stages it calls, a stage running inside
+        itself, as the parsing of an attached mail, is timed once
+    """
+    __slots__ = ("calls", "wall", "cpu")
+
+    def __init__(self):
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+
+    def __repr__(self):
+        return f"StageStats(calls={self.calls}, wall={self.wall:.6f}, cpu={self.cpu:.6f})"
+
+
+class Instrumentation:
+    """
+        Aggregates the stats of the parses run while it is active (with stats.activate(): ...).
+
+        Stages: message_from_bytes, parse_mail_header, mime_content, parse_mail_message, build_models,
+        unzip_attachments, extract_p7m, unwrap_p7m, thread_from_mail, thread_from_string.
+        Counters: bytes_decoded, attachments{extension}, limits_exceeded{limit}.
+
+        The stats can also be forwarded as they are recorded, with on_stage(stage, wall, cpu) and
+        on_count(name, value, labels), and exported in the Prometheus text format with to_prometheus().
+        The parses run in the processes of parse_mails are not seen, merge() joins the stats gathered elsewhere.
+    """
+
+    def __init__(
+            self,
+            on_stage: Optional[Callable[[str, float, float], None]] = None,
+            on_count: Optional[Callable[[str, float, Dict[str, str]], None]] = None
+    ):
+        """
+            :param on_stage: called at the end of every stage with its name, wall time and cpu time in seconds
+            :param on_count: called on every counter increment with the counter name, the increment and the labels
+        """
+        self.on_stage = on_stage
+        self.on_count = on_count
+        self.stages: Dict[str, StageStats] = defaultdict(StageStats)
+        self.counters: Dict[Tuple[str, Labels], float] = defaultdict(float)
+        self._lock = threading.Lock()
+        # stages running in the current thread, a recursive stage is timed by its outer call
+        self._running = threading.local()
+
+    def _enter(
+            self,
+            stage: str
+    ) -> bool:
+        running = self._running.__dict__.setdefault("stages", defaultdict(int))
+        running[stage] += 1
+        return running[stage] == 1
+
+    def _exit(
+            self,
+            stage: str
+    ):
+        self._running.stages[stage] -= 1
+
+    def add_stage(
+            self,
+            stage: str,
+            wall: float,
+            cpu: float,
+            timed: bool = True
+    ):
+        with self._lock:
+            stats = self.stages[stage]
+            stats.calls += 1
+            if timed:
+                stats.wall += wall
+                stats.cpu += cpu
+        if self.on_stage is not None:
+            self.on_stage(stage, wall, cpu)
+
+    def count(
+            self,
+            name: str,
+            value: float = 1,
+            **labels: str
+    ):
+        with self._lock:
+            self.counters[name, tuple(sorted(labels.items()))] += value
+        if self.on_count is not None:
+            self.on_count(name, value, labels)
+
+    def counter(
+            self,
+            name: str,
+            **labels: str
+    ) -> float:
+        """
+            Value of a counter, the sum over all its labels when none are given
+        """
+        if labels:
+            return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+        return sum(value for (counter, _), value in self.counters.items() if counter == name)
+
+    def merge(
+            self,
+            other: "Instrumentation"
+    ):
+        """
+            Add the stats of another Instrumentation, as one filled in a worker process and pickled back
+        """
+        with self._lock:
+            for stage, stats in other.stages.items():
+                mine = self.stages[stage]
+                mine.calls += stats.calls
+                mine.wall += stats.wall
+                mine.cpu += stats.cpu
+            for key, value in other.counters.items():
+                self.counters[key] += value
+
+    def reset(self):
+        with self._lock:
+            self.stages.clear()
+            self.counters.clear()
+
+    def report(self) -> str:
+        """
+            The stages by decreasing wall time and the counters, as a text table
+        """
+        lines = [f"{'stage':<22}{'calls':>10}{'wall s':>12}{'cpu s':>12}"]
+        for stage, stats in sorted(self.stages.items(), key=lambda item: -item[1].wall):
+            lines.append(f"{stage:<22}{stats.calls:>10}{stats.wall:>12.4f}{stats.cpu:>12.4f}")
+        for (name, labels), value in sorted(self.counters.items()):
+            label = ",".join(f"{key}={value}" for key, value in labels)
+            lines.append(f"{name}{{{label}}} {value:g}" if label else f"{name} {value:g}")
+        return "\n".join(lines)
+
+    def to_prometheus(
+            self,
+            prefix: str = "parsed_"
+    ) -> str:
+        """
+            The stats in the Prometheus text exposition format
+        """
+        lines = []
+        for metric, attribute in (("stage_calls_total", "calls"), ("stage_wall_seconds_total", "wall"),
+                                  ("stage_cpu_seconds_total", "cpu")):
+            lines.append(f"# TYPE {prefix}{metric} counter")
+            for stage, stats in sorted(self.stages.items()):
+                lines.append(f'{prefix}{metric}{{stage="{stage}"}} {getattr(stats, attribute):g}')
+        names = sorted({name for name, _ in self.counters})
+        for name in names:
+            lines.append(f"# TYPE {prefix}{name}_total counter")
+            for (counter, labels), value in sorted(self.counters.items()):
+                if counter != name:
+                    continue
+                label = ",".join(f'{key}="{value}"' for key, value in labels)
+                lines.append(f"{prefix}{name}_total{{{label}}} {value:g}" if label else f"{prefix}{name}_total {value:g}")
+        return "\n".join(lines) + "\n"
+
+    @contextmanager
+    def activate(self):
+        """
+            Record the stats of the parses run in the current context
+        """
+        global _active
+        with _active_lock:
+            _active += 1
+        token = _current_instrumentation.set(self)
+        try:
+            yield self
+        finally:
+            _current_instrumentation.reset(token)
+            with _active_lock:
+                _active -= 1
+
+    def __getstate__(self):
+        return {"stages": dict(self.stages), "counters": dict(self.counters)}
+
+    def __setstate__(self, state):
+        self.__init__()
+        self.stages.update(state["stages"])
+        self.counters.update(state["counters"])
+
+
+def stage(
+        name: str
+) -> Callable[[F], F]:
+    """
+        Decorator timing a function as a stage of the active Instrumentation
+    """
+
+    def decorator(func: F) -> F:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _active:
+                return func(*args, **kwargs)
+            instrumentation = _current_instrumentation.get()
+            if instrumentation is None:
+                return func(*args, **kwargs)
+            outer = instrumentation._enter(name)
+            wall, cpu = time.perf_counter(), time.thread_time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                instrumentation._exit(name)
+                instrumentation.add_stage(name, time.perf_counter() - wall, time.thread_time() - cpu, outer)
+
+        return wrapper
+
+    return decorator
+
+
+def count(
+        name: str,
+        value: float = 1,
+        **labels: str
+):
+    """
+        Increment a counter of the active Instrumentation, if any
+    """
+    if not _active:
+        return
+    instrumentation = _current_instrumentation.get()
+    if instrumentation is not None:
+        instrumentation.count(name, value, **labels)
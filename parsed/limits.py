@@ -0,0 +1,285 @@
+"""
+    Limits on the resources a single mail may take while it is parsed, so a few hostile or broken messages
+    cannot stall a worker.
+
+        limits = ParseLimits(max_parts=1_000, subprocess_timeout=5)
+        with limits.activate():
+            mail = parse_mail_byte(mail_byte)
+
+    Every parse run while limits are active draws from a ParseBudget, shared by the mail and by the mails and
+    archives attached to it. The MIME tree is checked before anything is decoded, so a mail with too many or too
+    deeply nested parts is rejected at the cost of a walk of its parts.
+
+    A limit exceeded raises a LimitExceeded subclass. With strict=False the parse degrades instead: the parts past
+    the limits are dropped, the archives and the attached mails past them are kept unexpanded, the attachments
+    found once the decoded bytes are spent are left lazy and the p7m whose unwrapping times out are left signed.
+    Every degradation is counted as limits_exceeded{limit} by the active Instrumentation, and a degraded result
+    is not stored by the MailCache or by the AttachmentStore.
+
+    The limits active around parse_mail_bytes and parse_mails_async apply to the parses they run in threads
+    and in processes, and to the openssl subprocesses they await; parse_mails takes them as an argument.
+"""
+import copy
+from contextlib import contextmanager
+from contextvars import ContextVar
+from email.message import Message
+from typing import Callable, Iterator, Optional, Tuple, TypeVar
+
+from parsed.instrumentation import count
+from parsed.mail.exceptions import LimitExceeded, MimeDepthExceeded, PartLimitExceeded, DecodedSizeExceeded, \
+    AttachmentDepthExceeded
+
+MAX_MIME_DEPTH = 50
+MAX_PARTS = 10_000
+MAX_DECODED_BYTES = 1 << 30
+MAX_ATTACHMENT_DEPTH = 8
+MAX_ARCHIVE_MEMBERS = 10_000
+MAX_ARCHIVE_SIZE = 1 << 30
+MAX_ZIP_RATIO = 250
+SUBPROCESS_TIMEOUT = 30.0
+
+_current_limits: ContextVar[Optional["ParseLimits"]] = ContextVar("parsed_limits", default=None)
+_current_budget: ContextVar[Optional["ParseBudget"]] = ContextVar("parsed_budget", default=None)
+
+T = TypeVar("T")
+
+
+def current_limits() -> Optional["ParseLimits"]:
+    """
+        The limits activated in the current context, None if there are none
+    """
+    return _current_limits.get()
+
+
+def current_budget() -> Optional["ParseBudget"]:
+    """
+        The budget of the parse running in the current context, None if no limits are active
+    """
+    return _current_budget.get()
+
+
+def exceeded(
+        error: LimitExceeded
+):
+    """
+        Raise error, unless the limits active in the current context degrade gracefully: the degradation is then
+        counted and the caller goes on with its fallback
+    """
+    limits = current_limits()
+    if limits is None or limits.strict:
+        raise error
+    budget = _current_budget.get()
+    if budget is not None:
+        budget.degraded += 1
+    count("limits_exceeded", limit=error.limit)
+
+
+def complete(
+        parse: Callable[[], T]
+) -> Tuple[T, bool]:
+    """
+        Run parse within the budget of the current parse, or of a new one
+        :param parse: callable parsing a mail or expanding an attachment
+        :return: its result and False if a limit degraded it, a degraded result must not be cached
+    """
+    limits = current_limits()
+    if limits is None:
+        return parse(), True
+    with limits.budget() as budget:
+        degraded = budget.degraded
+        result = parse()
+        return result, budget.degraded == degraded
+
+
+class ParseLimits:
+    """
+        Limits of the parses run while they are active (with limits.activate(): ...), None disables a limit.
+        The parses run in the processes of parse_mails are bound by its limits argument.
+    """
+
+    def __init__(
+            self,
+            max_mime_depth: Optional[int] = MAX_MIME_DEPTH,
+            max_parts: Optional[int] = MAX_PARTS,
+            max_decoded_bytes: Optional[int] = MAX_DECODED_BYTES,
+            max_attachment_depth: Optional[int] = MAX_ATTACHMENT_DEPTH,
+            max_archive_members: Optional[int] = MAX_ARCHIVE_MEMBERS,
+            max_archive_size: Optional[int] = MAX_ARCHIVE_SIZE,
+            max_zip_ratio: Optional[float] = MAX_ZIP_RATIO,
+            subprocess_timeout: Optional[float] = SUBPROCESS_TIMEOUT,
+            strict: bool = True
+    ):
+        """
+            :param max_mime_depth: maximum nesting of the multipart parts of a mail
+            :param max_parts: maximum number of MIME parts of a mail, its attached mails included
+            :param max_decoded_bytes: maximum bytes decoded while parsing a mail, its attachments included
+            :param max_attachment_depth: maximum nesting of attached mails and archives
+            :param max_archive_members: maximum number of members of an archive, nested archives included
+            :param max_archive_size: maximum uncompressed size of an archive, nested archives included
+            :param max_zip_ratio: maximum ratio between the uncompressed and the compressed size of the archive
+                members larger than 1 MiB
+            :param subprocess_timeout: seconds given to openssl to unwrap a p7m
+            :param strict: if True a limit exceeded raises a LimitExceeded, otherwise the parse degrades
+        """
+        self.max_mime_depth = max_mime_depth
+        self.max_parts = max_parts
+        self.max_decoded_bytes = max_decoded_bytes
+        self.max_attachment_depth = max_attachment_depth
+        self.max_archive_members = max_archive_members
+        self.max_archive_size = max_archive_size
+        self.max_zip_ratio = max_zip_ratio
+        self.subprocess_timeout = subprocess_timeout
+        self.strict = strict
+
+    @contextmanager
+    def budget(self) -> Iterator["ParseBudget"]:
+        """
+            The budget of the parse running in the current context, a new one if the parse is not nested in another
+        """
+        budget = _current_budget.get()
+        if budget is not None and budget.limits is self:
+            yield budget
+            return
+        budget = ParseBudget(self)
+        with budget.activate():
+            yield budget
+
+    @contextmanager
+    def activate(self):
+        """
+            Bound the parses run in the current context by these limits
+        """
+        token = _current_limits.set(self)
+        try:
+            yield self
+        finally:
+            _current_limits.reset(token)
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={value!r}" for name, value in vars(self).items())
+        return f"ParseLimits({fields})"
+
+
+def _pruned(
+        mime: Message,
+        parts: list
+) -> Message:
+    """
+        A copy of a multipart mime with other parts, the mime given is left untouched
+    """
+    pruned = copy.copy(mime)
+    pruned._payload = parts
+    return pruned
+
+
+class ParseBudget:
+    """
+        The resources taken so far by a parse and by the parses of its attachments
+    """
+
+    def __init__(
+            self,
+            limits: ParseLimits
+    ):
+        self.limits = limits
+        self.parts = 0
+        self.decoded = 0
+        self.attachment_depth = 0
+        # limits exceeded without raising, the results parsed meanwhile are incomplete
+        self.degraded = 0
+
+    def check(
+            self,
+            mime: Message
+    ) -> Message:
+        """
+            Count the parts of a mail and check their nesting, before anything is decoded
+            :param mime: the mail
+            :return: the mail, or a copy without the parts past the limits when they degrade
+        """
+        try:
+            return self._visit(mime, 0)
+        except RecursionError as e:
+            raise MimeDepthExceeded("mime parts nested deeper than the recursion limit") from e
+
+    def _visit(
+            self,
+            mime: Message,
+            depth: int
+    ) -> Message:
+        self.parts += 1
+        # the attachments of the mail are parsed on their own, as the parser does
+        if not mime.is_multipart() or (depth == 1 and (mime.get_content_disposition() == "attachment"
+                                                       or mime.get_filename())):
+            return mime
+        limits = self.limits
+        if limits.max_mime_depth is not None and depth >= limits.max_mime_depth:
+            exceeded(MimeDepthExceeded(f"mime parts nested more than {limits.max_mime_depth} levels"))
+            return _pruned(mime, [])
+        parts = []
+        for part in mime._payload:
+            if limits.max_parts is not None and self.parts >= limits.max_parts:
+                exceeded(PartLimitExceeded(f"mail has more than {limits.max_parts} parts"))
+                return _pruned(mime, parts)
+            parts.append(self._visit(part, depth + 1))
+        if all(visited is part for visited, part in zip(parts, mime._payload)):
+            return mime
+        return _pruned(mime, parts)
+
+    def decode(
+            self,
+            size: int
+    ):
+        """
+            Take the bytes about to be decoded
+        """
+        self.decoded += size
+        self.exhausted()
+
+    def exhausted(self) -> bool:
+        """
+            True when the bytes decoded are past the limit, the files are then decoded only if read
+        """
+        max_bytes = self.limits.max_decoded_bytes
+        if max_bytes is None or self.decoded <= max_bytes:
+            return False
+        exceeded(DecodedSizeExceeded(f"mail decodes to more than {max_bytes} bytes"))
+        return True
+
+    @contextmanager
+    def nested(self) -> Iterator[bool]:
+        """
+            Enter an attached mail or an archive, yields False if it must be kept unexpanded
+        """
+        max_depth = self.limits.max_attachment_depth
+        if max_depth is not None and self.attachment_depth >= max_depth:
+            exceeded(AttachmentDepthExceeded(f"attachments nested more than {max_depth} levels"))
+            yield False
+            return
+        self.attachment_depth += 1
+        try:
+            yield True
+        finally:
+            self.attachment_depth -= 1
+
+    @contextmanager
+    def activate(self):
+        token = _current_budget.set(self)
+        try:
+            yield self
+        finally:
+            _current_budget.reset(token)
+
+
+@contextmanager
+def nested_attachment() -> Iterator[bool]:
+    """
+        Enter an attached mail or an archive in the budget of the current parse, if any,
+        yields False if it must be kept unexpanded
+    """
+    budget = _current_budget.get()
+    if budget is None:
+        yield True
+        return
+    with budget.nested() as expand:
+        yield expand
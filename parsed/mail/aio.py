@@ -0,0 +1,346 @@
+"""
+    Asyncio API of the parser, the parsing runs in an executor and the openssl calls in awaited subprocesses.
+
+    With a thread executor, as the default one of the loop, a parse runs in a copy of the calling context:
+    the ParseLimits, MailCache, Instrumentation, PayloadStorage and AttachmentStore active around the call
+    apply to it as to a synchronous parse. A ProcessPoolExecutor sees only the arguments it is given: the
+    limits and the cache arguments, by default the ones active in the calling context, are carried over, the
+    cache being looked up and filled in the calling process; the Instrumentation, PayloadStorage and
+    AttachmentStore active in the calling context do not apply to the parses run in the processes.
+"""
+import asyncio
+import contextvars
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import nullcontext
+from email.policy import default, EmailPolicy
+from functools import partial
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, Iterable, List, Optional, Tuple, Union
+
+from parsed.enums import FileExtension
+from parsed.file.model import File
+from parsed.limits import ParseLimits, complete, current_limits, exceeded
+from parsed.mail.batch import MailResult, MailSource, _parse_source, _source_path
+from parsed.mail.cache import MailCache, current_cache
+from parsed.mail.exceptions import SubprocessTimeout
+from parsed.mail.model import Body, FlattedBody, MailFile, MailObject
+from parsed.mail.parser import parse_mail_byte
+from parsed.mail.parsing_utils import flatten_attachment
+from parsed.pkcs7 import signed_content, PKCS7Error
+from parsed.utils import OPENSSL_UNWRAP_COMMAND, openssl_fallback
+
+DEFAULT_CONCURRENCY = 64
+
+
+async def unwrap_p7m_async(
+        content: bytes
+) -> bytes:
+    """
+        Extract the signed content of a p7m, in process when possible and with an openssl
+        subprocess, awaited without blocking the loop, otherwise
+        :param content: the p7m content
+        :return: the signed content
+        :raise PKCS7Error: if the p7m can be unwrapped neither in process nor with openssl
+        :raise SubprocessTimeout: if openssl runs past the subprocess_timeout of the active ParseLimits
+    """
+    try:
+        return signed_content(content)
+    except PKCS7Error:
+        pass
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *OPENSSL_UNWRAP_COMMAND,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+    except OSError as e:
+        raise PKCS7Error(f"openssl cannot be run: {e}") from e
+    limits = current_limits()
+    timeout = limits.subprocess_timeout if limits is not None else None
+    try:
+        out, err = await asyncio.wait_for(process.communicate(content), timeout)
+    except asyncio.TimeoutError as e:
+        process.kill()
+        await process.wait()
+        raise SubprocessTimeout(f"openssl did not unwrap the p7m in {timeout} seconds") from e
+    if process.returncode:
+        raise PKCS7Error(f"openssl failed to unwrap the p7m: {err.decode(errors='replace').strip()}")
+    return out
+
+
+def _isolated(
+        function: Callable,
+        *args
+):
+    # a forked worker starts with the context of the process at fork time, the activations of then must not apply
+    return contextvars.Context().run(function, *args)
+
+
+def _run(
+        loop: asyncio.AbstractEventLoop,
+        executor: Optional[Executor],
+        function: Callable,
+        *args
+) -> Awaitable:
+    """
+        Run function in executor, in a thread with a copy of the calling context, in a process with its arguments only
+    """
+    if isinstance(executor, ProcessPoolExecutor):
+        return loop.run_in_executor(executor, partial(_isolated, function, *args))
+    return loop.run_in_executor(executor, partial(contextvars.copy_context().run, function, *args))
+
+
+def _activated(
+        resource: Optional[Union[ParseLimits, MailCache]]
+):
+    return resource.activate() if resource is not None else nullcontext()
+
+
+def _parse_without_openssl(
+        mail_byte: bytes,
+        policy: EmailPolicy,
+        kwargs: dict,
+        limits: Optional[ParseLimits],
+        cache: Optional[MailCache]
+) -> Optional[MailObject]:
+    with openssl_fallback(False), _activated(limits), _activated(cache):
+        return parse_mail_byte(mail_byte, policy=policy, **kwargs)
+
+
+def _parse_complete(
+        mail_byte: bytes,
+        policy: EmailPolicy,
+        kwargs: dict,
+        limits: Optional[ParseLimits]
+) -> Tuple[Optional[MailObject], bool]:
+    with openssl_fallback(False), _activated(limits):
+        return complete(partial(parse_mail_byte, mail_byte, policy=policy, **kwargs))
+
+
+def _parse_source_without_openssl(
+        index: int,
+        source: MailSource,
+        policy: EmailPolicy,
+        kwargs: dict,
+        limits: Optional[ParseLimits],
+        cache: Optional[MailCache]
+) -> MailResult:
+    with openssl_fallback(False), _activated(cache):
+        return _parse_source(index, source, policy, False, kwargs, limits)
+
+
+def _read(
+        path: str
+) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+async def _parse(
+        mail_byte: bytes,
+        loop: asyncio.AbstractEventLoop,
+        executor: Optional[Executor],
+        policy: EmailPolicy,
+        kwargs: dict,
+        limits: Optional[ParseLimits],
+        cache: Optional[MailCache]
+) -> Optional[MailObject]:
+    if not isinstance(executor, ProcessPoolExecutor):
+        return await _run(loop, executor, _parse_without_openssl, mail_byte, policy, kwargs, limits, cache)
+    if cache is None:
+        mail, _ = await _run(loop, executor, _parse_complete, mail_byte, policy, kwargs, limits)
+        return mail
+    # the processes do not share the cache, it is used here with the key the parser would compute
+    with openssl_fallback(False), _activated(limits):
+        key = cache.context_key(mail_byte, policy, **kwargs)
+    mail = cache.get(key)
+    if mail is None:
+        mail, whole = await _run(loop, executor, _parse_complete, mail_byte, policy, kwargs, limits)
+        if mail is not None and whole:
+            cache.put(key, mail)
+    return mail
+
+
+async def _unwrap_signed(
+        files: List[Union[File, MailFile]],
+        loop: asyncio.AbstractEventLoop,
+        executor: Optional[Executor]
+):
+    unwrapped = []
+    for file in files:
+        if isinstance(file, MailFile):
+            await _unwrap_mail(file.parsed_obj, loop, executor)
+        elif file.extension == FileExtension.P7M.value and file.loaded:
+            try:
+                content = await unwrap_p7m_async(file.content)
+            except PKCS7Error:
+                # left signed, as extract_p7m does
+                unwrapped.append(file)
+                continue
+            except SubprocessTimeout as e:
+                exceeded(e)
+                unwrapped.append(file)
+                continue
+            file.content = content
+            file.size = len(file.content)
+            file.filename = file.filename[:-len(FileExtension.P7M.value)]
+            # the signed content may be an archive or an xml to decode
+            file = await _run(loop, executor, flatten_attachment, file)
+        if isinstance(file, list):
+            unwrapped.extend(file)
+        else:
+            unwrapped.append(file)
+    files[:] = unwrapped
+
+
+async def _unwrap_mail(
+        mail: Optional[MailObject],
+        loop: asyncio.AbstractEventLoop,
+        executor: Optional[Executor]
+):
+    """
+        Unwrap with openssl subprocesses the p7m attachments the parser left signed
+    """
+    if mail is None:
+        return
+    if isinstance(mail.body, FlattedBody):
+        await _unwrap_signed(mail.body.attachments or [], loop, executor)
+        await _unwrap_signed(mail.body.inline_file or [], loop, executor)
+    elif isinstance(mail.body, Body):
+        await _unwrap_signed(mail.body.attachments, loop, executor)
+
+
+async def parse_mail_bytes(
+        mail_byte: bytes,
+        executor: Optional[Executor] = None,
+        semaphore: Optional[asyncio.Semaphore] = None,
+        policy: EmailPolicy = default,
+        limits: Optional[ParseLimits] = None,
+        cache: Optional[MailCache] = None,
+        **kwargs
+) -> Optional[MailObject]:
+    """
+        Parse a mime mail byte without blocking the event loop
+        :param mail_byte: the mail byte to parse
+        :param executor: executor running the parsing, the default executor of the loop if None;
+            a ProcessPoolExecutor spreads the parsing over the cores
+        :param semaphore: if given, the parsing waits for a slot of it, bounding the messages parsed at once
+        :param policy: an email policy
+        :param limits: the ParseLimits of the parse, the ones active in the calling context if None
+        :param cache: the MailCache of the parse, the one active in the calling context if None
+        :return: a MailObject or None
+
+        The p7m attachments that cannot be unwrapped in process are unwrapped with
+        asyncio.create_subprocess_exec instead of a blocking openssl call, those openssl fails on are left signed.
+    """
+    loop = asyncio.get_running_loop()
+    limits = limits if limits is not None else current_limits()
+    cache = cache if cache is not None else current_cache()
+    async with semaphore or nullcontext():
+        mail = await _parse(mail_byte, loop, executor, policy, kwargs, limits, cache)
+        with _activated(limits):
+            await _unwrap_mail(mail, loop, executor)
+    return mail
+
+
+async def _parse_result(
+        index: int,
+        source: MailSource,
+        executor: Optional[Executor],
+        policy: EmailPolicy,
+        kwargs: dict,
+        limits: Optional[ParseLimits],
+        cache: Optional[MailCache]
+) -> MailResult:
+    loop = asyncio.get_running_loop()
+    if cache is not None and isinstance(executor, ProcessPoolExecutor):
+        # the mail is keyed in the calling process, so the paths are read here
+        path = None
+        try:
+            path = _source_path(source)
+            mail_byte = bytes(source) if path is None else await loop.run_in_executor(None, _read, path)
+            result = MailResult(index=index, source=path,
+                                mail=await _parse(mail_byte, loop, executor, policy, kwargs, limits, cache))
+        except Exception as e:
+            return MailResult(index=index, source=path, error=e)
+    else:
+        result = await _run(loop, executor, _parse_source_without_openssl, index, source, policy, kwargs, limits,
+                            cache)
+    try:
+        with _activated(limits):
+            await _unwrap_mail(result.mail, loop, executor)
+    except Exception as e:
+        return MailResult(index=index, source=result.source, error=e)
+    return result
+
+
+async def _iterate(
+        mails: Union[Iterable[MailSource], AsyncIterable[MailSource]]
+) -> AsyncIterator[MailSource]:
+    if isinstance(mails, AsyncIterable):
+        async for mail in mails:
+            yield mail
+    else:
+        for mail in mails:
+            yield mail
+
+
+async def _completed(
+        pending: deque,
+        ordered: bool
+) -> AsyncIterator[MailResult]:
+    if ordered:
+        yield await pending.popleft()
+        return
+    done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+    for task in done:
+        pending.remove(task)
+        yield task.result()
+
+
+async def parse_mails_async(
+        mails: Union[Iterable[MailSource], AsyncIterable[MailSource]],
+        concurrency: int = DEFAULT_CONCURRENCY,
+        executor: Optional[Executor] = None,
+        flatted: bool = False,
+        ordered: bool = False,
+        policy: EmailPolicy = default,
+        limits: Optional[ParseLimits] = None,
+        cache: Optional[MailCache] = None,
+        **kwargs
+) -> AsyncIterator[MailResult]:
+    """
+        Parse a stream of mails without blocking the event loop
+        :param mails: iterable or async iterable of raw mail bytes or of paths
+        :param concurrency: maximum number of messages in flight, the source is not pulled while it is reached
+        :param executor: executor running the parsing, the default executor of the loop if None
+        :param flatted: Boolean indicating if the MailObjects created must be flatted or in full depths
+        :param ordered: if True the results are yielded in input order, otherwise as soon as they are ready
+        :param policy: an email policy
+        :param limits: the ParseLimits of every parse, the ones active in the calling context if None
+        :param cache: the MailCache of every parse, the one active in the calling context if None;
+            with a ProcessPoolExecutor the paths are then read in the calling process, to key the mails
+        :return: an async iterator of MailResult, one for every input message
+
+        As in parsed.mail.batch.parse_mails a failing message does not stop the stream,
+        its exception is reported in the error field of its MailResult.
+    """
+    kwargs["flatted"] = flatted
+    limits = limits if limits is not None else current_limits()
+    cache = cache if cache is not None else current_cache()
+    pending = deque()
+    index = 0
+    try:
+        async for source in _iterate(mails):
+            pending.append(asyncio.ensure_future(_parse_result(index, source, executor, policy, kwargs, limits, cache)))
+            index += 1
+            while len(pending) >= concurrency:
+                async for result in _completed(pending, ordered):
+                    yield result
+        while pending:
+            async for result in _completed(pending, ordered):
+                yield result
+    finally:
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,188 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, Future, FIRST_COMPLETED, wait
+from contextlib import nullcontext
+from email.policy import default, EmailPolicy
+from typing import Iterable, Iterator, Optional, Union, Tuple
+
+from pydantic import BaseModel, ConfigDict
+
+from parsed.limits import ParseLimits
+from parsed.mail.model import MailObject, Header
+from parsed.mail.parser import parse_mail_byte, parse_mail_header_byte, parse_mail_header_file
+
+MailSource = Union[str, os.PathLike, bytes, bytearray, memoryview]
+
+
+class MailResult(BaseModel):
+    """
+        Outcome of the parsing of a single message of a batch
+        INDEX:
+            position of the message in the input iterable
+        SOURCE:
+            path of the message, None when raw bytes were given
+        MAIL:
+            the parsed MailObject, None when the parsing failed or only the headers were requested
+        HEADER:
+            the parsed Header when only the headers were requested
+        ERROR:
+            the exception raised while parsing (HeaderDefect, ...), None on success
+    """
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    index: int
+    source: Optional[str] = None
+    mail: Optional[MailObject] = None
+    header: Optional[Header] = None
+    error: Optional[Exception] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def _source_path(
+        source: MailSource
+) -> Optional[str]:
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return None
+    return os.fspath(source)
+
+
+def _parse_source(
+        index: int,
+        source: MailSource,
+        policy: EmailPolicy,
+        headers_only: bool,
+        kwargs: dict,
+        limits: Optional[ParseLimits] = None
+) -> MailResult:
+    path = None
+    try:
+        path = _source_path(source)
+        if headers_only:
+            if path is None:
+                header = parse_mail_header_byte(bytes(source), policy=policy)
+            else:
+                header = parse_mail_header_file(path, policy=policy)
+            return MailResult(index=index, source=path, header=header)
+        if path is None:
+            mail_byte = bytes(source)
+        else:
+            with open(path, "rb") as f:
+                mail_byte = f.read()
+        with limits.activate() if limits is not None else nullcontext():
+            mail = parse_mail_byte(mail_byte, policy=policy, **kwargs)
+    except Exception as e:
+        return MailResult(index=index, source=path, error=e)
+    return MailResult(index=index, source=path, mail=mail)
+
+
+def _collect(
+        future: Future,
+        index: int,
+        source: MailSource
+) -> MailResult:
+    try:
+        return future.result()
+    except Exception as e:
+        # The worker died or the result could not be pickled back
+        path = None if isinstance(source, (bytes, bytearray, memoryview)) else str(source)
+        return MailResult(index=index, source=path, error=e)
+
+
+def _ordered_results(
+        executor: ProcessPoolExecutor,
+        sources: Iterator[Tuple[int, MailSource]],
+        window: int,
+        policy: EmailPolicy,
+        headers_only: bool,
+        kwargs: dict,
+        limits: Optional[ParseLimits]
+) -> Iterator[MailResult]:
+    pending = deque()
+    for index, source in sources:
+        future = executor.submit(_parse_source, index, source, policy, headers_only, kwargs, limits)
+        pending.append((future, index, source))
+        if len(pending) >= window:
+            yield _collect(*pending.popleft())
+    while pending:
+        yield _collect(*pending.popleft())
+
+
+def _unordered_results(
+        executor: ProcessPoolExecutor,
+        sources: Iterator[Tuple[int, MailSource]],
+        window: int,
+        policy: EmailPolicy,
+        headers_only: bool,
+        kwargs: dict,
+        limits: Optional[ParseLimits]
+) -> Iterator[MailResult]:
+    pending = {}
+    exhausted = False
+    while True:
+        while not exhausted and len(pending) < window:
+            try:
+                index, source = next(sources)
+            except StopIteration:
+                exhausted = True
+                break
+            future = executor.submit(_parse_source, index, source, policy, headers_only, kwargs, limits)
+            pending[future] = (index, source)
+        if not pending:
+            return
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield _collect(future, *pending.pop(future))
+
+
+def parse_mails(
+        mails: Iterable[MailSource],
+        workers: Optional[int] = None,
+        flatted: bool = False,
+        headers_only: bool = False,
+        ordered: bool = True,
+        prefetch: int = 4,
+        policy: EmailPolicy = default,
+        limits: Optional[ParseLimits] = None,
+        **kwargs
+) -> Iterator[MailResult]:
+    """
+        Parse a batch of mails spreading the work over a pool of processes
+        :param mails: iterable of paths to mail files or of raw mail bytes
+        :param workers: number of worker processes, defaults to the number of cpus;
+            with 0 or 1 the mails are parsed in the calling process
+        :param flatted: Boolean indicating if the MailObjects created must be flatted or in full depths
+        :param headers_only: if True only the header block of every mail is read and parsed
+        :param ordered: if True the results are yielded in input order, otherwise as soon as they are ready
+        :param prefetch: messages submitted in advance for each worker, it bounds the memory held by the batch
+        :param policy: an email policy
+        :param limits: the ParseLimits of every parse, activated in the workers since they do not see
+            the limits active in the calling context
+        :return: an iterator of MailResult, one for every input message
+
+        A message that fails to parse does not abort the batch, the exception raised
+        is reported in the error field of its MailResult.
+        Paths are read inside the workers, so passing paths instead of bytes avoids
+        copying the messages between processes.
+        The MailCache active in the calling context is used only when the mails are parsed in the calling
+        process (workers 0 or 1): the worker processes do not see it, so a batch spread over them skips
+        the deduplication.
+    """
+    kwargs["flatted"] = flatted
+    sources = enumerate(mails)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1:
+        for index, source in sources:
+            yield _parse_source(index, source, policy, headers_only, kwargs, limits)
+        return
+
+    window = workers * max(prefetch, 1)
+    collect = _ordered_results if ordered else _unordered_results
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        yield from collect(executor, sources, window, policy, headers_only, kwargs, limits)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,220 @@
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from email.policy import default, Policy
+from typing import Optional, Callable, Dict, Union
+
+from parsed.limits import complete, current_limits
+from parsed.mail.model import MailObject
+from parsed.utils import openssl_fallback_enabled
+
+DEFAULT_MAX_BYTES = 256 * 2 ** 20
+# the parse options keyed by the cache, an option not given is keyed as its default
+DEFAULT_OPTIONS = {"flatted": False, "lazy": False, "part_filter": None, "limits": None, "openssl_fallback": True}
+
+_current_cache: ContextVar[Optional["MailCache"]] = ContextVar("parsed_mail_cache", default=None)
+
+
+def raw_digest(
+        mail_byte: bytes = b""
+):
+    """
+        Digest of a raw mail as the cache keys it, a mail received in chunks is digested by updating it with them
+    """
+    return hashlib.blake2b(mail_byte, digest_size=16)
+
+
+def current_cache() -> Optional["MailCache"]:
+    """
+        The cache activated in the current context, None if there is none
+    """
+    return _current_cache.get()
+
+
+class MailCache:
+    """
+        Cache of parsed mails keyed by a digest of the raw mail and of the parse options.
+
+        The mails are stored pickled: the memory tier is a LRU bounded by the total size of the
+        pickles and the optional disk tier keeps one file per mail in directory.
+        Every hit returns a new object, so the cached mails can be modified freely.
+        Storing a mail loads the content of its lazy attachments.
+
+        While a cache is active (with cache.activate(): ...) parse_mail_byte, MailFeedParser and the
+        parsing of the .eml attachments go through it, so identical mails and identical nested
+        mails are parsed only once; parse_mail_message has no raw mail to key and bypasses it.
+        The mails are keyed by the active ParseLimits and openssl fallback too, and a mail degraded by the
+        limits is not stored.
+        The processes of parse_mails do not see the cache active in the calling context, a batch spread
+        over workers is not deduplicated; the asyncio API looks it up in the calling process instead.
+    """
+
+    def __init__(
+            self,
+            max_bytes: int = DEFAULT_MAX_BYTES,
+            directory: Optional[str] = None
+    ):
+        """
+            :param max_bytes: maximum total size of the mails kept in memory
+            :param directory: directory of the disk tier, None to keep the mails only in memory
+        """
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.size = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[str, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(
+            mail_byte: Union[bytes, "hashlib.blake2b"],
+            policy: Policy = default,
+            **options
+    ) -> str:
+        """
+            Digest of the raw mail, of the policy parsing it and of the parse options, resolved to their defaults
+            :param mail_byte: the raw mail, or its raw_digest
+        """
+        digest = raw_digest(mail_byte) if isinstance(mail_byte, (bytes, bytearray, memoryview)) else mail_byte.copy()
+        digest.update(repr(policy).encode())
+        digest.update(repr(sorted({**DEFAULT_OPTIONS, **options}.items())).encode())
+        return digest.hexdigest()
+
+    def _path(
+            self,
+            key: str
+    ) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.pickle")
+
+    def _store(
+            self,
+            key: str,
+            data: bytes
+    ):
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            if len(data) > self.max_bytes:
+                return
+            self._entries[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def get(
+            self,
+            key: str
+    ) -> Optional[MailObject]:
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        if data is not None:
+            return pickle.loads(data)
+        if self.directory is not None:
+            try:
+                with open(self._path(key), "rb") as f:
+                    data = f.read()
+            except FileNotFoundError:
+                pass
+            else:
+                self.disk_hits += 1
+                self._store(key, data)
+                return pickle.loads(data)
+        self.misses += 1
+        return None
+
+    def put(
+            self,
+            key: str,
+            mail: MailObject
+    ):
+        data = pickle.dumps(mail, protocol=pickle.HIGHEST_PROTOCOL)
+        self._store(key, data)
+        if self.directory is not None:
+            path = self._path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+
+    def context_key(
+            self,
+            mail_byte: Union[bytes, "hashlib.blake2b"],
+            policy: Policy = default,
+            **options
+    ) -> str:
+        """
+            Key of mail_byte parsed in the current context, with the active ParseLimits and openssl fallback
+        """
+        return self.key(mail_byte, policy, limits=current_limits(), openssl_fallback=openssl_fallback_enabled(),
+                        **options)
+
+    def fetch(
+            self,
+            mail_byte: Union[bytes, "hashlib.blake2b"],
+            parse: Callable[[], MailObject],
+            policy: Policy = default,
+            **options
+    ) -> MailObject:
+        """
+            Return the cached mail of mail_byte, parsing and caching it on a miss
+            :param mail_byte: the raw mail, or its raw_digest
+            :param parse: callable parsing the mail
+            :param policy: the email policy parsing the mail, part of the key
+            :param options: the parse options, part of the key
+            :return: the parsed mail
+        """
+        key = self.context_key(mail_byte, policy, **options)
+        mail = self.get(key)
+        if mail is None:
+            mail, whole = complete(parse)
+            if mail is not None and whole:
+                self.put(key, mail)
+        return mail
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "bytes": self.size,
+        }
+
+    def clear(self):
+        """
+            Empty the memory tier, the disk tier is left untouched
+        """
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @contextmanager
+    def activate(self):
+        """
+            Make this cache the one used by the parser in the current context
+        """
+        token = _current_cache.set(self)
+        try:
+            yield self
+        finally:
+            _current_cache.reset(token)
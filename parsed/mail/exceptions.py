@@ -12,3 +12,46 @@ class BodyDefect(ParseError):
 
 class MessageDefect(ParseError):
     ...
+
+
+class AttachmentDefect(ParseError):
+    ...
+
+
+class SerializationDefect(ParseError):
+    ...
+
+
+class LimitExceeded(ParseError):
+    """
+        A mail exceeded one of the ParseLimits, limit names the counter of the degraded parses
+    """
+    limit = "limit"
+
+
+class MimeDepthExceeded(LimitExceeded):
+    limit = "mime_depth"
+
+
+class PartLimitExceeded(LimitExceeded):
+    limit = "parts"
+
+
+class DecodedSizeExceeded(LimitExceeded):
+    limit = "decoded_bytes"
+
+
+class AttachmentDepthExceeded(LimitExceeded, AttachmentDefect):
+    limit = "attachment_depth"
+
+
+class ArchiveLimitExceeded(LimitExceeded, AttachmentDefect):
+    limit = "archive"
+
+
+class ExpansionRatioExceeded(ArchiveLimitExceeded):
+    limit = "zip_ratio"
+
+
+class SubprocessTimeout(LimitExceeded):
+    limit = "subprocess_timeout"
@@ -0,0 +1,194 @@
+from contextlib import nullcontext
+from email.feedparser import BytesFeedParser
+from email.message import Message, EmailMessage
+from email.policy import default, EmailPolicy
+from typing import Callable, List, Optional, Union
+
+from parsed.file.model import File
+from parsed.file.storage import PayloadStorage
+from parsed.limits import ParseBudget, current_limits
+from parsed.mail.cache import current_cache, raw_digest
+from parsed.mail.filter import PartFilter
+from parsed.mail.model import Header, MailFile, MailObject
+from parsed.mail.parser import parse_mail_header, parse_mime_attachment, _parse_mail_message
+from parsed.mail.parsing_utils import is_attachment
+
+Attachment = Union[File, MailFile, List[Union[File, MailFile]]]
+
+
+class MailFeedParser:
+    """
+        Push parser of a mail received in chunks.
+
+        The chunks are given to feed as they arrive: the Header is emitted as soon as the header block is
+        complete and every attachment as soon as its MIME part is closed, so a message can be routed before
+        its last attachment has arrived. close returns the whole MailObject, built with the attachments
+        already emitted.
+
+        With a storage the payload of every closed attachment is decoded into it and dropped from the
+        message being parsed, so only the part currently arriving is held encoded in memory.
+
+        close goes through the active MailCache, keyed by the digest of the chunks fed, unless an attachment
+        emitted was degraded by the active ParseLimits; on a hit the attachments were emitted all the same.
+        The parts in progress are read from the private stack of email.feedparser.BytesFeedParser, a Python
+        without it makes the constructor raise.
+
+            parser = MailFeedParser(on_header=route, on_attachment=upload)
+            for chunk in socket_chunks:
+                parser.feed(chunk)
+            mail = parser.close()
+    """
+
+    def __init__(
+            self,
+            on_header: Optional[Callable[[Header], None]] = None,
+            on_attachment: Optional[Callable[[Attachment], None]] = None,
+            storage: Optional[PayloadStorage] = None,
+            flatted: bool = False,
+            lazy: bool = False,
+            part_filter: Optional[PartFilter] = None,
+            policy: EmailPolicy = default
+    ):
+        """
+            :param on_header: called with the Header once the header block is complete
+            :param on_attachment: called with the File, the MailFile or the list of File (expanded archives)
+                of every attachment once its part is closed
+            :param storage: if given the attachment payloads are written to it instead of being kept
+                in the message
+            :param flatted: Boolean indicating if the MailObject returned by close must be flatted or in full depths
+            :param lazy: Boolean indicating if the attachments must be decoded only when their content is accessed,
+                ignored with a storage
+            :param part_filter: the parts to parse, the attachments it skips are not emitted
+            :param policy: an email policy
+        """
+        self.on_header = on_header
+        self.on_attachment = on_attachment
+        self.storage = storage
+        self.flatted = flatted
+        self.lazy = lazy
+        self.part_filter = part_filter
+        self.policy = policy
+        self.header: Optional[Header] = None
+        self.attachments: List[Attachment] = []
+        self._parser = BytesFeedParser(policy=policy)
+        if not isinstance(getattr(self._parser, "_msgstack", None), list):
+            raise RuntimeError("email.feedparser.BytesFeedParser has no _msgstack, the parts in progress cannot be read")
+        self._digest = raw_digest()
+        self._root: Optional[Message] = None
+        # ids of the parts whose attachments have all been emitted
+        self._done = set()
+        self._budget: Optional[ParseBudget] = None
+
+    def feed(
+            self,
+            chunk: bytes
+    ):
+        """
+            Push the next chunk of the mail, the callbacks of what it completes run before returning
+        """
+        self._parser.feed(chunk)
+        self._digest.update(chunk)
+        if self._root is None and self._parser._msgstack:
+            self._root = self._parser._msgstack[0]
+        if self._root is None:
+            return
+        # the headers are set all at once, when the header block is complete
+        if self.header is None and len(self._root):
+            self._emit_header()
+        if self._root.is_multipart():
+            self._emit_closed(self._root, top=True)
+
+    def close(self) -> Optional[MailObject]:
+        """
+            Parse the data still buffered and return the MailObject of the whole mail
+        """
+        root = self._parser.close()
+        self._root = root
+        if self.header is None:
+            self._emit_header()
+        if root.is_multipart():
+            self._emit_closed(root, top=True)
+        elif is_attachment(root) and self._accepts(root):
+            self._emit(root)
+        cache = current_cache()
+        with self._limited():
+            if cache is None or self._budget is not None and self._budget.degraded:
+                return _parse_mail_message(root, self.flatted, self.lazy, self.part_filter)
+            return cache.fetch(
+                self._digest,
+                lambda: _parse_mail_message(root, self.flatted, self.lazy, self.part_filter),
+                self.policy,
+                flatted=self.flatted,
+                lazy=self.lazy,
+                part_filter=self.part_filter
+            )
+
+    def _accepts(
+            self,
+            part: Union[Message, EmailMessage]
+    ) -> bool:
+        return self.part_filter is None or self.part_filter.accepts(part)
+
+    def _limited(self):
+        """
+            The budget of the active ParseLimits, shared by the attachments emitted and by the parse of close
+        """
+        limits = current_limits()
+        if limits is None:
+            return nullcontext()
+        if self._budget is None or self._budget.limits is not limits:
+            self._budget = ParseBudget(limits)
+        return self._budget.activate()
+
+    def _emit_header(self):
+        self.header = parse_mail_header(self._root)
+        if self.on_header is not None:
+            self.on_header(self.header)
+
+    def _emit_closed(
+            self,
+            mime: Union[Message, EmailMessage],
+            top: bool = False
+    ):
+        """
+            Emit the attachments of the closed parts of mime, the parts still open are visited again on the next feed
+        """
+        open_parts = self._parser._msgstack
+        for part in mime.get_payload():
+            if id(part) in self._done:
+                continue
+            closed = not any(part is element for element in open_parts)
+            if (closed or part.is_multipart()) and not self._accepts(part):
+                # skipped with its subtree, as the parser does
+                if closed:
+                    self._done.add(id(part))
+                continue
+            # the same parts the parser turns into attachments
+            if is_attachment(part) and (top or not part.is_multipart()):
+                if closed:
+                    self._emit(part)
+            elif part.is_multipart():
+                self._emit_closed(part)
+                if closed:
+                    self._done.add(id(part))
+            elif closed:
+                self._done.add(id(part))
+
+    def _emit(
+            self,
+            part: Union[Message, EmailMessage]
+    ):
+        self._done.add(id(part))
+        if self.storage is not None:
+            with self.storage.activate(), self._limited():
+                attachment = parse_mime_attachment(part, part_filter=self.part_filter)
+            if not part.is_multipart():
+                # the files read their bytes from the storage now
+                part.set_payload("")
+        else:
+            with self._limited():
+                attachment = parse_mime_attachment(part, lazy=self.lazy, part_filter=self.part_filter)
+        part.parsed_attachment = attachment
+        self.attachments.append(attachment)
+        if self.on_attachment is not None:
+            self.on_attachment(attachment)
@@ -0,0 +1,164 @@
+import os
+import re
+from email.message import Message, EmailMessage
+from fnmatch import translate
+from typing import Callable, Iterable, Optional, Tuple, Union
+
+from parsed.enums import FileExtension
+from parsed.file.model import File
+from parsed.mail.parsing_utils import is_attachment, payload_size
+
+# attachments holding other parts, selected by what they contain
+CONTAINER_EXTENSIONS = (FileExtension.ZIP.value, FileExtension.P7M.value, FileExtension.MAIL.value)
+
+
+def _patterns(
+        values: Optional[Iterable[str]]
+) -> Optional[Tuple[str, ...]]:
+    if values is None:
+        return None
+    if isinstance(values, str):
+        values = [values]
+    return tuple(sorted(value.lower() for value in values))
+
+
+def _extensions(
+        values: Optional[Iterable[str]]
+) -> Optional[Tuple[str, ...]]:
+    values = _patterns(values)
+    if values is None:
+        return None
+    return tuple(value if value.startswith(".") else f".{value}" for value in values)
+
+
+def _matcher(
+        patterns: Optional[Tuple[str, ...]]
+) -> Optional[Callable[[str], Optional[re.Match]]]:
+    """
+        One compiled regex matching any of the fnmatch patterns
+    """
+    if patterns is None:
+        return None
+    if not patterns:
+        return lambda value: None
+    return re.compile("|".join(translate(pattern) for pattern in patterns)).match
+
+
+class PartFilter:
+    """
+        Selects the MIME parts a parse keeps, given as part_filter to the parsing functions.
+
+        The parts that are not selected are skipped before decoding, together with their subtree,
+        and their archives and p7m are not expanded.
+        Content types accept fnmatch patterns ("text/*"), extensions are compared lowercase.
+
+        Multiparts and the container attachments (.eml, .zip, .p7m) are only subject to the exclusions
+        and to max_size, the include rules are applied to what they contain, so
+        PartFilter(extensions=[".pdf"]) also finds the pdf in a zip or in a forwarded mail.
+
+            # just the text
+            parse_mail_byte(mail, part_filter=PartFilter(content_types=["text/plain"], attachments=False))
+            # only the pdf attachments
+            parse_mail_byte(mail, part_filter=PartFilter(extensions=[".pdf"], body=False))
+    """
+
+    def __init__(
+            self,
+            content_types: Optional[Iterable[str]] = None,
+            extensions: Optional[Iterable[str]] = None,
+            exclude_content_types: Optional[Iterable[str]] = None,
+            exclude_extensions: Optional[Iterable[str]] = None,
+            min_size: Optional[int] = None,
+            max_size: Optional[int] = None,
+            body: bool = True,
+            attachments: bool = True
+    ):
+        """
+            :param content_types: content types to keep, all if None
+            :param extensions: extensions of the files to keep, all if None
+            :param exclude_content_types: content types to skip
+            :param exclude_extensions: extensions of the files to skip
+            :param min_size: minimum size in bytes of the kept parts
+            :param max_size: maximum size in bytes of the kept parts
+            :param body: if False the body parts are skipped
+            :param attachments: if False the attachments and inline files are skipped
+        """
+        self.content_types = _patterns(content_types)
+        self.extensions = _extensions(extensions)
+        self.exclude_content_types = _patterns(exclude_content_types) or ()
+        self.exclude_extensions = _extensions(exclude_extensions) or ()
+        self.min_size = min_size
+        self.max_size = max_size
+        self.body = body
+        self.attachments = attachments
+        self._include_types = _matcher(self.content_types)
+        self._exclude_types = _matcher(self.exclude_content_types)
+
+    def _accepts(
+            self,
+            content_type: str,
+            extension: str,
+            size: Optional[int]
+    ) -> bool:
+        if self._exclude_types(content_type) or extension in self.exclude_extensions:
+            return False
+        if size is not None and self.max_size is not None and size > self.max_size:
+            return False
+        if extension in CONTAINER_EXTENSIONS:
+            return True
+        if size is not None and self.min_size is not None and size < self.min_size:
+            return False
+        if self._include_types is not None and not self._include_types(content_type):
+            return False
+        return self.extensions is None or extension in self.extensions
+
+    def accepts(
+            self,
+            mime: Union[Message, EmailMessage]
+    ) -> bool:
+        """
+            Tell if a part must be parsed, the payload is not decoded
+        """
+        content_type = mime.get_content_type()
+        multipart = mime.is_multipart()
+        attachment = is_attachment(mime)
+        if multipart and not attachment:
+            return not self._exclude_types(content_type)
+        if attachment:
+            if not self.attachments:
+                return False
+            extension = os.path.splitext(attachment if isinstance(attachment, str) else mime.get_filename(""))[-1]
+        else:
+            if not self.body:
+                return False
+            extension = ""
+        return self._accepts(content_type, extension.lower(), None if multipart else payload_size(mime))
+
+    def accepts_file(
+            self,
+            file: File
+    ) -> bool:
+        """
+            Tell if a file expanded from a container attachment must be kept
+        """
+        return self._accepts((file.content_type or "").lower(), file.extension, file.size)
+
+    def __repr__(self):
+        # stable, the MailCache keys the parse options by their repr
+        options = ", ".join(
+            f"{name}={value!r}" for name, value in sorted(vars(self).items()) if not name.startswith("_")
+        )
+        return f"PartFilter({options})"
+
+    def __reduce__(self):
+        # the compiled matchers are rebuilt, not pickled
+        return PartFilter, (
+            self.content_types, self.extensions, self.exclude_content_types, self.exclude_extensions,
+            self.min_size, self.max_size, self.body, self.attachments
+        )
+
+    def __eq__(self, other):
+        return isinstance(other, PartFilter) and repr(self) == repr(other)
+
+    def __hash__(self):
+        return hash(repr(self))
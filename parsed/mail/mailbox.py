@@ -0,0 +1,196 @@
+import mmap
+import os
+import re
+from email.policy import default, EmailPolicy
+from typing import Iterator
+
+from parsed.mail.exceptions import ParseError
+from parsed.mail.model import MailObject
+from parsed.mail.parser import parse_mail_byte
+
+MBOX_SEPARATOR = b"From "
+MAILDIR_FOLDERS = ("new", "cur")
+
+_mboxrd_quote = re.compile(rb"^>(>*From )", re.MULTILINE)
+
+
+def _unquote_mbox(
+        message: bytes
+) -> bytes:
+    if b"\n>" in message or message.startswith(b">"):
+        return _mboxrd_quote.sub(rb"\1", message)
+    return message
+
+
+def iter_mbox_messages(
+        path: str
+) -> Iterator[bytes]:
+    """
+        Iterate over the raw messages of a mbox file, without loading the whole file
+        :param path: path of the mbox file
+        :return: an iterator of the raw bytes of every message, the "From " line excluded
+
+        The file is memory mapped and the message boundaries are searched in the mapping,
+        so only the message being yielded is copied in memory.
+        Lines quoted as ">From " (mboxrd) are unquoted.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            size = len(mm)
+            start = 0 if mm[:len(MBOX_SEPARATOR)] == MBOX_SEPARATOR else mm.find(b"\n" + MBOX_SEPARATOR)
+            if start == -1:
+                return
+            if start:
+                start += 1
+            while start < size:
+                # skip the "From " line of the message
+                body_start = mm.find(b"\n", start)
+                if body_start == -1:
+                    return
+                body_start += 1
+                end = mm.find(b"\n" + MBOX_SEPARATOR, body_start - 1)
+                next_start = size if end == -1 else end + 1
+                end = size if end == -1 else end
+                message = mm[body_start:end]
+                # the empty line closing the last message belongs to the mbox format
+                if end == size and message.endswith(b"\n\n"):
+                    message = message[:-1]
+                yield _unquote_mbox(message)
+                start = next_start
+
+
+def iter_maildir_paths(
+        path: str,
+        folders: bool = True
+) -> Iterator[str]:
+    """
+        Iterate over the paths of the messages of a Maildir
+        :param path: root of the Maildir
+        :param folders: if True the Maildir++ sub folders (.Sent, .Archive, ...) are walked too
+        :return: an iterator of message paths
+    """
+    for sub_dir in MAILDIR_FOLDERS:
+        sub_path = os.path.join(path, sub_dir)
+        if not os.path.isdir(sub_path):
+            continue
+        with os.scandir(sub_path) as entries:
+            for entry in sorted(entries, key=lambda e: e.name):
+                if entry.is_file() and not entry.name.startswith("."):
+                    yield entry.path
+    if folders:
+        with os.scandir(path) as entries:
+            sub_folders = sorted(
+                (entry.path for entry in entries if entry.is_dir() and entry.name.startswith(".")),
+            )
+        for sub_folder in sub_folders:
+            yield from iter_maildir_paths(sub_folder, folders=False)
+
+
+def iter_maildir_messages(
+        path: str,
+        folders: bool = True
+) -> Iterator[bytes]:
+    """
+        Iterate over the raw messages of a Maildir, reading one message at a time
+        :param path: root of the Maildir
+        :param folders: if True the Maildir++ sub folders are walked too
+        :return: an iterator of the raw bytes of every message
+    """
+    for message_path in iter_maildir_paths(path, folders):
+        with open(message_path, "rb") as f:
+            yield f.read()
+
+
+def iter_mailbox_messages(
+        path: str
+) -> Iterator[bytes]:
+    """
+        Iterate over the raw messages of a mailbox, a directory is read as a Maildir
+        and a file as a mbox
+        :param path: path of the mailbox
+        :return: an iterator of the raw bytes of every message
+    """
+    if os.path.isdir(path):
+        return iter_maildir_messages(path)
+    return iter_mbox_messages(path)
+
+
+def _parse_messages(
+        messages: Iterator[bytes],
+        ignore_errors: bool,
+        policy: EmailPolicy,
+        kwargs: dict
+) -> Iterator[MailObject]:
+    for message in messages:
+        try:
+            mail = parse_mail_byte(message, policy=policy, **kwargs)
+        except ParseError:
+            if ignore_errors:
+                continue
+            raise
+        if mail is not None:
+            yield mail
+
+
+def iter_mbox(
+        path: str,
+        flatted: bool = False,
+        ignore_errors: bool = False,
+        policy: EmailPolicy = default,
+        **kwargs
+) -> Iterator[MailObject]:
+    """
+        Lazily parse the messages of a mbox file
+        :param path: path of the mbox file
+        :param flatted: Boolean indicating if the MailObjects created must be flatted or in full depths
+        :param ignore_errors: if True the messages raising a ParseError are skipped
+        :param policy: an email policy
+        :return: an iterator of MailObject
+
+        Only one message at a time is held in memory, to parse in parallel feed
+        iter_mbox_messages to parsed.mail.batch.parse_mails instead.
+    """
+    return _parse_messages(iter_mbox_messages(path), ignore_errors, policy, dict(kwargs, flatted=flatted))
+
+
+def iter_maildir(
+        path: str,
+        flatted: bool = False,
+        ignore_errors: bool = False,
+        folders: bool = True,
+        policy: EmailPolicy = default,
+        **kwargs
+) -> Iterator[MailObject]:
+    """
+        Lazily parse the messages of a Maildir
+        :param path: root of the Maildir
+        :param flatted: Boolean indicating if the MailObjects created must be flatted or in full depths
+        :param ignore_errors: if True the messages raising a ParseError are skipped
+        :param folders: if True the Maildir++ sub folders are walked too
+        :param policy: an email policy
+        :return: an iterator of MailObject
+    """
+    return _parse_messages(
+        iter_maildir_messages(path, folders), ignore_errors, policy, dict(kwargs, flatted=flatted)
+    )
+
+
+def iter_mailbox(
+        path: str,
+        flatted: bool = False,
+        ignore_errors: bool = False,
+        policy: EmailPolicy = default,
+        **kwargs
+) -> Iterator[MailObject]:
+    """
+        Lazily parse the messages of a mailbox, a directory is read as a Maildir
+        and a file as a mbox
+        :param path: path of the mailbox
+        :param flatted: Boolean indicating if the MailObjects created must be flatted or in full depths
+        :param ignore_errors: if True the messages raising a ParseError are skipped
+        :param policy: an email policy
+        :return: an iterator of MailObject
+    """
+    return _parse_messages(iter_mailbox_messages(path), ignore_errors, policy, dict(kwargs, flatted=flatted))
@@ -3,6 +3,7 @@ from typing import Optional, Union, List
 
 from pydantic import BaseModel
 
+from parsed.dates import received_timestamp
 from parsed.enums import FileExtension
 from parsed.file.model import File, ParsableFile
 
@@ -25,7 +26,8 @@ class Body(BaseModel):
             self,
             convert: bool = True
     ) -> Union[List['MailObject'], List['MailFile']]:
-        mails = self.attachments_of_extension(FileExtension.MAIL.value)
+        # an .eml kept unparsed is a plain File
+        mails = [mail for mail in self.attachments_of_extension(FileExtension.MAIL.value) if isinstance(mail, MailFile)]
         if mails:
             if convert:
                 return list(map(lambda mail: mail.parsed_obj, mails))
@@ -53,6 +55,9 @@ class Header(BaseModel):
     Cc: Optional[Union[List[EmailAddress], EmailAddress]] = None
     Received: Optional[Union[datetime, str]] = None
     Subject: Optional[str] = None
+    MessageID: Optional[str] = None
+    InReplyTo: Optional[str] = None
+    References: List[str] = []
 
 
 class MailObject(BaseModel):
@@ -68,6 +73,8 @@ class MailObject(BaseModel):
             Subject of the mail
         RECEIVED:
             date and time when the email was received
+        MESSAGEID, INREPLYTO, REFERENCES:
+            the message ids, without angle brackets, linking the mail to the ones it replies to
 
     # MAIL
         BODY:
@@ -83,23 +90,29 @@ class MailObject(BaseModel):
     body: Union[Body, FlattedBody]
     thread_id: Optional[Union[str, int]] = None
 
+    def sort_key(self) -> float:
+        """
+            Timestamp of Received, comparable whether it is a datetime, naive or aware, a string or None
+        """
+        return received_timestamp(self.header.Received)
+
     def __lt__(self, other):
-        return self.header.Received < other.header.Received
+        return self.sort_key() < other.sort_key()
 
     def __gt__(self, other):
-        return self.header.Received > other.header.Received
+        return self.sort_key() > other.sort_key()
 
     def __le__(self, other):
-        return self.header.Received <= other.header.Received
+        return self.sort_key() <= other.sort_key()
 
     def __ge__(self, other):
-        return self.header.Received >= other.header.Received
+        return self.sort_key() >= other.sort_key()
 
     def __eq__(self, other):
-        return self.header.Received == other.header.Received
+        return isinstance(other, MailObject) and self.sort_key() == other.sort_key()
 
     def __ne__(self, other):
-        return self.header.Received != other.header.Received
+        return not self == other
 
 
 class MailFile(ParsableFile):
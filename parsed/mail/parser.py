@@ -1,16 +1,46 @@
+import re
 from email import message_from_bytes, message_from_string
+from email.parser import BytesHeaderParser, HeaderParser
 
 from parsed.mail import Body
-from parsed.mail.exceptions import HeaderDefect
+from parsed.file.storage import current_storage
+from parsed.file.store import current_store
+from parsed.instrumentation import stage, count, current_instrumentation
+from parsed.limits import current_limits, nested_attachment
+from parsed.mail.cache import current_cache
+from parsed.mail.exceptions import HeaderDefect, MimeDepthExceeded
+from parsed.mail.filter import PartFilter
 from email.message import Message, EmailMessage
 from email.policy import default, EmailPolicy
-from typing import Union, Optional
+from typing import Union, Optional, BinaryIO
 
 from parsed.enums import FileExtension
 from parsed.file.model import File
 from parsed.mail.model import MailObject, BodyParts, Header, MailFile, FlattedBody
 from parsed.mail.parsing_utils import mime_content, flatten_attachment, is_attachment, get_address, get_subject, \
-    get_date
+    get_date, mime_file, header_value, get_message_ids, first_address
+
+
+@stage("message_from_bytes")
+def _message_from_bytes(
+        mail_byte: bytes,
+        **kwargs
+) -> Message:
+    try:
+        return message_from_bytes(mail_byte, **kwargs)
+    except RecursionError as e:
+        raise MimeDepthExceeded("mime parts nested deeper than the email package can parse") from e
+
+
+@stage("message_from_string")
+def _message_from_string(
+        mail_string: str,
+        **kwargs
+) -> Message:
+    try:
+        return message_from_string(mail_string, **kwargs)
+    except RecursionError as e:
+        raise MimeDepthExceeded("mime parts nested deeper than the email package can parse") from e
 
 
 def parse_mail_byte(
@@ -28,8 +58,16 @@ def parse_mail_byte(
         aspects of the parser's operation.  The default policy maintains
         backward compatibility.
     """
-    mime = message_from_bytes(mail_byte, policy=policy)
-    return parse_mail_message(mime, **kwargs)
+    cache = current_cache()
+    if cache is not None:
+        return cache.fetch(
+            mail_byte,
+            lambda: _parse_mail_message(_message_from_bytes(mail_byte, policy=policy), **kwargs),
+            policy,
+            **kwargs
+        )
+    mime = _message_from_bytes(mail_byte, policy=policy)
+    return _parse_mail_message(mime, **kwargs)
 
 
 def parse_mail_string(
@@ -47,84 +85,166 @@ def parse_mail_string(
         aspects of the parser's operation.  The default policy maintains
         backward compatibility.
     """
-    mime = message_from_string(mail_string, policy=policy, **kwargs)
+    mime = _message_from_string(mail_string, policy=policy, **kwargs)
     return parse_mail_message(mime, **kwargs)
 
 
+_header_end = re.compile(rb"\r?\n\r?\n")
+_header_end_str = re.compile(r"\r?\n\r?\n")
+
+
+def header_block(
+        mail_byte: bytes
+) -> bytes:
+    """
+        Return the header block of a mime mail byte, the body is left untouched
+        :param mail_byte: the mail byte
+        :return: the bytes up to the empty line closing the headers
+    """
+    match = _header_end.search(mail_byte)
+    if match is None:
+        return mail_byte
+    return mail_byte[:match.end()]
+
+
+def parse_mail_header_byte(
+        mail_byte: bytes,
+        policy: EmailPolicy = default
+) -> Header:
+    """
+        Parse only the headers of a mime mail byte, skipping body and attachments
+        :param mail_byte: the mail byte to parse
+        :param policy: an email policy
+        :return: a Header
+    """
+    mime = BytesHeaderParser(policy=policy).parsebytes(header_block(mail_byte))
+    return parse_mail_header(mime)
+
+
+def parse_mail_header_string(
+        mail_string: str,
+        policy: EmailPolicy = default
+) -> Header:
+    """
+        Parse only the headers of a mime mail string, skipping body and attachments
+        :param mail_string: the mail string to parse
+        :param policy: an email policy
+        :return: a Header
+    """
+    end = _header_end_str.search(mail_string)
+    if end is not None:
+        mail_string = mail_string[:end.end()]
+    mime = HeaderParser(policy=policy).parsestr(mail_string)
+    return parse_mail_header(mime)
+
+
+def parse_mail_header_file(
+        fp: Union[str, BinaryIO],
+        policy: EmailPolicy = default
+) -> Header:
+    """
+        Parse only the headers of a mail file, the file is read up to the end of the header block
+        :param fp: a path or a binary file object
+        :param policy: an email policy
+        :return: a Header
+    """
+    if isinstance(fp, str):
+        with open(fp, "rb") as f:
+            return parse_mail_header_file(f, policy)
+    lines = []
+    for line in fp:
+        lines.append(line)
+        if line in (b"\n", b"\r\n"):
+            break
+    mime = BytesHeaderParser(policy=policy).parsebytes(b"".join(lines))
+    return parse_mail_header(mime)
+
+
+@stage("parse_mail_header")
 def parse_mail_header(
         mime: Union[Message, EmailMessage]
 ):
-    sender = get_address(
-        mime.get("From")
-    )
+    sender = first_address(get_address(
+        header_value(mime, "From")
+    ))
     if not sender:
         raise HeaderDefect
 
     receivers = get_address(
-        mime.get("To", mime.get("Delivered-To"))
+        header_value(mime, "To", header_value(mime, "Delivered-To"))
     )
     if not receivers:
         raise HeaderDefect
 
     cc = get_address(
-        mime.get("Cc")
+        header_value(mime, "Cc")
     )
 
     subject = get_subject(
-        mime.get("Subject")
+        header_value(mime, "Subject")
     )
 
     received = get_date(
         mime
     )
 
-    return Header(
+    message_id = get_message_ids(header_value(mime, "Message-ID"))
+    in_reply_to = get_message_ids(header_value(mime, "In-Reply-To"))
+
+    return Header.model_construct(
         From=sender,
         To=receivers,
         Cc=cc,
         Subject=subject,
-        Received=received
+        Received=received,
+        MessageID=message_id[0] if message_id else None,
+        InReplyTo=in_reply_to[0] if in_reply_to else None,
+        References=get_message_ids(header_value(mime, "References"))
     )
 
 
 def get_attachment_and_body_parts(
         mime: Union[Message, EmailMessage],
-        flatted: bool = False
+        flatted: bool = False,
+        lazy: bool = False,
+        part_filter: Optional[PartFilter] = None
 ):
     content, attachments = [], []
     if mime.is_multipart():
         for part in mime._payload:
+            if part_filter is not None and not part_filter.accepts(part):
+                continue
             if is_attachment(part):
-                parsed_atts = parse_mime_attachment(part)
+                parsed_atts = parse_mime_attachment(part, lazy=lazy, part_filter=part_filter)
                 if isinstance(parsed_atts, list):
                     attachments.extend(parsed_atts)
-                else:
+                elif parsed_atts is not None:
                     attachments.append(parsed_atts)
             else:
                 if part.is_multipart():
                     if not flatted:
                         content.append(
-                            parse_multipart_mime(part)
+                            parse_multipart_mime(part, lazy=lazy, part_filter=part_filter)
                         )
                     else:
-                        parse_multipart_mime(part, ref=content)
+                        parse_multipart_mime(part, ref=content, lazy=lazy, part_filter=part_filter)
                 else:
                     content.append(
-                        BodyParts(
+                        BodyParts.model_construct(
                             content=mime_content(part),
                             content_type=part.get_content_type()
                         )
                     )
-    else:
+    elif part_filter is None or part_filter.accepts(mime):
         if is_attachment(mime):
-            att = parse_mime_attachment(mime)
+            att = parse_mime_attachment(mime, lazy=lazy, part_filter=part_filter)
             if isinstance(att, list):
                 attachments.extend(att)
-            else:
+            elif att is not None:
                 attachments.append(att)
         else:
             content.append(
-                BodyParts(
+                BodyParts.model_construct(
                     content=mime_content(mime),
                     content_type=mime.get_content_type()
                 )
@@ -134,17 +254,53 @@ def get_attachment_and_body_parts(
 
 def parse_mail_message(
         mime: Union[EmailMessage, Message],
-        flatted: bool = False
+        flatted: bool = False,
+        lazy: bool = False,
+        part_filter: Optional[PartFilter] = None
 ) -> Optional[Union[MailObject, MailFile]]:
     """
         Parse a Message or EmailMessage object to a MailObject or MailFile object
         :param mime: Message or EmailMessage object
         :param flatted: Boolean indicating if the MailObject created must be flatted or in full depths
+        :param lazy: Boolean indicating if the attachments must be decoded only when their content is accessed
+        :param part_filter: if given only the parts it accepts are parsed, the others are not decoded
         :return: MailObject or MailFile object
+
+        The message is not looked up in the active MailCache, as its original bytes are gone and its
+        serialization is both costly and not always possible; its .eml attachments still are.
+        While ParseLimits are active the mail and its attachments are parsed within a single budget of them.
     """
+    return _parse_mail_message(mime, flatted, lazy, part_filter)
 
+
+@stage("parse_mail_message")
+def _parse_mail_message(
+        mime: Union[EmailMessage, Message],
+        flatted: bool = False,
+        lazy: bool = False,
+        part_filter: Optional[PartFilter] = None
+) -> Optional[Union[MailObject, MailFile]]:
     header = parse_mail_header(mime)
-    content, attachments = get_attachment_and_body_parts(mime, flatted)
+    limits = current_limits()
+    try:
+        if limits is None:
+            content, attachments = get_attachment_and_body_parts(mime, flatted, lazy, part_filter)
+        else:
+            # the attached mails are parsed within the budget of the mail
+            with limits.budget() as budget:
+                content, attachments = get_attachment_and_body_parts(budget.check(mime), flatted, lazy, part_filter)
+    except RecursionError as e:
+        raise MimeDepthExceeded("mime parts nested deeper than the recursion limit") from e
+    return _build_mail(header, content, attachments, flatted)
+
+
+@stage("build_models")
+def _build_mail(
+        header: Header,
+        content: list,
+        attachments: list,
+        flatted: bool
+) -> MailObject:
     if flatted:
         text_body = ""
         html_body = ""
@@ -157,71 +313,141 @@ def parse_mail_message(
             elif element.content_type == "text/html":
                 html_body += element.content
 
-        body = FlattedBody(
+        body = FlattedBody.model_construct(
             text_body=text_body,
             html_body=html_body,
             inline_file=inline_file,
             attachments=attachments
         )
     else:
-        body = Body(
+        body = Body.model_construct(
             content=content,
             attachments=attachments
         )
-    return MailObject(
+    return MailObject.model_construct(
         header=header,
         body=body
     )
 
 
 def parse_mail_attachment(
-        mime: Union[Message, EmailMessage]
-) -> MailFile:
+        mime: Union[Message, EmailMessage],
+        lazy: bool = False,
+        part_filter: Optional[PartFilter] = None
+) -> Union[MailFile, File]:
+    """
+        Parse an attached mail
+        :return: a MailFile, or a message/rfc822 File if the mail is kept unparsed, as past the attachment
+            depth of the active ParseLimits
+    """
     filename = mime.get_filename(failobj="email.eml")
-    mime = message_from_bytes(mime_content(mime))
-    mail_obj = parse_mail_message(mime)
-    return MailFile(
+    content = mime_content(mime)
+    if isinstance(content, Message):
+        # message/rfc822 attachments come already parsed
+        content = content.as_bytes()
+    elif isinstance(content, str):
+        content = content.encode("utf-8", "surrogateescape")
+    with nested_attachment() as expand:
+        if not expand:
+            # past the attachment depth of the active ParseLimits the mail is kept unparsed
+            mail_obj = None
+        else:
+            mail_obj = parse_mail_byte(content, lazy=lazy, part_filter=part_filter)
+    # a mail kept unparsed is a plain file, a MailFile always has its parsed_obj
+    file_class, fields = (File, {}) if mail_obj is None else (MailFile, {"parsed_obj": mail_obj})
+    storage = current_storage()
+    if storage is not None:
+        # the raw mail is kept in the storage, the parsed tree is enough in memory
+        return file_class.from_payload(
+            storage.store(content),
+            filename=filename,
+            content_type="message/rfc822",
+            encoding=mime.get("Content-Transfer-Encoding"),
+            **fields
+        )
+    return file_class.model_construct(
         filename=filename,
-        content=mime.as_bytes(),
-        parsed_obj=mail_obj,
-        encoding=mime.get("Content-Transfer-encoding")
+        content=content,
+        content_type="message/rfc822",
+        size=len(content),
+        encoding=mime.get("Content-Transfer-Encoding"),
+        **fields
     )
 
 
 def parse_multipart_mime(
         mime: Union[Message, EmailMessage],
-        ref: Optional[list] = None
+        ref: Optional[list] = None,
+        lazy: bool = False,
+        part_filter: Optional[PartFilter] = None
 ) -> Optional[BodyParts]:
     if ref is not None:
         for part in mime._payload:
-            model = mime_to_model(part, ref=ref)
+            model = mime_to_model(part, ref=ref, lazy=lazy, part_filter=part_filter)
             if model:
                 ref.append(model)
     else:
-        return BodyParts(
-            content=list(
-                map(mime_to_model, mime._payload)
-            ),
+        models = (mime_to_model(part, lazy=lazy, part_filter=part_filter) for part in mime._payload)
+        return BodyParts.model_construct(
+            content=[model for model in models if model is not None],
             content_type=mime.get_content_type()
         )
 
 
+def _filter_files(
+        obj: Union[list, File],
+        part_filter: PartFilter
+) -> Optional[Union[list, File]]:
+    """
+        Keep the files expanded from an archive or a p7m that part_filter accepts
+    """
+    if isinstance(obj, list):
+        files = (_filter_files(element, part_filter) for element in obj)
+        return [element for element in files if element is not None]
+    return obj if part_filter.accepts_file(obj) else None
+
+
+def _count_attachments(
+        obj: Optional[Union[list, File]]
+):
+    if isinstance(obj, list):
+        for element in obj:
+            _count_attachments(element)
+    elif obj is not None:
+        count("attachments", extension=obj.extension or "none")
+
+
 def parse_mime_attachment(
         mime: Union[Message, EmailMessage],
-        fold_attachment: bool = True
-) -> Union[list[Union[File, MailFile]], MailFile, File]:
+        fold_attachment: bool = True,
+        lazy: bool = False,
+        part_filter: Optional[PartFilter] = None
+) -> Optional[Union[list[Union[File, MailFile]], MailFile, File]]:
+    # parts already turned into attachments while the mail was streamed, see parsed.mail.feed
+    parsed = getattr(mime, "parsed_attachment", None)
+    if parsed is not None:
+        return parsed
     filename = mime.get_filename(failobj="")
 
     if "eml" in filename:
-        obj = parse_mail_attachment(mime)
+        obj = parse_mail_attachment(mime, lazy, part_filter)
     else:
-        obj = flatten_attachment(
-            File(
-                filename=filename,
-                content=mime_content(mime),
-                encoding=mime.get("Content-Transfer-Encoding")
+        store = current_store()
+        if store is not None:
+            obj = store.attachment(
+                mime,
+                filename,
+                lambda: flatten_attachment(mime_file(mime, filename), lazy=False)
             )
-        )
+        else:
+            obj = flatten_attachment(
+                mime_file(mime, filename, lazy),
+                lazy
+            )
+        if part_filter is not None:
+            obj = _filter_files(obj, part_filter)
+    if current_instrumentation() is not None:
+        _count_attachments(obj)
     if fold_attachment and isinstance(obj, list):
         attachments = []
         for attachment in obj:
@@ -236,20 +462,25 @@ def parse_mime_attachment(
 def mime_to_model(
         mime: Union[EmailMessage, Message],
         fold_attachment: bool = True,
-        ref: Optional[list] = None
+        ref: Optional[list] = None,
+        lazy: bool = False,
+        part_filter: Optional[PartFilter] = None
 ):
+    if part_filter is not None and not part_filter.accepts(mime):
+        return None
+
     if mime.is_multipart():
         # Multipart-mime but not a mail
-        return parse_multipart_mime(mime, ref)
+        return parse_multipart_mime(mime, ref, lazy, part_filter)
 
     # Not multipart-mime
 
     # Case attachment or inline file
     if is_attachment(mime):
-        return parse_mime_attachment(mime, fold_attachment)
+        return parse_mime_attachment(mime, fold_attachment, lazy, part_filter)
 
     # str or html-str type
-    return BodyParts(
+    return BodyParts.model_construct(
         content=mime_content(mime),
         content_type=mime.get_content_type()
     )
@@ -1,37 +1,88 @@
-from email.header import decode_header
+import binascii
+import re
+from functools import partial, lru_cache
+import os
 from email.message import Message, EmailMessage
-from email.utils import parseaddr, parsedate_to_datetime
-from typing import Union, List, Optional
+from email.utils import parsedate_to_datetime
+from typing import Union, List, Optional, Tuple
 
-from parsed.enums import FileExtension
-from parsed.file.model import File
-from parsed.mail.model import MailObject, BodyParts, EmailAddress
+from parsed.enums import FileExtension, MimeTypes
+from parsed.file.model import File, Content
+from parsed.file.storage import current_storage
+from parsed.instrumentation import stage, count
+from parsed.limits import current_budget, exceeded, nested_attachment
+from parsed.mail.exceptions import LimitExceeded
+from parsed.mail.model import MailObject, BodyParts, EmailAddress, FlattedBody
 from parsed.utils import unzip_attachments, extract_p7m
 
 
+def _decode_text(
+        content: Optional[Union[str, bytes]]
+) -> Optional[str]:
+    if isinstance(content, bytes):
+        return content.decode()
+    return content
+
+
+def _flatten_unwrapped(
+        attachment: File,
+        signed_filename: str,
+        content: Content
+) -> Content:
+    """
+        The content of a lazy p7m once unwrapped on first access, as flatten_attachment leaves the signed file
+    """
+    if attachment.filename == signed_filename:
+        return content
+    return flatten_attachment(File.model_construct(filename=attachment.filename, content=content)).content
+
+
 def flatten_attachment(
-        attachment: Union[File, list]
+        attachment: Union[File, list],
+        lazy: bool = False
 ) -> Union[File, List[File]]:
+    """
+        Expand the archives and the signed files of an attachment
+        :param attachment: a File or a list of File
+        :param lazy: if True decoding and p7m unwrapping are deferred to the first access to the content,
+            archives are still expanded since their members must be listed
+        :return: a File or a list of File, an archive past the active ParseLimits is kept unexpanded when they degrade
+    """
     if isinstance(attachment, list):
-        return list(map(flatten_attachment, attachment))
+        return [flatten_attachment(element, lazy) for element in attachment]
     match attachment.extension:
         case FileExtension.XML.value:
-            content = attachment.content
-            if isinstance(content, bytes):
-                attachment.content = content.decode()
+            attachment.defer(_decode_text)
             return attachment
         case FileExtension.ZIP.value:
-            return flatten_attachment(
-                unzip_attachments(
-                    attachment
+            with nested_attachment() as expand:
+                if not expand:
+                    return attachment
+                try:
+                    members = unzip_attachments(
+                        attachment,
+                        lazy
+                    )
+                except LimitExceeded as e:
+                    exceeded(e)
+                    return attachment
+                return flatten_attachment(
+                    members,
+                    lazy
                 )
-            )
         case FileExtension.P7M.value:
-            return flatten_attachment(
-                extract_p7m(
-                    attachment
-                )
-            )
+            filename = attachment.filename
+            inner_extension = os.path.splitext(filename[:-len(FileExtension.P7M.value)])[-1].lower()
+            # the unwrapped archives must be expanded right away
+            lazy = lazy and inner_extension not in (FileExtension.ZIP.value, FileExtension.P7M.value)
+            attachment = extract_p7m(attachment, lazy)
+            if lazy:
+                attachment.defer(partial(_flatten_unwrapped, attachment, filename))
+                return attachment
+            if attachment.filename == filename:
+                # left signed
+                return attachment
+            return flatten_attachment(attachment, lazy)
         case _:
             return attachment
 
@@ -39,29 +90,191 @@ def flatten_attachment(
 def get_body(
         mail: Union[MailObject, BodyParts],
         tipe: str = "text/plain"
-) -> Union[bytes, str]:
+) -> Optional[Union[bytes, str]]:
     if isinstance(mail, MailObject):
-        for elem in mail.body.content:
-            if isinstance(elem, BodyParts):
-                return get_body(elem, tipe)
+        if isinstance(mail.body, FlattedBody):
+            if tipe == MimeTypes.PLAIN.value:
+                return mail.body.text_body
+            if tipe == MimeTypes.HTML.value:
+                return mail.body.html_body
+            return None
+        parts = mail.body.content
+    elif isinstance(mail, BodyParts):
+        if not isinstance(mail.content, list):
+            return mail.content if mail.content_type == tipe else None
+        parts = mail.content
     else:
-        if isinstance(mail.content, list):
-            for elem in mail.content:
-                return get_body(elem, tipe)
+        return None
+    for part in parts:
+        body = get_body(part, tipe)
+        if body is not None:
+            return body
+    return None
+
+
+# RFC 2047 encoded-word, the whitespace between two encoded-words is not part of the text
+_encoded_word = re.compile(r"=\?([^?*\s]+)(?:\*[^?\s]*)?\?([QqBb])\?([^?\s]*)\?=")
+_encoded_word_gap = re.compile(r"(\?=)\s+(?==\?)")
+_q_escape = re.compile(rb"=([0-9A-Fa-f]{2})")
+_folding = re.compile(r"\r?\n(?=[ \t])|\r?\n$")
+# tokens of an address list: quoted strings, comments, angle addresses, separators and plain text
+_address_token = re.compile(r'"(?:[^"\\]|\\.)*"?|\((?:[^()\\]|\\.)*\)?|<[^>]*>?|[,;]|[^",;(<]+')
+_quoted_pair = re.compile(r"\\(.)")
+
+
+def _decode_word_bytes(
+        encoding: str,
+        text: str
+) -> bytes:
+    if encoding in "Bb":
+        try:
+            return binascii.a2b_base64(text + "=" * (-len(text) % 4))
+        except binascii.Error:
+            return text.encode("ascii", "replace")
+    return _q_escape.sub(lambda match: bytes([int(match.group(1), 16)]), text.replace("_", " ").encode("ascii", "replace"))
+
+
+def _decode_charset(
+        data: bytes,
+        charset: str
+) -> str:
+    try:
+        return data.decode(charset, "replace")
+    except LookupError:
+        return data.decode("latin-1")
+
+
+@lru_cache(maxsize=8192)
+def decode_words(
+        value: str
+) -> str:
+    """
+        Decode the RFC 2047 encoded-words of a header value, adjacent words in the same charset are
+        joined before decoding so the characters split between them are kept
+        :param value: the raw header value
+        :return: the decoded value
+    """
+    if "=?" not in value:
+        return value
+    value = _encoded_word_gap.sub(r"\1", value)
+    chunks, last = [], 0
+    pending, pending_charset = b"", None
+    for match in _encoded_word.finditer(value):
+        charset, encoding, text = match.groups()
+        charset = charset.lower()
+        if match.start() > last or charset != pending_charset:
+            if pending:
+                chunks.append(_decode_charset(pending, pending_charset))
+                pending = b""
+            chunks.append(value[last:match.start()])
+        pending += _decode_word_bytes(encoding, text)
+        pending_charset = charset
+        last = match.end()
+    if pending:
+        chunks.append(_decode_charset(pending, pending_charset))
+    chunks.append(value[last:])
+    return "".join(chunks)
+
+
+def _unquote(
+        text: str
+) -> str:
+    if text.startswith('"'):
+        text = text[1:-1] if len(text) > 1 and text.endswith('"') else text[1:]
+        return _quoted_pair.sub(r"\1", text)
+    return text
+
+
+def _address_pair(
+        tokens: List[str]
+) -> Optional[Tuple[str, str]]:
+    """
+        Name and address of the tokens of a single mailbox
+    """
+    name, address, comments = [], None, []
+    for token in tokens:
+        first = token[0]
+        if first == "<":
+            address = token[1:-1] if token.endswith(">") else token[1:]
+        elif first == "(":
+            comments.append(token[1:-1] if token.endswith(")") else token[1:])
+        elif first == '"':
+            name.append(_unquote(token))
         else:
-            if mail.content_type == tipe:
-                return mail.content
-            else:
-                return get_body(mail, tipe)
+            name.append(token)
+    text = " ".join("".join(name).split())
+    if address is None:
+        # bare addr-spec, the name may be in a comment: addr@example.com (Name)
+        address, text = text, " ".join(comments)
+    if not address and not text:
+        return None
+    return decode_words(text), address.strip()
+
+
+@lru_cache(maxsize=8192)
+def split_addresses(
+        value: str,
+        separators: str = ",;"
+) -> Tuple[Tuple[str, str], ...]:
+    """
+        Split an address list in one pass, commas and semicolons inside quoted names, comments
+        and angle addresses are not separators; group names (undisclosed-recipients:;) are dropped
+        :param value: the raw header value
+        :param separators: the characters separating the addresses
+        :return: (name, address) of every address, the names decoded
+    """
+    pairs, tokens = [], []
+    for token in _address_token.findall(value):
+        if token in separators:
+            pair = _address_pair(tokens)
+            if pair is not None:
+                pairs.append(pair)
+            tokens = []
+            continue
+        if token[0] not in '"(<' and ":" in token and not any(t[0] == "<" for t in tokens):
+            # the display name of a group
+            token = token.split(":", 1)[1]
+            tokens = []
+            if not token.strip():
+                continue
+        tokens.append(token)
+    pair = _address_pair(tokens)
+    if pair is not None:
+        pairs.append(pair)
+    return tuple(pairs)
+
+
+def _email_addresses(
+        pairs: Tuple[Tuple[str, str], ...]
+) -> Optional[Union[List[EmailAddress], EmailAddress]]:
+    addresses = [EmailAddress.model_construct(name=name, address=address) for name, address in pairs]
+    if not addresses:
+        return None
+    if len(addresses) == 1:
+        return addresses[0]
+    return addresses
+
+
+def first_address(
+        addresses: Optional[Union[List[EmailAddress], EmailAddress]]
+) -> Optional[EmailAddress]:
+    """
+        The first address of a list, the sender kept of a mail written by several authors (RFC 5322 3.6.2),
+        as the Header has a single From
+    """
+    if isinstance(addresses, list):
+        return addresses[0] if addresses else None
+    return addresses
 
 
 def transform_address(
         address: str
 ):
-    address = parseaddr(address)
-    return EmailAddress(
-        nickname=address[0],
-        address=address[1]
+    pairs = split_addresses(address, "")
+    name, address = pairs[0] if pairs else ("", "")
+    return EmailAddress.model_construct(
+        name=name,
+        address=address
     )
 
 
@@ -72,45 +285,73 @@ def get_email_address(
         return
     target = target.strip()
     target = target.replace("&lt;", "<").replace("&gt;", ">")
-    addresses = target.split(";")
-    addresses = list(map(transform_address, addresses))
-    if len(addresses) == 1:
-        return addresses[0]
-    return addresses
+    # the quoted threads separate the addresses with ";", commas are part of the names there
+    return _email_addresses(split_addresses(target, ";"))
+
+
+def header_value(
+        mime: Union[Message, EmailMessage],
+        name: str,
+        failobj=None
+) -> Optional[str]:
+    """
+        The raw value of a header, unfolded, without the parsing of the policy
+        :param mime: Message or EmailMessage object
+        :param name: name of the header, case insensitive
+        :param failobj: returned if the header is missing
+        :return: the value, encoded-words not decoded
+    """
+    name = name.lower()
+    for key, value in mime._headers:
+        if key.lower() == name:
+            if not isinstance(value, str):
+                # set by the application, as an email.header.Header
+                return str(mime.get(key))
+            if _has_surrogates(value):
+                value = value.encode("ascii", "surrogateescape").decode("utf-8", "replace")
+            return _folding.sub("", value)
+    return failobj
 
 
 def get_address(
         mime_header
-) -> Union[List[EmailAddress], EmailAddress]:
+) -> Optional[Union[List[EmailAddress], EmailAddress]]:
+    """
+        Parse an address list header
+        :param mime_header: the header value, raw or decoded
+        :return: an EmailAddress, a list of EmailAddress or None if there is no address
+    """
     if mime_header is not None:
-        addresses = []
-        for address in mime_header.split(", "):
-            address = parseaddr(address)
-            addresses.append(
-                EmailAddress(
-                    name=address[0],
-                    address=address[1]
-                )
-            )
-        if len(addresses) == 1:
-            return addresses[0]
-        else:
-            return addresses
+        return _email_addresses(split_addresses(str(mime_header)))
 
 
 def get_subject(
         subject_header
 ) -> str:
-    subject = ""
-    if subject_header:
-        encoded_tuple = decode_header(subject_header)[0]
-        byte_subject = encoded_tuple[0]
-        encoding = encoded_tuple[1]
-        if encoding:
-            subject = byte_subject.decode(encoding)
-        else:
-            subject = str(byte_subject)
-    return subject
+    """
+        Decode a subject, every RFC 2047 encoded-word of it
+    """
+    if not subject_header:
+        return ""
+    return decode_words(str(subject_header))
+
+
+_message_id = re.compile(r"<([^<>\s]+)>")
+
+
+def get_message_ids(
+        header: Optional[str]
+) -> List[str]:
+    """
+        The message ids of a Message-ID, In-Reply-To or References header, without angle brackets
+    """
+    if not header:
+        return []
+    ids = _message_id.findall(header)
+    if not ids and header.strip():
+        # a bare id, written without the brackets
+        ids = header.split()[:1]
+    return ids
 
 
 def get_date(
@@ -124,15 +365,105 @@ def get_date(
         return parsedate_to_datetime(date)
 
 
+@stage("mime_content")
 def mime_content(
         mime: Union[Message, EmailMessage],
         decode: bool = True,
         **kwargs
 ) -> Optional[Union[EmailMessage, Message, str, bytes]]:
+    budget = current_budget()
+    if budget is not None:
+        budget.decode(payload_size(mime))
     try:
-        return mime.get_content(**kwargs)
+        content = mime.get_content(**kwargs)
     except (KeyError, AttributeError):
-        return mime.get_payload(decode=decode, **kwargs)
+        content = mime.get_payload(decode=decode, **kwargs)
+    if isinstance(content, (str, bytes)):
+        count("bytes_decoded", len(content))
+    return content
+
+
+def _text_content(
+        content: bytes,
+        charset: str
+) -> str:
+    """
+        Decode the payload of a text part as get_content does
+    """
+    try:
+        return content.decode(charset, "replace")
+    except LookupError:
+        return content.decode("utf-8", "replace")
+
+
+def payload_size(
+        mime: Union[Message, EmailMessage]
+) -> int:
+    """
+        Size of the decoded payload of a non multipart mime, computed without decoding it
+        :param mime: Message or EmailMessage object
+        :return: the size in bytes, exact for base64 and an upper bound otherwise
+    """
+    payload = mime._payload
+    if not isinstance(payload, str):
+        return 0
+    size = len(payload)
+    if mime.get("Content-Transfer-Encoding", "").strip().lower() == "base64":
+        size -= payload.count("\n") + payload.count("\r") + payload.count(" ")
+        size = size * 3 // 4 - payload.rstrip().endswith("=") - payload.rstrip().endswith("==")
+    return max(size, 0)
+
+
+def mime_file(
+        mime: Union[Message, EmailMessage],
+        filename: str,
+        lazy: bool = False
+) -> File:
+    """
+        Build a File from a non multipart mime
+        :param mime: Message or EmailMessage object
+        :param filename: name of the file
+        :param lazy: if True the payload is decoded on first access to the content
+        :return: a File
+
+        While a PayloadStorage is active the payload is decoded into it and the File reads it from there.
+        Once the bytes decoded by the parse are past the active ParseLimits the File is lazy, when they degrade.
+    """
+    storage = current_storage()
+    budget = current_budget()
+    if budget is not None and budget.exhausted():
+        storage, lazy = None, True
+    if storage is not None:
+        if budget is not None:
+            budget.decode(payload_size(mime))
+        payload = storage.decode(mime)
+        count("bytes_decoded", payload.size)
+        file = File.from_payload(
+            payload,
+            filename=filename,
+            content_type=mime.get_content_type(),
+            encoding=mime.get("Content-Transfer-Encoding")
+        )
+        if mime.get_content_maintype() == "text":
+            # a str as without the storage
+            file.defer(partial(_text_content, charset=mime.get_param("charset", "ASCII")))
+        return file
+    if lazy:
+        return File.lazy(
+            partial(mime_content, mime),
+            filename=filename,
+            content_type=mime.get_content_type(),
+            size=payload_size(mime),
+            encoding=mime.get("Content-Transfer-Encoding")
+        )
+    content = mime_content(mime)
+    return File.model_construct(
+        filename=filename,
+        content=content,
+        content_type=mime.get_content_type(),
+        size=len(content) if isinstance(content, (str, bytes)) else None,
+        encoding=mime.get("Content-Transfer-Encoding")
+    )
 
 
 def _has_surrogates(s):
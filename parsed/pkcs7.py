@@ -0,0 +1,158 @@
+"""
+    Minimal DER/BER reader extracting the signed content of a CMS (PKCS#7) SignedData,
+    the structure of the p7m files:
+
+    ContentInfo ::= SEQUENCE {
+        contentType OBJECT IDENTIFIER (signedData),
+        content [0] EXPLICIT SignedData }
+    SignedData ::= SEQUENCE {
+        version INTEGER,
+        digestAlgorithms SET,
+        encapContentInfo SEQUENCE {
+            eContentType OBJECT IDENTIFIER,
+            eContent [0] EXPLICIT OCTET STRING OPTIONAL },
+        ... }
+
+    The signature is not verified, as with "openssl smime -verify -noverify".
+"""
+import base64
+import binascii
+from typing import Iterator, Tuple, Union
+
+
+SEQUENCE = 0x30
+OBJECT_IDENTIFIER = 0x06
+OCTET_STRING = 0x04
+CONSTRUCTED_OCTET_STRING = 0x24
+EXPLICIT_0 = 0xA0
+
+SIGNED_DATA_OID = bytes.fromhex("2a864886f70d010702")
+
+# tag, start of the content, end of the content, start of the next element
+Element = Tuple[int, int, int, int]
+
+
+class PKCS7Error(ValueError):
+    ...
+
+
+def _element(
+        data: memoryview,
+        offset: int,
+        end: int
+) -> Element:
+    if offset + 2 > end:
+        raise PKCS7Error("truncated element")
+    tag = data[offset]
+    offset += 1
+    if tag & 0x1F == 0x1F:
+        # high tag number form
+        while offset < end and data[offset] & 0x80:
+            offset += 1
+        offset += 1
+    if offset >= end:
+        raise PKCS7Error("truncated length")
+    length = data[offset]
+    offset += 1
+    if length == 0x80:
+        # BER indefinite length, the content ends with two zero bytes
+        position = offset
+        while True:
+            if position + 2 > end:
+                raise PKCS7Error("missing end of contents")
+            if data[position] == 0 and data[position + 1] == 0:
+                return tag, offset, position, position + 2
+            position = _element(data, position, end)[3]
+    if length & 0x80:
+        size = length & 0x7F
+        if size == 0 or size > 8 or offset + size > end:
+            raise PKCS7Error("invalid length")
+        length = int.from_bytes(data[offset:offset + size], "big")
+        offset += size
+    if offset + length > end:
+        raise PKCS7Error("truncated content")
+    return tag, offset, offset + length, offset + length
+
+
+def _children(
+        data: memoryview,
+        element: Element
+) -> Iterator[Element]:
+    offset, end = element[1], element[2]
+    while offset < end:
+        child = _element(data, offset, end)
+        yield child
+        offset = child[3]
+
+
+def _child(
+        children: Iterator[Element],
+        tag: int
+) -> Element:
+    child = next(children, None)
+    if child is None or child[0] != tag:
+        raise PKCS7Error(f"expected tag {tag:#04x}")
+    return child
+
+
+def _octets(
+        data: memoryview,
+        element: Element
+) -> Iterator[memoryview]:
+    tag, start, end, _ = element
+    if tag == OCTET_STRING:
+        yield data[start:end]
+    elif tag == CONSTRUCTED_OCTET_STRING:
+        for child in _children(data, element):
+            yield from _octets(data, child)
+    else:
+        raise PKCS7Error("eContent is not an OCTET STRING")
+
+
+def _der(
+        p7m: bytes
+) -> bytes:
+    if p7m[:1] == bytes([SEQUENCE]):
+        return p7m
+    # base64 (or PEM) encoded p7m
+    lines = [line for line in p7m.splitlines() if line and not line.startswith(b"-----")]
+    try:
+        return base64.b64decode(b"".join(lines), validate=False)
+    except binascii.Error:
+        raise PKCS7Error("not a DER or base64 encoded p7m")
+
+
+def signed_content(
+        p7m: Union[bytes, bytearray]
+) -> bytes:
+    """
+        Extract the signed content of a p7m
+        :param p7m: the p7m, DER/BER or base64 encoded
+        :return: the signed content
+        :raise PKCS7Error: if p7m is not an attached SignedData
+    """
+    data = memoryview(_der(bytes(p7m)))
+    content_info = _element(data, 0, len(data))
+    if content_info[0] != SEQUENCE:
+        raise PKCS7Error("ContentInfo is not a SEQUENCE")
+    children = _children(data, content_info)
+    content_type = _child(children, OBJECT_IDENTIFIER)
+    if data[content_type[1]:content_type[2]] != SIGNED_DATA_OID:
+        raise PKCS7Error("ContentInfo is not a SignedData")
+    explicit = _child(children, EXPLICIT_0)
+
+    signed_data = _child(_children(data, explicit), SEQUENCE)
+    children = _children(data, signed_data)
+    next(children, None)  # version
+    next(children, None)  # digestAlgorithms
+    encap_content_info = _child(children, SEQUENCE)
+
+    children = _children(data, encap_content_info)
+    _child(children, OBJECT_IDENTIFIER)
+    e_content = next(children, None)
+    if e_content is None or e_content[0] != EXPLICIT_0:
+        raise PKCS7Error("detached signature, the p7m has no content")
+    e_content = next(_children(data, e_content), None)
+    if e_content is None:
+        raise PKCS7Error("empty eContent")
+    return b"".join(_octets(data, e_content))
@@ -0,0 +1,500 @@
+"""
+    Compact binary serialization of MailObject and MailThread, to hand parsed mails between processes.
+
+    Layout, integers little endian:
+
+        b"PRSD" | version: u8 | kind: b"M" mail or b"T" thread
+        header length: u32 | body length: u32
+        header section: the Header of the mail, or of every mail of the thread
+        body section: bodies, attachments and nested mails, the bytes contents replaced by blob numbers
+        blob count: u32 | blob lengths: u64 each | the blobs, back to back
+
+    The sections are encoded with marshal, so they are as fast to write and read as the interpreter allows
+    and carry no base64; the attachment bytes are copied out of line as they are. load_header reads only
+    the header section, the blobs of a file can be left on disk until the contents are accessed.
+    The models are rebuilt without validation, as pickle does: load only data written by dumps.
+"""
+import io
+import marshal
+import os
+import struct
+from datetime import datetime, timedelta, timezone
+from email import message_from_bytes
+from email.message import Message
+from email.policy import default
+from functools import partial
+from typing import BinaryIO, Callable, Dict, List, Optional, Tuple, Union
+
+from parsed.file.model import File
+from parsed.mail import Body, BodyParts, EmailAddress, Header, MailFile, MailObject
+from parsed.mail.exceptions import SerializationDefect
+from parsed.mail.model import FlattedBody
+from parsed.thread.model import MailThread
+
+MAGIC = b"PRSD"
+VERSION = 1
+MARSHAL_VERSION = 4
+
+_KIND_MAIL = b"M"
+_KIND_THREAD = b"T"
+_PREAMBLE = struct.Struct("<4sBcII")
+_COUNT = struct.Struct("<I")
+
+# tags of the encoded nodes, a node is a tuple starting with its tag
+_BLOB, _PART, _FILE, _MAIL_FILE, _MAIL, _BODY, _FLATTED, _MESSAGE = range(8)
+
+Serializable = Union[MailObject, MailThread]
+
+
+_private_defaults: Dict[type, Optional[dict]] = {}
+
+
+def _construct(
+        cls,
+        **values
+):
+    """
+        model_construct for a model given all its fields, restored the way pickle restores a model,
+        without the per field default lookups of model_construct
+    """
+    if cls not in _private_defaults:
+        private = cls.__private_attributes__
+        _private_defaults[cls] = {name: attr.get_default() for name, attr in private.items()} if private else None
+    private = _private_defaults[cls]
+    obj = cls.__new__(cls)
+    obj.__setstate__({
+        "__dict__": values,
+        "__pydantic_fields_set__": set(values),
+        "__pydantic_extra__": None,
+        "__pydantic_private__": None if private is None else dict(private),
+    })
+    return obj
+
+
+def _text(
+        value: Optional[str]
+) -> Optional[str]:
+    # marshal takes only exact str, the header values of the email package are subclasses
+    return value if value is None or type(value) is str else str(value)
+
+
+def _encode_date(
+        date: Optional[Union[datetime, str]]
+):
+    if not isinstance(date, datetime):
+        return date
+    offset = date.utcoffset()
+    return (
+        date.year, date.month, date.day, date.hour, date.minute, date.second, date.microsecond,
+        None if offset is None else offset.total_seconds()
+    )
+
+
+def _decode_date(
+        date
+) -> Optional[Union[datetime, str]]:
+    if not isinstance(date, tuple):
+        return date
+    *fields, offset = date
+    return datetime(*fields, tzinfo=None if offset is None else timezone(timedelta(seconds=offset)))
+
+
+def _encode_addresses(
+        addresses: Optional[Union[List[EmailAddress], EmailAddress]]
+):
+    if addresses is None:
+        return None
+    if isinstance(addresses, EmailAddress):
+        return _text(addresses.name), _text(addresses.address)
+    return [(_text(address.name), _text(address.address)) for address in addresses]
+
+
+def _decode_addresses(
+        addresses
+) -> Optional[Union[List[EmailAddress], EmailAddress]]:
+    if addresses is None:
+        return None
+    if isinstance(addresses, tuple):
+        return _construct(EmailAddress, name=addresses[0], address=addresses[1])
+    return [_construct(EmailAddress, name=name, address=address) for name, address in addresses]
+
+
+def _encode_header(
+        header: Header
+) -> tuple:
+    return (
+        _encode_addresses(header.From), _encode_addresses(header.To), _encode_addresses(header.Cc),
+        _encode_date(header.Received), _text(header.Subject), _text(header.MessageID), _text(header.InReplyTo),
+        [_text(reference) for reference in header.References]
+    )
+
+
+def _decode_header(
+        header: tuple
+) -> Header:
+    sender, receivers, cc, received, subject, message_id, in_reply_to, references = header
+    return _construct(
+        Header,
+        From=_decode_addresses(sender),
+        To=_decode_addresses(receivers),
+        Cc=_decode_addresses(cc),
+        Received=_decode_date(received),
+        Subject=subject,
+        MessageID=message_id,
+        InReplyTo=in_reply_to,
+        References=references
+    )
+
+
+class _Encoder:
+    """
+        Turns a model tree into marshal values, collecting the bytes contents as blobs
+    """
+
+    def __init__(self):
+        # bytes, or a File whose stored payload is copied without loading it
+        self.blobs: List[Union[bytes, File]] = []
+
+    def blob(
+            self,
+            data: Union[bytes, File]
+    ) -> tuple:
+        self.blobs.append(data)
+        return _BLOB, len(self.blobs) - 1
+
+    def content(
+            self,
+            file: File
+    ):
+        payload = file._payload
+        if payload is not None and file._loader is not None and file._loader == payload.read:
+            return self.blob(file)
+        content = file.content
+        return self.blob(content) if isinstance(content, (bytes, bytearray, memoryview)) else _text(content)
+
+    def file(
+            self,
+            file: File
+    ) -> tuple:
+        return _text(file.filename), self.content(file), _text(file.content_type), file.size, _text(file.encoding)
+
+    def node(
+            self,
+            obj
+    ):
+        if isinstance(obj, MailFile):
+            return (
+                _MAIL_FILE, *self.file(obj), None if obj.parsed_obj is None else self.mail(obj.parsed_obj)
+            )
+        if isinstance(obj, File):
+            return (_FILE, *self.file(obj))
+        if isinstance(obj, BodyParts):
+            return _PART, self.node(obj.content), obj.content_type
+        if isinstance(obj, list):
+            return [self.node(element) for element in obj]
+        if isinstance(obj, (bytes, bytearray, memoryview)):
+            return self.blob(obj)
+        if isinstance(obj, Message):
+            return _MESSAGE, self.blob(obj.as_bytes())
+        if obj is None or isinstance(obj, str):
+            return _text(obj)
+        raise SerializationDefect(f"cannot serialize {type(obj).__name__}")
+
+    def body(
+            self,
+            body: Union[Body, FlattedBody]
+    ) -> tuple:
+        if isinstance(body, FlattedBody):
+            return (
+                _FLATTED, _text(body.text_body), _text(body.html_body), self.node(body.inline_file or []),
+                self.node(body.attachments or [])
+            )
+        return _BODY, self.node(body.content), self.node(body.attachments)
+
+    def mail(
+            self,
+            mail: MailObject,
+            header: bool = True
+    ) -> tuple:
+        """
+            :param header: if False the header is left to the header section
+        """
+        return _MAIL, _encode_header(mail.header) if header else None, self.body(mail.body), mail.thread_id
+
+
+class _Decoder:
+    """
+        Rebuilds the models from the marshal values, reading the blobs with blob(number)
+    """
+
+    def __init__(
+            self,
+            blob: Callable[[int], bytes],
+            lazy_blob: Optional[Callable[[int], Tuple[Callable[[], bytes], int]]] = None
+    ):
+        self.blob = blob
+        self.lazy_blob = lazy_blob
+        self._decoders = {
+            _BLOB: lambda value: self.blob(value[1]),
+            _PART: lambda value: _construct(BodyParts, content=self.node(value[1]), content_type=value[2]),
+            _FILE: lambda value: self.file(File, value[1:6]),
+            _MAIL_FILE: lambda value: self.file(MailFile, value[1:6], parsed_obj=self.mail(value[6])),
+            _MAIL: self.mail,
+            _BODY: lambda value: _construct(Body, content=self.node(value[1]), attachments=self.node(value[2])),
+            _FLATTED: lambda value: _construct(
+                FlattedBody,
+                text_body=value[1], html_body=value[2],
+                inline_file=self.node(value[3]), attachments=self.node(value[4])
+            ),
+            _MESSAGE: lambda value: message_from_bytes(self.node(value[1]), policy=default),
+        }
+
+    def node(
+            self,
+            value
+    ):
+        if isinstance(value, tuple):
+            return self._decoders[value[0]](value)
+        if isinstance(value, list):
+            return [self.node(element) for element in value]
+        return value
+
+    def file(
+            self,
+            cls,
+            fields: tuple,
+            **kwargs
+    ) -> File:
+        filename, content, content_type, size, encoding = fields
+        if self.lazy_blob is not None and isinstance(content, tuple) and content[0] == _BLOB:
+            loader, blob_size = self.lazy_blob(content[1])
+            return cls.lazy(
+                loader, filename=filename, content_type=content_type,
+                size=blob_size if size is None else size, encoding=encoding, **kwargs
+            )
+        return _construct(
+            cls,
+            filename=filename, content=self.node(content), content_type=content_type, size=size,
+            encoding=encoding, **kwargs
+        )
+
+    def mail(
+            self,
+            value: Optional[tuple],
+            header: Optional[Header] = None
+    ) -> Optional[MailObject]:
+        if value is None:
+            return None
+        _, encoded_header, body, thread_id = value
+        return _construct(
+            MailObject,
+            header=header if header is not None else _decode_header(encoded_header),
+            body=self.node(body),
+            thread_id=thread_id
+        )
+
+
+def _mails(
+        obj: Serializable
+) -> Tuple[bytes, list]:
+    if isinstance(obj, MailThread):
+        return _KIND_THREAD, list(obj.thread)
+    if isinstance(obj, MailObject):
+        return _KIND_MAIL, [obj]
+    raise SerializationDefect(f"cannot serialize {type(obj).__name__}")
+
+
+def dump(
+        obj: Serializable,
+        fp: BinaryIO
+) -> int:
+    """
+        Write a MailObject or a MailThread to a binary file object
+        :param obj: the mail or the thread, its lazy attachments are loaded except the ones in a PayloadStorage,
+            which are copied chunk by chunk
+        :param fp: a binary file object, as a socket file, only written sequentially
+        :return: the number of bytes written
+    """
+    kind, mails = _mails(obj)
+    encoder = _Encoder()
+    headers, entries = [], []
+    for mail in mails:
+        mail_obj = mail.parsed_obj if isinstance(mail, MailFile) else mail
+        headers.append(_encode_header(mail_obj.header))
+        if isinstance(mail, MailFile):
+            entries.append(encoder.node(mail))
+        else:
+            entries.append(encoder.mail(mail, header=False))
+    if kind == _KIND_THREAD:
+        header_section = marshal.dumps(headers, MARSHAL_VERSION)
+        body_section = marshal.dumps((obj.id, entries), MARSHAL_VERSION)
+    else:
+        header_section = marshal.dumps(headers[0], MARSHAL_VERSION)
+        body_section = marshal.dumps(entries[0], MARSHAL_VERSION)
+    sizes = [blob.size if isinstance(blob, File) else len(blob) for blob in encoder.blobs]
+    fp.write(_PREAMBLE.pack(MAGIC, VERSION, kind, len(header_section), len(body_section)))
+    fp.write(header_section)
+    fp.write(body_section)
+    fp.write(_COUNT.pack(len(sizes)))
+    fp.write(struct.pack(f"<{len(sizes)}Q", *sizes))
+    for blob in encoder.blobs:
+        if isinstance(blob, File):
+            blob.write_to(fp)
+        else:
+            fp.write(blob)
+    return _PREAMBLE.size + len(header_section) + len(body_section) + _COUNT.size + 8 * len(sizes) + sum(sizes)
+
+
+def dumps(
+        obj: Serializable
+) -> bytes:
+    """
+        Serialize a MailObject or a MailThread to bytes
+    """
+    buffer = io.BytesIO()
+    dump(obj, buffer)
+    return buffer.getvalue()
+
+
+def _read(
+        fp: BinaryIO,
+        size: int
+) -> bytes:
+    data = fp.read(size)
+    if len(data) != size:
+        raise SerializationDefect("truncated data")
+    return data
+
+
+def _preamble(
+        fp: BinaryIO
+) -> Tuple[bytes, int, int]:
+    magic, version, kind, header_size, body_size = _PREAMBLE.unpack(_read(fp, _PREAMBLE.size))
+    if magic != MAGIC:
+        raise SerializationDefect("not a serialized mail")
+    if version != VERSION or kind not in (_KIND_MAIL, _KIND_THREAD):
+        raise SerializationDefect(f"unsupported format version {version}")
+    return kind, header_size, body_size
+
+
+def _unmarshal(
+        data: bytes
+):
+    try:
+        return marshal.loads(data)
+    except (EOFError, ValueError, TypeError) as e:
+        raise SerializationDefect("corrupted section") from e
+
+
+def _read_blob(
+        path: str,
+        offset: int,
+        size: int
+) -> bytes:
+    with open(path, "rb") as f:
+        f.seek(offset)
+        return _read(f, size)
+
+
+def _as_file(
+        source: Union[bytes, bytearray, memoryview, str, os.PathLike, BinaryIO]
+) -> Tuple[BinaryIO, bool]:
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source), True
+    if isinstance(source, (str, os.PathLike)):
+        return open(source, "rb"), True
+    return source, False
+
+
+def load_header(
+        source: Union[bytes, bytearray, memoryview, str, os.PathLike, BinaryIO]
+) -> Union[Header, List[Header]]:
+    """
+        Read only the header section, the bodies and the blobs are not read
+        :param source: the serialized bytes, a path or a binary file object positioned at the start of the data
+        :return: the Header of a mail or the list of the Headers of the mails of a thread
+    """
+    fp, owned = _as_file(source)
+    try:
+        kind, header_size, _ = _preamble(fp)
+        headers = _unmarshal(_read(fp, header_size))
+    finally:
+        if owned:
+            fp.close()
+    if kind == _KIND_THREAD:
+        return [_decode_header(header) for header in headers]
+    return _decode_header(headers)
+
+
+def _build(
+        kind: bytes,
+        headers,
+        body,
+        decoder: _Decoder
+) -> Serializable:
+    if kind == _KIND_MAIL:
+        return decoder.mail(body, _decode_header(headers))
+    thread_id, entries = body
+    mails = []
+    for header, entry in zip(headers, entries):
+        if entry[0] == _MAIL:
+            mails.append(decoder.mail(entry, _decode_header(header)))
+        else:
+            mails.append(decoder.node(entry))
+    # sorted and indexed at the first query
+    return MailThread.model_construct(thread=mails, ordered=False, id=thread_id)
+
+
+def _sections(
+        fp: BinaryIO
+) -> Tuple[bytes, tuple, tuple, Tuple[int, ...]]:
+    kind, header_size, body_size = _preamble(fp)
+    headers = _unmarshal(_read(fp, header_size))
+    body = _unmarshal(_read(fp, body_size))
+    count, = _COUNT.unpack(_read(fp, _COUNT.size))
+    sizes = struct.unpack(f"<{count}Q", _read(fp, 8 * count))
+    return kind, headers, body, sizes
+
+
+def load(
+        source: Union[str, os.PathLike, BinaryIO],
+        lazy: bool = False
+) -> Serializable:
+    """
+        Rebuild a MailObject or a MailThread from a file written by dump, without validation
+        :param source: a path or a binary file object positioned at the start of the data, which is read
+            up to its end, so the mails written one after the other on a stream are read one per call
+        :param lazy: with a path, if True the attachments are read from the file only when their content
+            is accessed, so the file must be kept until then
+        :return: the mail or the thread
+    """
+    if isinstance(source, (str, os.PathLike)):
+        path = os.fspath(source)
+        with open(path, "rb") as fp:
+            if not lazy:
+                return load(fp)
+            kind, headers, body, sizes = _sections(fp)
+            offset = fp.tell()
+        offsets = []
+        for size in sizes:
+            offsets.append(offset)
+            offset += size
+        if offset > os.path.getsize(path):
+            raise SerializationDefect("truncated data")
+        decoder = _Decoder(
+            lambda number: _read_blob(path, offsets[number], sizes[number]),
+            lambda number: (partial(_read_blob, path, offsets[number], sizes[number]), sizes[number])
+        )
+        return _build(kind, headers, body, decoder)
+    kind, headers, body, sizes = _sections(source)
+    blobs = [_read(source, size) for size in sizes]
+    return _build(kind, headers, body, _Decoder(blobs.__getitem__))
+
+
+def loads(
+        data: Union[bytes, bytearray, memoryview]
+) -> Serializable:
+    """
+        Rebuild a MailObject or a MailThread from the bytes written by dumps, without validation
+    """
+    return load(io.BytesIO(data))
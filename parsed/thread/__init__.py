@@ -1,8 +1,11 @@
 from .model import MailThread
 from .parser import thread_from_mail, thread_from_string, mail_from_string
+from .corpus import ThreadIndex, thread_corpus
 __all__ = [
     'MailThread',
     'thread_from_string',
     'thread_from_mail',
-    'mail_from_string'
+    'mail_from_string',
+    'ThreadIndex',
+    'thread_corpus'
 ]
\ No newline at end of file
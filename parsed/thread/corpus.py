@@ -0,0 +1,270 @@
+import re
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from parsed.mail import MailObject, MailFile
+from .model import MailThread
+
+# reply and forward prefixes of the common clients: Re:, R:, RIF:, AW:, SV:, RV:, Fwd:, Fw:, I:, WG:, TR:, Re[2]:
+_subject_prefix = re.compile(
+    r"^\s*(?:\[[^\]]*\]\s*)?(?:(re|r|rif|aw|sv|rv|vs|fwd?|i|wg|tr|enc)(?:\[\d+\]|\(\d+\))?\s*:\s*)",
+    re.IGNORECASE
+)
+_spaces = re.compile(r"\s+")
+
+
+def normalize_subject(
+        subject: Optional[str]
+) -> Tuple[str, bool]:
+    """
+        Strip the reply and forward prefixes of a subject
+        :param subject: the subject
+        :return: the normalized subject, lowercase, and True if the subject had a prefix
+    """
+    if not subject:
+        return "", False
+    prefixed = False
+    while True:
+        match = _subject_prefix.match(subject)
+        if match is None:
+            break
+        subject = subject[match.end():]
+        prefixed = True
+    return _spaces.sub(" ", subject).strip().lower(), prefixed
+
+
+class _Container:
+    """
+        A message id of the corpus, with its mail once it has been seen, linked to its parent
+    """
+    __slots__ = ("message_id", "mail", "parent", "order")
+
+    def __init__(self, message_id: str, order: int):
+        self.message_id = message_id
+        self.mail: Optional[MailObject] = None
+        self.parent: Optional["_Container"] = None
+        self.order = order
+
+
+class ThreadIndex:
+    """
+        Threads a corpus of mails by their Message-ID, In-Reply-To and References headers, JWZ style.
+
+        Every message id seen, also only as a reference, gets a container in a hash map and the containers
+        are linked to their parents; the threads are kept in a union-find named by their root message id,
+        so adding a mail costs about the length of its References. The mails without references are joined to the thread of their
+        normalized subject when one of the two subjects is a reply ("Re: ...").
+
+        Mails can be added incrementally: a late mail may join two threads, so the thread_id set by add
+        can change, threads() assigns the final ones.
+
+            index = ThreadIndex()
+            index.add_mails(iter_mbox("archive.mbox"))
+            threads = index.threads()
+    """
+
+    def __init__(
+            self,
+            subjects: bool = True,
+            deduplicate: bool = False,
+            max_distance: int = 3
+    ):
+        """
+            :param subjects: if True the mails without references are threaded by their normalized subject
+            :param deduplicate: if True the copies of a mail already indexed, exact or near duplicates, are not
+                added, they only get the thread_id of their original
+            :param max_distance: maximum number of different SimHash bits of two near duplicates
+        """
+        self.subjects = subjects
+        self.duplicates = 0
+        self._deduplicator = None
+        if deduplicate:
+            from .dedup import Deduplicator
+            self._deduplicator = Deduplicator(max_distance)
+        # container of every indexed mail, by id of the mail
+        self._mail_containers: Dict[int, _Container] = {}
+        self._containers: Dict[str, _Container] = {}
+        # union-find parent of every container, the representative is the root of the thread
+        self._sets: Dict[_Container, _Container] = {}
+        self._subjects: Dict[str, Tuple[_Container, bool]] = {}
+        self._generated = 0
+
+    def _container(
+            self,
+            message_id: str
+    ) -> _Container:
+        container = self._containers.get(message_id)
+        if container is None:
+            container = _Container(message_id, len(self._containers))
+            self._containers[message_id] = container
+            self._sets[container] = container
+        return container
+
+    def _find(
+            self,
+            container: _Container
+    ) -> _Container:
+        sets = self._sets
+        root = container
+        while sets[root] is not root:
+            root = sets[root]
+        while sets[container] is not root:
+            sets[container], container = root, sets[container]
+        return root
+
+    def _union(
+            self,
+            first: _Container,
+            second: _Container
+    ):
+        """
+            Join the thread of second to the thread of first, whose representative names the joined thread
+        """
+        first, second = self._find(first), self._find(second)
+        if first is not second:
+            self._sets[second] = first
+
+    @staticmethod
+    def _is_ancestor(
+            container: _Container,
+            other: _Container
+    ) -> bool:
+        while other is not None:
+            if other is container:
+                return True
+            other = other.parent
+        return False
+
+    def _link(
+            self,
+            parent: _Container,
+            child: _Container
+    ):
+        # a child keeps its first parent and no link may close a loop
+        if child.parent is None and parent is not child and not self._is_ancestor(child, parent):
+            child.parent = parent
+        self._union(parent, child)
+
+    def add(
+            self,
+            mail: Union[MailObject, MailFile]
+    ) -> str:
+        """
+            Add a mail to the index and set its thread_id
+            :param mail: a MailObject or a MailFile
+            :return: the current id of the thread of the mail
+        """
+        if isinstance(mail, MailFile):
+            mail = mail.parsed_obj
+        if self._deduplicator is not None:
+            original = self._deduplicator.original(mail)
+            if original is not None:
+                self.duplicates += 1
+                mail.thread_id = self._find(self._mail_containers[id(original)]).message_id
+                return mail.thread_id
+        header = mail.header
+        message_id = header.MessageID
+        known = self._containers.get(message_id) if message_id else None
+        if message_id is None or known is not None and known.mail is not None:
+            # no id, or a copy with the id of a mail already indexed
+            self._generated += 1
+            message_id = f"<generated-{self._generated}>"
+        container = self._container(message_id)
+        container.mail = mail
+        self._mail_containers[id(mail)] = container
+
+        references = list(header.References or [])
+        if header.InReplyTo and header.InReplyTo not in references:
+            references.append(header.InReplyTo)
+        previous = None
+        for reference in references:
+            if reference == message_id:
+                continue
+            current = self._container(reference)
+            if previous is not None:
+                self._link(previous, current)
+            previous = current
+        if previous is not None:
+            # the last reference is the parent, whatever an older mail said
+            if container.parent is not None and not self._is_ancestor(container, previous):
+                container.parent = None
+            self._link(previous, container)
+        elif self.subjects:
+            self._thread_by_subject(container, header.Subject)
+
+        mail.thread_id = self._find(container).message_id
+        return mail.thread_id
+
+    def _thread_by_subject(
+            self,
+            container: _Container,
+            subject: Optional[str]
+    ):
+        key, reply = normalize_subject(subject)
+        if not key:
+            return
+        known = self._subjects.get(key)
+        if known is None:
+            self._subjects[key] = (container, reply)
+            return
+        other, other_reply = known
+        if reply:
+            self._union(other, container)
+        elif other_reply:
+            # the original mail names the thread and the subject from now on
+            self._union(container, other)
+            self._subjects[key] = (container, reply)
+
+    def add_mails(
+            self,
+            mails: Iterable[Union[MailObject, MailFile]]
+    ):
+        for mail in mails:
+            self.add(mail)
+
+    def thread_id(
+            self,
+            message_id: str
+    ) -> Optional[str]:
+        """
+            The current thread id of a message id, None if it is not in the index
+        """
+        container = self._containers.get(message_id)
+        if container is None:
+            return None
+        return self._find(container).message_id
+
+    def threads(self) -> List[MailThread]:
+        """
+            Build a MailThread for every thread of the index and set the final thread_id of the mails
+            :return: the threads, in order of their oldest message id, the mails by date
+        """
+        mails: Dict[_Container, List[MailObject]] = {}
+        for container in self._containers.values():
+            if container.mail is not None:
+                mails.setdefault(self._find(container), []).append(container.mail)
+        threads = []
+        for root in sorted(mails, key=lambda root: root.order):
+            thread = MailThread(id=root.message_id)
+            thread.add_mails(mails[root])
+            threads.append(thread)
+        return threads
+
+    def __len__(self):
+        return sum(1 for container in self._containers.values() if container.mail is not None)
+
+
+def thread_corpus(
+        mails: Iterable[Union[MailObject, MailFile]],
+        subjects: bool = True,
+        deduplicate: bool = False
+) -> List[MailThread]:
+    """
+        Thread a batch of parsed mails by their Message-ID, In-Reply-To and References headers
+        :param mails: MailObject or MailFile
+        :param subjects: if True the mails without references are threaded by their normalized subject
+        :param deduplicate: if True the exact and near duplicate mails are left out of the threads
+        :return: the threads, every mail has the thread_id of its thread
+    """
+    index = ThreadIndex(subjects, deduplicate)
+    index.add_mails(mails)
+    return index.threads()
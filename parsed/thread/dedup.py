@@ -0,0 +1,206 @@
+import hashlib
+import re
+from array import array
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from parsed.mail import MailObject, MailFile, EmailAddress
+from parsed.mail.model import FlattedBody
+from parsed.mail.parsing_utils import get_body
+from .corpus import normalize_subject
+
+DEFAULT_MAX_DISTANCE = 3
+SHINGLE_SIZE = 3
+
+_word = re.compile(r"\w+")
+_quoted_line = re.compile(r"^[ \t]*>.*$", re.MULTILINE)
+_tag = re.compile(r"<[^>]*>")
+# the first quoted header, as located by parsed.thread.parser.thread_spans
+_thread_boundary = re.compile("Da:|From:")
+_MASK = (1 << 64) - 1
+_MULTIPLIER = 0x9E3779B97F4A7C15
+# for every bit of a byte, the byte values having it set
+_WITH_BIT = [bytes(value for value in range(256) if value >> bit & 1) for bit in range(8)]
+
+
+def own_text(
+        mail: MailObject
+) -> str:
+    """
+        The text written in a mail, without the quoted lines and the quoted mails that follow it
+    """
+    if isinstance(mail.body, FlattedBody):
+        text = mail.body.text_body or _tag.sub(" ", mail.body.html_body or "")
+    else:
+        text = get_body(mail, "text/plain")
+        if text is None:
+            text = _tag.sub(" ", get_body(mail, "text/html") or "")
+    if isinstance(text, bytes):
+        text = text.decode(errors="replace")
+    boundary = _thread_boundary.search(text)
+    if boundary is not None and boundary.start() > 0:
+        text = text[:boundary.start()]
+    return _quoted_line.sub("", text)
+
+
+@lru_cache(maxsize=65536)
+def _word_hash(
+        word: str
+) -> int:
+    return int.from_bytes(hashlib.blake2b(word.encode(), digest_size=8).digest(), "little")
+
+
+def simhash(
+        words: List[str],
+        shingle_size: int = SHINGLE_SIZE
+) -> int:
+    """
+        64 bit SimHash of the word shingles of a text, close texts have hashes differing in few bits
+    """
+    hashes = [_word_hash(word) for word in words]
+    size = min(shingle_size, len(hashes))
+    # rolling polynomial hash of the shingles, every word is hashed once
+    leading = pow(_MULTIPLIER, size - 1, 1 << 64)
+    value = 0
+    for word_hash in hashes[:size]:
+        value = (value * _MULTIPLIER + word_hash) & _MASK
+    shingles = [value ^ value >> 32]
+    for old, new in zip(hashes, hashes[size:]):
+        value = ((value - old * leading) * _MULTIPLIER + new) & _MASK
+        shingles.append(value ^ value >> 32)
+    digests = array("Q", shingles).tobytes()
+    half = len(shingles) / 2
+    simhash_value = 0
+    for position in range(8):
+        # the bytes of all the shingles at this position, the bits are counted by deleting the bytes without them
+        column = digests[position::8]
+        for bit in range(8):
+            if len(column) - len(column.translate(None, _WITH_BIT[bit])) > half:
+                simhash_value |= 1 << (position * 8 + bit)
+    return simhash_value
+
+
+def _bands(
+        max_distance: int
+) -> List[Tuple[int, int]]:
+    """
+        Split the 64 bits in max_distance + 1 bands: two hashes within max_distance bits agree on a whole band
+    """
+    count = max_distance + 1
+    edges = [round(64 * i / count) for i in range(count + 1)]
+    return [(start, (1 << (end - start)) - 1) for start, end in zip(edges, edges[1:])]
+
+
+class Fingerprint:
+    __slots__ = ("message_id", "exact", "simhash", "block")
+
+    def __init__(
+            self,
+            message_id: Optional[str],
+            exact: Optional[bytes],
+            simhash: Optional[int],
+            block: Tuple[str, str]
+    ):
+        self.message_id = message_id
+        self.exact = exact
+        self.simhash = simhash
+        self.block = block
+
+
+def fingerprint(
+        mail: MailObject,
+        shingle_size: int = SHINGLE_SIZE
+) -> Fingerprint:
+    """
+        Exact hash of the normalized own text, SimHash of its shingles and blocking key (sender, normalized subject)
+    """
+    words = _word.findall(own_text(mail).lower())
+    sender = mail.header.From
+    block = (
+        sender.address.lower() if isinstance(sender, EmailAddress) and sender.address else "",
+        normalize_subject(mail.header.Subject)[0]
+    )
+    if not words:
+        # no text to compare, only the message id can tell a copy
+        return Fingerprint(mail.header.MessageID, None, None, block)
+    exact = hashlib.blake2b(" ".join(words).encode(), digest_size=16).digest()
+    return Fingerprint(mail.header.MessageID, exact, simhash(words, shingle_size), block)
+
+
+class Deduplicator:
+    """
+        Finds the copies of the mails already seen: same Message-ID, same normalized text, or text whose
+        SimHash differs in at most max_distance bits, as the copy of a mail quoted in a reply.
+
+        The near duplicates are looked up only among the mails with the same sender and normalized subject,
+        and among them only in the SimHash bands that match exactly, so the cost stays about linear.
+    """
+
+    def __init__(
+            self,
+            max_distance: int = DEFAULT_MAX_DISTANCE,
+            shingle_size: int = SHINGLE_SIZE
+    ):
+        """
+            :param max_distance: maximum number of different SimHash bits of two near duplicates, 0 for exact only
+            :param shingle_size: words in a shingle
+        """
+        self.max_distance = max_distance
+        self.shingle_size = shingle_size
+        self._bands = _bands(max_distance)
+        self._ids: Dict[str, MailObject] = {}
+        self._exact: Dict[bytes, MailObject] = {}
+        self._near: Dict[Tuple, List[Tuple[int, MailObject]]] = {}
+
+    def original(
+            self,
+            mail: Union[MailObject, MailFile]
+    ) -> Optional[MailObject]:
+        """
+            The mail already seen that mail is a copy of, None if it is new; a new mail is remembered
+        """
+        if isinstance(mail, MailFile):
+            mail = mail.parsed_obj
+        mark = fingerprint(mail, self.shingle_size)
+        if mark.message_id is not None and mark.message_id in self._ids:
+            return self._ids[mark.message_id]
+        if mark.exact is not None and mark.exact in self._exact:
+            return self._exact[mark.exact]
+        keys = []
+        if mark.simhash is not None and self.max_distance:
+            keys = [(mark.block, index, mark.simhash >> shift & mask) for index, (shift, mask) in enumerate(self._bands)]
+            for key in keys:
+                for value, seen in self._near.get(key, ()):
+                    if (value ^ mark.simhash).bit_count() <= self.max_distance:
+                        return seen
+        if mark.message_id is not None:
+            self._ids[mark.message_id] = mail
+        if mark.exact is not None:
+            self._exact[mark.exact] = mail
+        for key in keys:
+            self._near.setdefault(key, []).append((mark.simhash, mail))
+        return None
+
+    def unique(
+            self,
+            mails: Iterable[Union[MailObject, MailFile]]
+    ) -> Iterator[Union[MailObject, MailFile]]:
+        """
+            Yield the mails that are not a copy of a mail yielded before
+        """
+        for mail in mails:
+            if self.original(mail) is None:
+                yield mail
+
+
+def deduplicate(
+        mails: Iterable[Union[MailObject, MailFile]],
+        max_distance: int = DEFAULT_MAX_DISTANCE
+) -> List[Union[MailObject, MailFile]]:
+    """
+        Drop the exact and near duplicates of a list of mails, the first copy of every mail is kept
+        :param mails: MailObject or MailFile
+        :param max_distance: maximum number of different SimHash bits of two near duplicates, 0 for exact only
+        :return: the mails without the copies
+    """
+    return list(Deduplicator(max_distance).unique(mails))
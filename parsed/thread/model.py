@@ -1,30 +1,238 @@
-from typing import Union, List, Optional
+import math
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime
+from typing import Union, List, Optional, Dict, Tuple
 
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 
-from parsed.mail import MailObject, MailFile
+from parsed.dates import received_timestamp
+from parsed.mail import MailObject, MailFile, EmailAddress
+
+ThreadMail = Union[MailObject, MailFile]
+# (timestamp, insertion sequence, mail): the sequence is unique, the mails are never compared
+_Entry = Tuple[float, int, ThreadMail]
+
+
+def _mail_obj(
+        mail: ThreadMail
+) -> MailObject:
+    return mail.parsed_obj if isinstance(mail, MailFile) else mail
+
+
+def _addresses(
+        addresses: Optional[Union[List[EmailAddress], EmailAddress]]
+) -> List[str]:
+    if addresses is None:
+        return []
+    if isinstance(addresses, EmailAddress):
+        addresses = [addresses]
+    return [address.address.lower() for address in addresses if address.address]
+
+
+def _bound(
+        date: Optional[Union[datetime, str, float]],
+        default: float
+) -> float:
+    if date is None:
+        return default
+    if isinstance(date, (int, float)):
+        return date
+    return received_timestamp(date)
 
 
 class MailThread(BaseModel):
     """
-        Represents a mail thread
+        Represents a mail thread, ordered by the Received date of the mails.
+
+        The mails are kept sorted by a normalized timestamp, the naive dates taken as UTC, the ones given as
+        strings parsed, the missing ones last; mails with the same date keep their insertion order.
+        A mail is inserted by binary search and the thread keeps indexes by sender and by participant, so the
+        queries do not scan the whole thread:
+
+            thread.by_sender("mario.rossi@example.com", start=datetime(2024, 3, 1))
+            thread[datetime(2024, 3, 1):datetime(2024, 4, 1)]
+
+        After editing the list directly call sort(); a thread sorted in reverse is sorted again at the next
+        insertion or query.
     """
-    thread: List[Union[MailObject, MailFile]] = []
+    thread: List[ThreadMail] = []
     ordered: bool = False
     id: Optional[Union[str, int]] = None
+    _keys: List[Tuple[float, int]] = PrivateAttr(default_factory=list)
+    _senders: Dict[str, List[_Entry]] = PrivateAttr(default_factory=dict)
+    _participants: Dict[str, List[_Entry]] = PrivateAttr(default_factory=dict)
+    _sequence: int = PrivateAttr(default=0)
+    _reversed: bool = PrivateAttr(default=False)
+
+    def _index(
+            self,
+            entries: List[_Entry]
+    ):
+        senders_index, participants_index = self._senders, self._participants
+        for entry in entries:
+            header = _mail_obj(entry[2]).header
+            senders = _addresses(header.From)
+            for address in senders:
+                insort(senders_index.setdefault(address, []), entry)
+            for address in set(senders + _addresses(header.To) + _addresses(header.Cc)):
+                insort(participants_index.setdefault(address, []), entry)
 
     def sort(self, reverse: bool = False):
-        self.thread.sort(reverse=reverse)
-        self.ordered = True
+        """
+            Sort the thread and rebuild its indexes
+            :param reverse: if True the list is left from the newest mail, it is sorted again at the next insertion
+        """
+        # the mails with the same date keep their insertion order, also when the list was left reversed
+        mails = reversed(self.thread) if self._reversed else self.thread
+        entries = sorted(
+            (_mail_obj(mail).sort_key(), sequence, mail) for sequence, mail in enumerate(mails, 1)
+        )
+        self._sequence = len(entries)
+        self._keys = [(timestamp, sequence) for timestamp, sequence, _ in entries]
+        self._senders.clear()
+        self._participants.clear()
+        self._index(entries)
+        self.thread = [mail for _, _, mail in entries]
+        self.ordered = not reverse
+        self._reversed = reverse
+        if reverse:
+            self.thread.reverse()
+
+    def _ensure_sorted(self):
+        if not self.ordered or len(self._keys) != len(self.thread):
+            self.sort()
 
     def __len__(self):
         return len(self.thread)
 
+    def __getitem__(
+            self,
+            item: Union[int, slice]
+    ) -> Union[ThreadMail, List[ThreadMail]]:
+        """
+            thread[i] is the i-th mail by date, thread[start:end] the mails received in [start, end)
+            when start and end are datetimes or date strings
+        """
+        self._ensure_sorted()
+        if isinstance(item, slice) and not (
+                isinstance(item.start, (int, type(None))) and isinstance(item.stop, (int, type(None)))
+        ):
+            return self.between(item.start, item.stop)
+        return self.thread[item]
+
     def add_mail(self, mail: Union[MailObject, MailFile]):
-        mail.thread_id = self.id
-        self.thread.append(mail)
+        self._ensure_sorted()
+        _mail_obj(mail).thread_id = self.id
+        self._sequence += 1
+        key = (_mail_obj(mail).sort_key(), self._sequence)
+        keys = self._keys
+        position = bisect_right(keys, key)
+        keys.insert(position, key)
+        self.thread.insert(position, mail)
+        self._index([(*key, mail)])
 
     def add_mails(self, mails: List[MailObject]):
+        mails = list(mails)
+        if len(mails) <= len(self.thread):
+            for mail in mails:
+                self.add_mail(mail)
+            return
+        # a batch larger than the thread is cheaper to sort at once
+        self._ensure_sorted()
         for mail in mails:
-            mail.thread_id = self.id
+            _mail_obj(mail).thread_id = self.id
         self.thread.extend(mails)
+        self.sort()
+
+    def _range(
+            self,
+            start: Optional[Union[datetime, str, float]],
+            end: Optional[Union[datetime, str, float]]
+    ) -> Tuple[Tuple[float], Tuple[float]]:
+        # the keys (timestamp, sequence) sort after (timestamp,) and before (timestamp + anything,)
+        return (_bound(start, -math.inf),), (_bound(end, math.inf),)
+
+    def between(
+            self,
+            start: Optional[Union[datetime, str, float]] = None,
+            end: Optional[Union[datetime, str, float]] = None
+    ) -> List[ThreadMail]:
+        """
+            The mails received in [start, end), by date
+            :param start: first date, the naive ones taken as UTC, from the oldest mail if None
+            :param end: date excluded, up to the newest dated mail if None; the mails without date are never returned
+        """
+        self._ensure_sorted()
+        low, high = self._range(start, end)
+        return self.thread[bisect_left(self._keys, low):bisect_left(self._keys, high)]
+
+    def _lookup(
+            self,
+            index: Dict[str, List[_Entry]],
+            address: str,
+            start: Optional[Union[datetime, str, float]],
+            end: Optional[Union[datetime, str, float]]
+    ) -> List[ThreadMail]:
+        self._ensure_sorted()
+        entries = index.get(address.lower(), [])
+        if start is None and end is None:
+            return [mail for _, _, mail in entries]
+        low, high = self._range(start, end)
+        return [mail for _, _, mail in entries[bisect_left(entries, low):bisect_left(entries, high)]]
+
+    def by_sender(
+            self,
+            address: str,
+            start: Optional[Union[datetime, str, float]] = None,
+            end: Optional[Union[datetime, str, float]] = None
+    ) -> List[ThreadMail]:
+        """
+            The mails sent by an address, by date, optionally received in [start, end)
+        """
+        return self._lookup(self._senders, address, start, end)
+
+    def by_participant(
+            self,
+            address: str,
+            start: Optional[Union[datetime, str, float]] = None,
+            end: Optional[Union[datetime, str, float]] = None
+    ) -> List[ThreadMail]:
+        """
+            The mails having an address as sender, recipient or in cc, by date, optionally received in [start, end)
+        """
+        return self._lookup(self._participants, address, start, end)
+
+    def senders(self) -> List[str]:
+        self._ensure_sorted()
+        return list(self._senders)
+
+    def participants(self) -> List[str]:
+        self._ensure_sorted()
+        return list(self._participants)
+
+    def deduplicate(self, max_distance: int = 3) -> int:
+        """
+            Remove the copies of the same mail, as an attached .eml and its quote in a reply;
+            of every mail the oldest copy is kept, or the oldest one with a Message-ID
+            :param max_distance: maximum number of different SimHash bits of two near duplicates, 0 for exact only
+            :return: the number of mails removed
+        """
+        from .dedup import Deduplicator
+
+        self._ensure_sorted()
+        deduplicator = Deduplicator(max_distance)
+        positions = {}
+        unique = []
+        for mail in self.thread:
+            original = deduplicator.original(mail)
+            mail_obj = _mail_obj(mail)
+            if original is None:
+                positions[id(mail_obj)] = len(unique)
+                unique.append(mail)
+            elif original.header.MessageID is None and mail_obj.header.MessageID is not None:
+                unique[positions[id(original)]] = mail
+        removed = len(self.thread) - len(unique)
+        if removed:
+            self.thread = unique
+            self.sort()
+        return removed
@@ -1,8 +1,13 @@
-from typing import Optional, List
+import re
+from bisect import bisect_left
+from enum import Enum
+from typing import Optional, List, Dict, Tuple, Type
 
-from parsed.mail import MailObject, Body, BodyParts, Header
-from parsed.mail.parser import get_body, get_email_address
-from parsed.utils import strp_ita_string
+from parsed.mail import MailObject, Body, BodyParts, Header, EmailAddress, MailFile
+from parsed.mail.model import FlattedBody
+from parsed.mail.parsing_utils import get_body, get_email_address, first_address
+from parsed.dates import parse_date
+from parsed.instrumentation import stage
 from .enums import MailLangBounds
 from .model import MailThread
 
@@ -40,62 +45,134 @@ def get_bounded_value(
     return bounded_value
 
 
-def mail_from_string(
-        mail_str: str
-) -> MailObject:
-    bounds = MailLangBounds.ENG.value if mail_str[:5] == "From:" else MailLangBounds.ITA.value
+Span = Tuple[int, int]
 
-    sender = get_bounded_value(
-        mail_str,
-        bounds.FROM
-    )
-    sender = get_email_address(sender)
 
-    received = get_bounded_value(
-        mail_str,
-        bounds.RECEIVED
-    )
+def _field_scanner(
+        bounds: Type[Enum]
+) -> Tuple[re.Pattern, Dict[str, List[str]]]:
+    markers = {
+        guardian
+        for field in (bounds.FROM, bounds.RECEIVED, bounds.TO, bounds.CC, bounds.SUB_BODY)
+        for bound_tuple in field.value
+        for guardian in bound_tuple
+        if guardian is not None
+    }
+    # the longest markers first, a match also counts for the markers that are its prefix ("Subject: ", "Subject")
+    pattern = re.compile("|".join(map(re.escape, sorted(markers, key=len, reverse=True))))
+    prefixes = {marker: [prefix for prefix in markers if marker.startswith(prefix)] for marker in markers}
+    return pattern, prefixes
 
-    if received:
-        received = received.strip()
-        try:
-            received = strp_ita_string(received)
-        except Exception:
-            received = strp_ita_string(received, "%A, %B %d, %Y %I:%M:%S %p")
 
-    to = get_bounded_value(
-        mail_str,
-        bounds.TO
-    )
-    to = get_email_address(to)
+_field_scanners = {lang.value: _field_scanner(lang.value) for lang in MailLangBounds}
+_thread_boundary = re.compile("Da:|From:")
 
-    cc = get_bounded_value(
-        mail_str,
-        bounds.CC
-    )
-    cc = get_email_address(cc)
 
-    subject_and_body = get_bounded_value(
-        mail_str,
-        bounds.SUB_BODY
+def _bounded_span(
+        positions: Dict[str, List[int]],
+        bounds: Enum,
+        start: int,
+        end: int
+) -> Optional[Span]:
+    for first, second in bounds.value:
+        if first is None:
+            value_start = start
+        elif first in positions:
+            value_start = positions[first][0] + len(first)
+        else:
+            continue
+        if second is None:
+            return value_start, end
+        occurrences = positions.get(second, ())
+        index = bisect_left(occurrences, value_start)
+        if index < len(occurrences) and occurrences[index] > value_start:
+            return value_start, occurrences[index]
+    return None
+
+
+def mail_field_spans(
+        text: str,
+        start: int = 0,
+        end: Optional[int] = None
+) -> Dict[str, Optional[Span]]:
+    """
+        Locate the fields of a quoted mail with a single scan of text[start:end]
+        :param text: the text containing the quoted mail
+        :param start: start of the quoted mail in text
+        :param end: end of the quoted mail in text, defaults to the end of text
+        :return: a dict with the (start, end) offsets in text of FROM, RECEIVED, TO, CC, SUBJECT and BODY,
+            None for the fields not found
+    """
+    end = len(text) if end is None else end
+    bounds = MailLangBounds.ENG.value if text.startswith("From:", start) else MailLangBounds.ITA.value
+    pattern, prefixes = _field_scanners[bounds]
+
+    positions: Dict[str, List[int]] = {}
+    for match in pattern.finditer(text, start, end):
+        for marker in prefixes[match.group()]:
+            positions.setdefault(marker, []).append(match.start())
+
+    spans = {
+        field.name: _bounded_span(positions, field, start, end)
+        for field in (bounds.FROM, bounds.RECEIVED, bounds.TO, bounds.CC)
+    }
+    subject, body = None, None
+    sub_body = _bounded_span(positions, bounds.SUB_BODY, start, end)
+    if sub_body is not None:
+        new_line = text.find("\n", *sub_body)
+        if new_line != -1:
+            subject = sub_body[0], new_line
+            body = new_line + 1, sub_body[1]
+    spans[bounds.SUBJECT.name] = subject
+    spans[bounds.BODY.name] = body
+    return spans
+
+
+def _span_value(
+        text: str,
+        span: Optional[Span]
+) -> Optional[str]:
+    if span is None:
+        return None
+    return text[span[0]:span[1]]
+
+
+def _mail_from_span(
+        text: str,
+        start: int,
+        end: int,
+        source: Optional[str] = None
+) -> MailObject:
+    spans = mail_field_spans(text, start, end)
+
+    sender = first_address(get_email_address(
+        _span_value(text, spans["FROM"])
+    ))
+
+    # the quoted headers are written by the client of the replier, not of the quoted sender
+    received = parse_date(
+        _span_value(text, spans["RECEIVED"]),
+        source=source
     )
-    subject = get_bounded_value(
-        subject_and_body,
-        bounds.SUBJECT
+
+    to = get_email_address(
+        _span_value(text, spans["TO"])
     )
 
-    body = get_bounded_value(
-        subject_and_body,
-        bounds.BODY
+    cc = get_email_address(
+        _span_value(text, spans["CC"])
     )
 
-    body = Body(
-        content=[BodyParts(
-            content=body,
+    subject = _span_value(text, spans["SUBJECT"])
+
+    body = Body.model_construct(
+        content=[BodyParts.model_construct(
+            content=_span_value(text, spans["BODY"]),
             content_type="text/plain"
         )]
     )
 
+    # the header fields are scraped from free text, so they are still validated
     header = Header(
         From=sender,
         To=to,
@@ -104,70 +181,100 @@ def mail_from_string(
         Cc=cc
     )
 
-    return MailObject(
+    return MailObject.model_construct(
         header=header,
         body=body
     )
 
 
+def mail_from_string(
+        mail_str: str
+) -> MailObject:
+    return _mail_from_span(mail_str, 0, len(mail_str))
+
+
+@stage("thread_from_string")
 def thread_from_string(
-        mail_text: str
+        mail_text: str,
+        source: Optional[str] = None
 ) -> Optional[MailThread]:
     """
         Parses a mail string and if the text is valid, returns a MailThread object
         :param mail_text: text of the mail
+        :param source: address of the sender of the mail quoting the thread, whose client wrote the quoted dates
         :return: MailThread object or None if text does not contain thread information
     """
-    split_text = split_thread_text(mail_text)
-    if split_text:
+    spans = thread_spans(mail_text)
+    if spans:
         thread = MailThread()
-        for str_token in split_text:
-            if str_token != "":
-                mail = mail_from_string(str_token)
+        for start, end in spans:
+            if end > start:
+                mail = _mail_from_span(mail_text, start, end, source)
                 if mail is not None:
                     thread.add_mail(mail)
         return thread
 
 
-def thread_from_mail(
+def _attached_mails(
         mail: MailObject
+) -> List[MailObject]:
+    """
+        The mails attached to a mail, whether its body is flatted or not
+    """
+    if isinstance(mail.body, FlattedBody):
+        files = (mail.body.attachments or []) + (mail.body.inline_file or [])
+        mails = [file.parsed_obj for file in files if isinstance(file, MailFile)]
+    else:
+        mails = mail.body.mails()
+    return [attached for attached in mails if attached is not None]
+
+
+@stage("thread_from_mail")
+def thread_from_mail(
+        mail: MailObject,
+        deduplicate: bool = True
 ) -> Optional[MailThread]:
     """
         Recursively parses a mail object, getting the text from the body and all the eml file in the
         attachments, and gathers all the mails into a MailThread object
         :param mail: Mail object
+        :param deduplicate: if True a mail found both as attached eml and as quoted text is kept once
         :return: MailThread object or None
     """
     mail_thread = MailThread()
-    mails = mail.body.mails()
+    mails = _attached_mails(mail)
     mails.append(mail)
     for mail in mails:
         mail_thread.add_mail(mail)
         text: str = get_body(mail, "text/plain")
-        thread = thread_from_string(text)
+        if not text:
+            continue
+        sender = mail.header.From if mail.header is not None else None
+        thread = thread_from_string(text, sender.address if isinstance(sender, EmailAddress) else None)
         if thread:
             mail_thread.add_mails(thread.thread)
+    if deduplicate:
+        mail_thread.deduplicate()
     return mail_thread
 
 
-def split_thread_text(
+def thread_spans(
         text: str
-) -> Optional[List[str]]:
+) -> List[Span]:
+    """
+        Locate the quoted mails of a thread with a single scan of the text
+        :param text: text of the mail
+        :return: the (start, end) offsets of every quoted mail, each one starting at a "Da:" or "From:"
+    """
+    boundaries = [match.start() for match in _thread_boundary.finditer(text)]
+    boundaries.append(len(text))
+    return list(zip(boundaries, boundaries[1:]))
 
-    confronto = [text.find("Da:"), text.find("From:")]
-    confronto = list(filter(lambda x: x >= 0, confronto))
 
-    if not confronto:
+def split_thread_text(
+        text: str
+) -> Optional[List[str]]:
+    spans = thread_spans(text)
+    if not spans:
         return
-
-    confronto = min(confronto)
-    i = confronto + 1
-    text_len = len(text)
-    splitted_text = []
-    while i < text_len:
-        j = [text.find("Da:", i), text.find("From:", i)]
-        j = list(filter(lambda x: x >= 0, j))
-        j = min(j) if j else text_len
-        splitted_text.append(text[i - 1:j])
-        i = j + 1
-    return splitted_text
+    return [text[start:end] for start, end in spans]
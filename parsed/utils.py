@@ -1,54 +1,292 @@
 import io
-import os
+import re
 import subprocess
+from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import datetime
+from functools import partial
 from os.path import splitext as os_split_extension
-from tempfile import NamedTemporaryFile
-from zipfile import ZipFile
+from typing import List, Callable, BinaryIO, Optional
+from zipfile import ZipFile, ZipInfo
 
 from parsed.file.model import File
+from parsed.file.storage import current_storage
+from parsed.instrumentation import stage
+from parsed.limits import current_limits, current_budget, exceeded
+from parsed.mail.exceptions import ArchiveLimitExceeded, AttachmentDepthExceeded, ExpansionRatioExceeded, \
+    SubprocessTimeout
+from parsed.pkcs7 import signed_content, PKCS7Error
 
 
+OPENSSL_UNWRAP_COMMAND = ["openssl", "smime", "-verify", "-noverify", "-inform", "DER"]
+
+_openssl_fallback: ContextVar[bool] = ContextVar("parsed_openssl_fallback", default=True)
+
+
+@contextmanager
+def openssl_fallback(
+        enabled: bool
+):
+    """
+        Enable or disable, in the current context, the openssl fallback of unwrap_p7m.
+        While disabled the p7m that cannot be unwrapped in process are left signed.
+    """
+    token = _openssl_fallback.set(enabled)
+    try:
+        yield
+    finally:
+        _openssl_fallback.reset(token)
+
+
+def openssl_fallback_enabled() -> bool:
+    """
+        False while the openssl fallback of unwrap_p7m is disabled in the current context
+    """
+    return _openssl_fallback.get()
+
+
+def openssl_unwrap_p7m(
+        content: bytes,
+        timeout: Optional[float] = None
+) -> bytes:
+    """
+        Extract the signed content of a p7m with an openssl subprocess
+        :param content: the p7m content
+        :param timeout: seconds given to openssl, None to wait for it
+        :return: the signed content
+        :raise PKCS7Error: if openssl is missing or fails to unwrap the p7m
+        :raise SubprocessTimeout: if openssl runs past timeout
+    """
+    try:
+        out = subprocess.run(OPENSSL_UNWRAP_COMMAND, input=content, check=True, capture_output=True, timeout=timeout)
+    except subprocess.TimeoutExpired as e:
+        raise SubprocessTimeout(f"openssl did not unwrap the p7m in {timeout} seconds") from e
+    except subprocess.CalledProcessError as e:
+        raise PKCS7Error(f"openssl failed to unwrap the p7m: {e.stderr.decode(errors='replace').strip()}") from e
+    except OSError as e:
+        raise PKCS7Error(f"openssl cannot be run: {e}") from e
+    return out.stdout or b""
+
+
+@stage("unwrap_p7m")
+def unwrap_p7m(
+        content: bytes
+) -> bytes:
+    """
+        Extract the signed content of a p7m, in process when possible and with openssl otherwise
+        :param content: the p7m content
+        :return: the signed content
+        :raise PKCS7Error: if the p7m can be unwrapped neither in process nor with openssl
+        :raise SubprocessTimeout: if openssl runs past the subprocess_timeout of the active ParseLimits
+    """
+    try:
+        return signed_content(content)
+    except PKCS7Error:
+        if not openssl_fallback_enabled():
+            raise
+        limits = current_limits()
+        return openssl_unwrap_p7m(content, limits.subprocess_timeout if limits is not None else None)
+
+
+def _unwrap_on_load(
+        attachment: File,
+        content: bytes
+) -> bytes:
+    """
+        Unwrap the content of a lazy p7m on first access, renaming the attachment only if it succeeds
+    """
+    try:
+        unwrapped = unwrap_p7m(content)
+    except PKCS7Error:
+        return content
+    except SubprocessTimeout as e:
+        exceeded(e)
+        return content
+    attachment.filename = os_split_extension(attachment.filename)[0]
+    return unwrapped
+
+
+@stage("extract_p7m")
 def extract_p7m(
-        attachment: File
+        attachment: File,
+        lazy: bool = False
 ):
-    with NamedTemporaryFile(suffix=attachment.extension) as temp_file:
-        temp_file.write(attachment.content)
-        command = f"openssl smime -verify -noverify -in {temp_file.name} -inform DER"
-        out = subprocess.run(command, shell=True, check=True, capture_output=True)
-    attachment.content = out.stdout or ""
+    """
+        Replace the content of a p7m attachment with the signed content
+        :param attachment: the p7m attachment
+        :param lazy: if True the content is unwrapped on first access, the attachment keeps the .p7m extension
+            until then
+        :return: the attachment, named without the .p7m extension, or left signed if it cannot be
+            unwrapped, in process or with openssl while the fallback is enabled, or if openssl times out while
+            the active ParseLimits degrade
+    """
+    if lazy:
+        attachment.size = None
+        attachment.defer(partial(_unwrap_on_load, attachment))
+        return attachment
+    try:
+        content = unwrap_p7m(attachment.content)
+    except PKCS7Error:
+        return attachment
+    except SubprocessTimeout as e:
+        exceeded(e)
+        return attachment
     attachment.filename = os_split_extension(attachment.filename)[0]
+    attachment.content = content
+    attachment.size = len(content)
     return attachment
 
 
-def unzip_attachments(
-        attachment: File
-):
-    attachments = []
-    with ZipFile(io.BytesIO(attachment.content)) as zip_ref:
-        for sub_file in zip_ref.filelist:
-            extraction_path = zip_ref.extract(sub_file)
-            # @TODO WE HAVE TO HANDLE WHEN THEN EXTRACTED ELEMENT IS A DIRECTORY AND
-            #  TAKE ALL THE FILE OUT OF IT
-            if not os.path.isdir(extraction_path):
-                with open(
-                        extraction_path,
-                        "rb"
-                ) as f:
-                    content = f.read()
+ZIP_MAX_MEMBERS = 10_000
+ZIP_MAX_SIZE = 1 << 30
+ZIP_MAX_DEPTH = 4
+# smaller members are not checked for their ratio, small text files compress well without being bombs
+ZIP_RATIO_MIN_SIZE = 1 << 20
 
-                attachments.append(
-                    File(
-                        filename=sub_file.filename,
-                        content_type=f"application/{sub_file.filename.split('.')[-1]}",
-                        content=content,
-                        encoding=None
+
+class _ZipBudget:
+    """
+        Members and uncompressed bytes still allowed while expanding an archive and the archives nested in it,
+        None disables a limit
+    """
+
+    def __init__(
+            self,
+            max_members: Optional[int],
+            max_size: Optional[int],
+            max_depth: Optional[int],
+            max_ratio: Optional[float] = None
+    ):
+        self.max_members = max_members
+        self.max_size = max_size
+        self.max_depth = max_depth
+        self.max_ratio = max_ratio
+        self.members = 0
+        self.size = 0
+
+    def take(self, info: ZipInfo):
+        # the members are read up to their declared size, the header bounds what they expand to
+        self.members += 1
+        self.size += info.file_size
+        if self.max_members is not None and self.members > self.max_members:
+            raise ArchiveLimitExceeded(f"zip archive has more than {self.max_members} members")
+        if self.max_size is not None and self.size > self.max_size:
+            raise ArchiveLimitExceeded(f"zip archive expands to more than {self.max_size} bytes")
+        if (self.max_ratio is not None and info.file_size > ZIP_RATIO_MIN_SIZE
+                and info.file_size > self.max_ratio * max(info.compress_size, 1)):
+            raise ExpansionRatioExceeded(
+                f"zip member {info.filename} expands more than {self.max_ratio} times its compressed size"
+            )
+
+
+def _read_zip_member(
+        opener: Callable[[], BinaryIO],
+        info: ZipInfo
+) -> bytes:
+    with ZipFile(opener()) as zip_ref:
+        return zip_ref.read(info)
+
+
+def _unzip(
+        opener: Callable[[], BinaryIO],
+        lazy: bool,
+        budget: _ZipBudget,
+        depth: Optional[int]
+) -> List[File]:
+    attachments = []
+    storage = current_storage()
+    with ZipFile(opener()) as zip_ref:
+        for info in zip_ref.infolist():
+            # the members of a directory are listed on their own, with the directory in their name
+            if info.is_dir():
+                continue
+            budget.take(info)
+            extension = os_split_extension(info.filename)[-1].lower()
+            if extension == ".zip":
+                if depth is not None and depth <= 0:
+                    raise AttachmentDepthExceeded(f"zip archives nested more than {budget.max_depth} levels")
+                if storage is not None:
+                    with zip_ref.open(info) as member:
+                        nested = storage.store(member).open
+                else:
+                    nested = partial(io.BytesIO, zip_ref.read(info))
+                attachments.extend(
+                    _unzip(nested, lazy, budget, None if depth is None else depth - 1)
+                )
+                continue
+            kwargs = dict(
+                filename=info.filename,
+                content_type=f"application/{extension[1:]}",
+                encoding=None
+            )
+            if storage is not None:
+                # the member is decompressed chunk by chunk into the storage
+                with zip_ref.open(info) as member:
+                    attachments.append(
+                        File.from_payload(storage.store(member), **kwargs)
                     )
+            elif lazy:
+                attachments.append(
+                    File.lazy(partial(_read_zip_member, opener, info), size=info.file_size, **kwargs)
+                )
+            else:
+                attachments.append(
+                    File.model_construct(content=zip_ref.read(info), size=info.file_size, **kwargs)
                 )
-                os.remove(extraction_path)
     return attachments
 
 
+@stage("unzip_attachments")
+def unzip_attachments(
+        attachment: File,
+        lazy: bool = False,
+        max_members: Optional[int] = None,
+        max_size: Optional[int] = None,
+        max_depth: Optional[int] = None,
+        max_ratio: Optional[float] = None
+) -> List[File]:
+    """
+        Expand a zip attachment, the members of its directories and of the nested
+        archives are returned as a flat list
+        :param attachment: the zip attachment, read through File.open so a stored payload is not loaded
+        :param lazy: if True the members are decompressed on first access to their content
+        :param max_members: maximum number of members, nested archives included
+        :param max_size: maximum total uncompressed size, nested archives included
+        :param max_depth: maximum nesting of archives
+        :param max_ratio: maximum ratio between the uncompressed and the compressed size of the large members
+        :return: the list of the files contained in the archive
+        :raise ArchiveLimitExceeded: if the archive exceeds one of the limits
+        :raise AttachmentDepthExceeded: if the archives are nested too deep
+
+        The limits not given are those of the active ParseLimits, where the depth is what is left of
+        max_attachment_depth, or without them ZIP_MAX_MEMBERS, ZIP_MAX_SIZE and ZIP_MAX_DEPTH.
+    """
+    limits = current_limits()
+    if limits is None:
+        max_members = ZIP_MAX_MEMBERS if max_members is None else max_members
+        max_size = ZIP_MAX_SIZE if max_size is None else max_size
+        max_depth = ZIP_MAX_DEPTH if max_depth is None else max_depth
+    else:
+        max_members = limits.max_archive_members if max_members is None else max_members
+        max_size = limits.max_archive_size if max_size is None else max_size
+        max_ratio = limits.max_zip_ratio if max_ratio is None else max_ratio
+        if max_depth is None and limits.max_attachment_depth is not None:
+            budget = current_budget()
+            # the budget already counts this archive when it is expanded by the parser
+            max_depth = limits.max_attachment_depth - (budget.attachment_depth if budget is not None else 1)
+    if lazy and attachment.loaded:
+        # the members keep a reference to the archive bytes, not to the attachment
+        opener = partial(io.BytesIO, attachment.content)
+    else:
+        opener = attachment.open
+    return _unzip(
+        opener,
+        lazy,
+        _ZipBudget(max_members, max_size, max_depth, max_ratio),
+        max_depth
+    )
+
+
 weekday = {
     "lunedì": "monday",
     "martedì": "tuesday",
@@ -74,12 +312,12 @@ months = {
 }
 
 
+_ita_pieces = {**months, **weekday}
+_ita_piece = re.compile("|".join(sorted(_ita_pieces, key=len, reverse=True)))
+
+
 def replace_datetime_piece(datetime_string: str):
-    for mesi in months.items():
-        datetime_string = datetime_string.replace(*mesi)
-    for giorni in weekday.items():
-        datetime_string = datetime_string.replace(*giorni)
-    return datetime_string
+    return _ita_piece.sub(lambda match: _ita_pieces[match.group(0)], datetime_string)
 
 
 def strp_ita_string(datetime_string: str, _format: str = "%A %d %B %Y %H:%M"):
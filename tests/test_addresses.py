@@ -0,0 +1,64 @@
+import io
+
+from parsed.converters.toEmailMessage import ConverterToEmailMessage
+from parsed.mail import EmailAddress
+from parsed.mail.parser import parse_mail_byte
+from parsed.mail.parsing_utils import decode_words, get_address, get_email_address, split_addresses
+from parsed.thread.parser import mail_from_string
+
+
+def test_separators_inside_names_comments_and_groups():
+    value = '"Rossi, Mario" <mario.rossi@example.it>, anna.verdi@example.it (Anna; Verdi), undisclosed-recipients:;'
+    assert split_addresses(value) == (
+        ("Rossi, Mario", "mario.rossi@example.it"),
+        ("Anna; Verdi", "anna.verdi@example.it"),
+    )
+
+
+def test_encoded_names():
+    assert split_addresses("=?utf-8?q?Niccol=C3=B2?= <niccolo.rossi@example.it>") == \
+        (("Niccolò", "niccolo.rossi@example.it"),)
+
+
+def test_adjacent_encoded_words():
+    # the "è" is split between the two words, the space between them is not part of the text
+    assert decode_words("=?utf-8?q?Fattura_=C3?= =?utf-8?q?=A8_pronta?=") == "Fattura è pronta"
+    assert decode_words("=?utf-8?b?w6g=?= =?utf-8?q?_pronta?=") == "è pronta"
+    assert decode_words("senza parole codificate") == "senza parole codificate"
+
+
+def test_get_address():
+    assert get_address("Anna Verdi <anna.verdi@example.it>") == EmailAddress(name="Anna Verdi",
+                                                                           address="anna.verdi@example.it")
+    assert [address.address for address in get_address("a@example.it, b@example.it")] == \
+        ["a@example.it", "b@example.it"]
+    assert get_address("undisclosed-recipients:;") is None
+    assert get_address(None) is None
+
+
+def test_quoted_thread_addresses():
+    # the quoted threads separate the addresses with ";", the commas belong to the names
+    assert [(address.name, address.address) for address in
+            get_email_address("Rossi, Mario &lt;mario.rossi@example.it&gt;; anna.verdi@example.it")] == \
+        [("Rossi, Mario", "mario.rossi@example.it"), ("", "anna.verdi@example.it")]
+
+
+def test_mail_of_several_authors_is_from_the_first():
+    mail = parse_mail_byte(
+        b"From: Anna Verdi <anna.verdi@example.it>, luigi.bianchi@example.it\n"
+        b"To: mario.rossi@example.it\n"
+        b"Subject: Verbale\n"
+        b"\n"
+        b"Il verbale.\n"
+    )
+    assert mail.header.From == EmailAddress(name="Anna Verdi", address="anna.verdi@example.it")
+    assert ConverterToEmailMessage().write_mbox([mail], io.BytesIO()) == 1
+    quoted = mail_from_string(
+        "Da: Anna Verdi <anna.verdi@example.it>; luigi.bianchi@example.it\n"
+        "Inviato: lunedì 4 marzo 2024 10:15\n"
+        "A: mario.rossi@example.it\n"
+        "Oggetto: Verbale\n"
+        "\n"
+        "Il verbale.\n"
+    )
+    assert quoted.header.From.address == "anna.verdi@example.it"
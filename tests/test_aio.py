@@ -0,0 +1,72 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pytest
+
+from benchmarks.corpus import generate_corpus
+from parsed.file.storage import PayloadStorage
+from parsed.instrumentation import Instrumentation
+from parsed.limits import ParseLimits
+from parsed.mail.aio import parse_mail_bytes, parse_mails_async
+from parsed.mail.cache import MailCache
+from parsed.mail.exceptions import PartLimitExceeded
+from parsed.mail.parser import parse_mail_byte
+
+MAIL = generate_corpus("alternative", 5000, 1)[0]
+
+
+def _results(mails, **kwargs) -> list:
+    async def collect():
+        return [result async for result in parse_mails_async(mails, ordered=True, **kwargs)]
+    return asyncio.run(collect())
+
+
+def test_parse_mail_bytes():
+    assert asyncio.run(parse_mail_bytes(MAIL)).model_dump() == parse_mail_byte(MAIL).model_dump()
+
+
+def test_thread_sees_the_calling_context():
+    cache, stats = MailCache(), Instrumentation()
+    with ParseLimits(max_parts=2).activate():
+        with pytest.raises(PartLimitExceeded):
+            asyncio.run(parse_mail_bytes(MAIL))
+    with cache.activate(), stats.activate():
+        asyncio.run(parse_mail_bytes(MAIL))
+        asyncio.run(parse_mail_bytes(MAIL))
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert stats.stages["message_from_bytes"].calls == 1
+    with PayloadStorage().activate():
+        mail = asyncio.run(parse_mail_bytes(generate_corpus("zip", 5000, 1)[0]))
+    assert not mail.body.attachments[0].loaded
+
+
+def test_explicit_limits_and_cache():
+    cache = MailCache()
+    with pytest.raises(PartLimitExceeded):
+        asyncio.run(parse_mail_bytes(MAIL, limits=ParseLimits(max_parts=2)))
+    results = _results([MAIL, MAIL], executor=ThreadPoolExecutor(2), cache=cache, limits=ParseLimits())
+    assert all(result.ok for result in results)
+    assert cache.hits + cache.misses == 2 and len(cache) == 1
+
+
+def test_process_executor():
+    cache = MailCache()
+    with ProcessPoolExecutor(2) as executor:
+        with ParseLimits(max_parts=2).activate():
+            with pytest.raises(PartLimitExceeded):
+                asyncio.run(parse_mail_bytes(MAIL, executor=executor))
+            assert isinstance(_results([MAIL], executor=executor)[0].error, PartLimitExceeded)
+        with cache.activate():
+            first = asyncio.run(parse_mail_bytes(MAIL, executor=executor))
+            results = _results([MAIL, bytearray(MAIL)], executor=executor)
+    assert (cache.hits, cache.misses) == (2, 1)
+    assert [result.mail.model_dump() for result in results] == [first.model_dump()] * 2
+
+
+def test_async_result_is_not_served_with_the_p7m_signed():
+    # the asyncio API parses without the openssl fallback, its cache entries are kept apart
+    cache = MailCache()
+    with cache.activate():
+        asyncio.run(parse_mail_bytes(MAIL))
+        parse_mail_byte(MAIL)
+    assert (cache.hits, cache.misses, len(cache)) == (0, 2, 2)
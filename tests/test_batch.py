@@ -0,0 +1,56 @@
+import pytest
+
+from benchmarks.corpus import generate_corpus
+from parsed.limits import ParseLimits
+from parsed.mail.batch import parse_mails
+from parsed.mail.exceptions import HeaderDefect, PartLimitExceeded
+from parsed.mail.parser import parse_mail_byte
+
+MAILS = generate_corpus("alternative", 2000, 6)
+
+NO_RECEIVER = b"From: anna.verdi@example.it\nSubject: Senza destinatario\n\nA domani.\n"
+
+
+def _dumps(mails) -> list:
+    return [parse_mail_byte(mail).model_dump() for mail in mails]
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_results_in_input_order(workers):
+    results = list(parse_mails(MAILS, workers=workers, prefetch=1))
+    assert [result.index for result in results] == list(range(len(MAILS)))
+    assert [result.mail.model_dump() for result in results] == _dumps(MAILS)
+
+
+def test_unordered_results_cover_the_batch():
+    results = list(parse_mails(MAILS, workers=3, ordered=False, prefetch=1))
+    assert sorted(result.index for result in results) == list(range(len(MAILS)))
+    assert all([result.mail.model_dump()] == _dumps(MAILS[result.index:result.index + 1]) for result in results)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_errors_are_reported_per_mail(tmp_path, workers):
+    missing = str(tmp_path / "missing.eml")
+    path = tmp_path / "mail.eml"
+    path.write_bytes(MAILS[0])
+    results = list(parse_mails([MAILS[1], NO_RECEIVER, missing, str(path)], workers=workers))
+    assert [result.ok for result in results] == [True, False, False, True]
+    assert isinstance(results[1].error, HeaderDefect) and results[1].source is None
+    assert isinstance(results[2].error, FileNotFoundError) and results[2].source == missing
+    assert results[3].source == str(path)
+    assert [results[3].mail.model_dump()] == _dumps(MAILS[:1])
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_headers_only(tmp_path, workers):
+    path = tmp_path / "mail.eml"
+    path.write_bytes(MAILS[0])
+    results = list(parse_mails([MAILS[1], str(path)], workers=workers, headers_only=True))
+    assert all(result.mail is None for result in results)
+    headers = [mail["header"] for mail in _dumps([MAILS[1], MAILS[0]])]
+    assert [result.header.model_dump() for result in results] == headers
+
+
+def test_limits_are_applied_in_the_workers():
+    results = list(parse_mails(MAILS[:2], workers=2, limits=ParseLimits(max_parts=2)))
+    assert all(isinstance(result.error, PartLimitExceeded) for result in results)
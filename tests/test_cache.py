@@ -0,0 +1,87 @@
+import base64
+from email import message_from_bytes, message_from_string
+from email.policy import compat32, default
+
+from parsed.mail.cache import MailCache
+from parsed.mail.parser import parse_mail_byte, parse_mail_message
+
+MAIL = (
+    b"From: Anna Verdi <anna.verdi@example.it>\n"
+    b"To: luigi.bianchi@example.it\n"
+    b"Subject: Riunione\n"
+    b"\n"
+    b"A domani.\n"
+)
+
+
+def test_key_includes_policy():
+    assert MailCache.key(MAIL, default) != MailCache.key(MAIL, compat32)
+
+
+def test_key_resolves_default_options():
+    assert MailCache.key(MAIL) == MailCache.key(MAIL, default, flatted=False, lazy=False, part_filter=None)
+    assert MailCache.key(MAIL) != MailCache.key(MAIL, flatted=True)
+
+
+def test_policies_are_cached_apart():
+    cache = MailCache()
+    with cache.activate():
+        parse_mail_byte(MAIL, policy=default)
+        parse_mail_byte(MAIL, policy=compat32)
+    assert cache.misses == 2
+    assert cache.hits == 0
+
+
+def test_explicit_defaults_hit():
+    cache = MailCache()
+    with cache.activate():
+        first = parse_mail_byte(MAIL)
+        second = parse_mail_byte(MAIL, lazy=False, flatted=False)
+    assert cache.hits == 1
+    assert second == first
+
+
+def test_parse_mail_message_bypasses_the_cache():
+    # a message read from a str with 8 bit headers cannot be serialized back to bytes
+    mime = message_from_string(
+        "From: Zoë <zoe@example.it>\n"
+        "To: luigi.bianchi@example.it\n"
+        "Subject: Riunione è\n"
+        "\n"
+        "A domani.\n",
+        policy=compat32
+    )
+    cache = MailCache()
+    with cache.activate():
+        mail = parse_mail_message(mime)
+        parse_mail_message(message_from_bytes(MAIL, policy=default))
+    assert mail.header.Subject == "Riunione è"
+    assert (cache.hits, cache.misses) == (0, 0)
+
+
+def test_attached_mail_hits_top_level_entry():
+    outer = (
+        b"From: luigi.bianchi@example.it\n"
+        b"To: anna.verdi@example.it\n"
+        b"Subject: Fwd: Riunione\n"
+        b"MIME-Version: 1.0\n"
+        b'Content-Type: multipart/mixed; boundary="B"\n'
+        b"\n"
+        b"--B\n"
+        b"Content-Type: text/plain\n"
+        b"\n"
+        b"Inoltro.\n"
+        b"--B\n"
+        b"Content-Type: application/octet-stream\n"
+        b'Content-Disposition: attachment; filename="riunione.eml"\n'
+        b"Content-Transfer-Encoding: base64\n"
+        b"\n"
+        + base64.encodebytes(MAIL)
+        + b"--B--\n"
+    )
+    cache = MailCache()
+    with cache.activate():
+        parse_mail_byte(MAIL)
+        mail = parse_mail_byte(outer)
+    assert cache.hits == 1
+    assert mail.body.attachments[0].parsed_obj.header.Subject == "Riunione"
@@ -0,0 +1,41 @@
+import pytest
+
+from benchmarks.corpus import generate_corpus
+from parsed.converters.toColumnar import ConverterToColumnar
+from parsed.mail import MailFile
+from parsed.mail.parser import parse_mail_byte
+from parsed.thread.parser import thread_from_mail
+
+pyarrow = pytest.importorskip("pyarrow")
+
+AUTHORS_MAIL = (
+    b"From: Anna Verdi <anna.verdi@example.it>, luigi.bianchi@example.it\n"
+    b"To: mario.rossi@example.it\n"
+    b"Subject: Verbale\n"
+    b"\n"
+    b"Il verbale.\n"
+)
+
+
+def _table(mails) -> "pyarrow.Table":
+    return pyarrow.Table.from_batches(list(ConverterToColumnar().convert(mails)))
+
+
+def test_several_authors_export_the_first():
+    row = _table([parse_mail_byte(AUTHORS_MAIL)]).to_pylist()[0]
+    assert (row["sender"], row["sender_name"]) == ("anna.verdi@example.it", "Anna Verdi")
+
+
+def test_attached_mail_without_parsed_obj_is_skipped():
+    mail = parse_mail_byte(AUTHORS_MAIL)
+    unparsed = MailFile.model_construct(filename="email.eml", content=b"", parsed_obj=None)
+    assert _table([unparsed, mail, MailFile.model_construct(filename="email.eml", parsed_obj=mail)]).num_rows == 2
+
+
+@pytest.mark.parametrize("flatted", [False, True])
+def test_threads_of_attached_mails(flatted):
+    mails = [parse_mail_byte(mail_byte, flatted=flatted) for mail_byte in generate_corpus("nested", 5000, 3)]
+    threads = [thread_from_mail(mail) for mail in mails]
+    table = _table(threads)
+    assert table.num_rows == sum(len(thread.thread) for thread in threads)
+    assert None not in table.column("sender").to_pylist()
@@ -0,0 +1,86 @@
+from email.policy import SMTP, SMTPUTF8, compat32, default
+
+import pytest
+
+from benchmarks.corpus import generate_corpus
+from parsed.converters.toEmailMessage import ConverterToEmailMessage
+from parsed.mail.parser import parse_mail_byte
+
+NON_ASCII_MAIL = (
+    "From: Niccolò Rossi <niccolo.rossi@example.it>\n"
+    "To: Zoë Bianchi <zoe.bianchi@example.it>, anna.verdi@example.it\n"
+    "Subject: Fattura è pronta\n"
+    "MIME-Version: 1.0\n"
+    "Content-Type: text/plain; charset=utf-8\n"
+    "Content-Transfer-Encoding: 8bit\n"
+    "\n"
+    "La fattura è in allegato.\n"
+).encode()
+
+
+def _normalized(value):
+    """
+        The dump of a mail without the line endings and the transfer encodings the serialization may change
+    """
+    if isinstance(value, dict):
+        return {key: _normalized(element) for key, element in value.items() if key != "encoding"}
+    if isinstance(value, list):
+        return [_normalized(element) for element in value]
+    if isinstance(value, str):
+        return value.replace("\r\n", "\n").rstrip("\n")
+    if isinstance(value, bytes):
+        return value.replace(b"\r\n", b"\n").rstrip(b"\n")
+    return value
+
+
+@pytest.mark.parametrize("policy", [default, SMTP, SMTPUTF8, compat32])
+def test_non_ascii_headers_round_trip(policy):
+    mail = parse_mail_byte(NON_ASCII_MAIL)
+    data = ConverterToEmailMessage(policy=policy).to_bytes(mail)
+    if not getattr(policy, "utf8", False):
+        assert data.isascii()
+    assert parse_mail_byte(data).header == mail.header
+
+
+def test_convert_non_ascii_headers():
+    message = ConverterToEmailMessage().convert(parse_mail_byte(NON_ASCII_MAIL))
+    assert message["Subject"] == "Fattura è pronta"
+    assert message["From"].addresses[0].display_name == "Niccolò Rossi"
+    assert message["To"].addresses[0].display_name == "Zoë Bianchi"
+
+
+@pytest.mark.parametrize("kind", ["plain", "alternative", "nested", "zip", "p7m"])
+@pytest.mark.parametrize("flatted", [False, True])
+def test_corpus_round_trip(kind, flatted):
+    converter = ConverterToEmailMessage()
+    for mail_byte in generate_corpus(kind, 5000, 5):
+        mail = parse_mail_byte(mail_byte, flatted=flatted)
+        again = parse_mail_byte(converter.to_bytes(mail), flatted=flatted)
+        assert _normalized(again.model_dump()) == _normalized(mail.model_dump())
+
+
+def test_text_attachment_round_trip():
+    mail_byte = (
+        b"From: anna.verdi@example.it\n"
+        b"To: luigi.bianchi@example.it\n"
+        b"Subject: Note\n"
+        b"MIME-Version: 1.0\n"
+        b'Content-Type: multipart/mixed; boundary="B"\n'
+        b"\n"
+        b"--B\n"
+        b"Content-Type: text/plain\n"
+        b"\n"
+        b"Le note.\n"
+        b"--B\n"
+        b"Content-Type: text/plain; charset=iso-8859-1\n"
+        b'Content-Disposition: attachment; filename="notes.txt"\n'
+        b"Content-Transfer-Encoding: quoted-printable\n"
+        b"\n"
+        b"some notes =E8\n"
+        b"--B--\n"
+    )
+    converter = ConverterToEmailMessage()
+    for lazy in (False, True):
+        mail = parse_mail_byte(mail_byte, lazy=lazy)
+        again = parse_mail_byte(converter.to_bytes(mail))
+        assert again.body.attachments[0].content == "some notes è"
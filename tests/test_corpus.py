@@ -0,0 +1,91 @@
+from parsed.mail.parser import parse_mail_byte
+from parsed.thread.corpus import ThreadIndex, normalize_subject, thread_corpus
+
+
+def _mail(message_id: str, subject: str, references=(), in_reply_to: str = None, body: str = None):
+    headers = [
+        "From: anna.verdi@example.it",
+        "To: luigi.bianchi@example.it",
+        f"Subject: {subject}",
+        f"Message-ID: <{message_id}>",
+    ]
+    if references:
+        headers.append("References: " + " ".join(f"<{reference}>" for reference in references))
+    if in_reply_to:
+        headers.append(f"In-Reply-To: <{in_reply_to}>")
+    return parse_mail_byte(("\n".join(headers) + f"\n\n{body or message_id}\n").encode())
+
+
+def _threads(index: ThreadIndex) -> list:
+    return [sorted(mail.header.MessageID for mail in thread.thread) for thread in index.threads()]
+
+
+def test_normalize_subject():
+    assert normalize_subject("Re: R: Fwd: [lista] RIF:  Riunione   di marzo") == ("riunione di marzo", True)
+    assert normalize_subject("AW[2]: Riunione") == ("riunione", True)
+    assert normalize_subject("Riunione") == ("riunione", False)
+    assert normalize_subject(None) == ("", False)
+
+
+def test_reply_before_parent():
+    index = ThreadIndex()
+    reply = _mail("2@example.it", "Re: Riunione", in_reply_to="1@example.it")
+    assert index.add(reply) == "1@example.it"
+    parent = _mail("1@example.it", "Riunione")
+    assert index.add(parent) == "1@example.it"
+    assert _threads(index) == [["1@example.it", "2@example.it"]]
+    assert reply.thread_id == parent.thread_id == "1@example.it"
+
+
+def test_late_mail_joins_two_threads():
+    index = ThreadIndex()
+    first, second = _mail("a@example.it", "Bilancio"), _mail("b@example.it", "Fornitori")
+    index.add(first)
+    index.add(second)
+    assert index.thread_id("a@example.it") != index.thread_id("b@example.it")
+    index.add(_mail("c@example.it", "Bilancio e fornitori", references=["a@example.it", "b@example.it"]))
+    assert index.thread_id("a@example.it") == index.thread_id("b@example.it") == index.thread_id("c@example.it")
+    assert _threads(index) == [["a@example.it", "b@example.it", "c@example.it"]]
+    # threads() sets the final thread id of the mails added before the join
+    assert first.thread_id == second.thread_id == "a@example.it"
+
+
+def test_reference_loops():
+    index = ThreadIndex(subjects=False)
+    index.add(_mail("x@example.it", "Uno", references=["y@example.it", "x@example.it"]))
+    index.add(_mail("y@example.it", "Due", references=["x@example.it"]))
+    index.add(_mail("z@example.it", "Tre", references=["z@example.it"]))
+    assert _threads(index) == [["x@example.it", "y@example.it"], ["z@example.it"]]
+    parents = {container.message_id: container.parent for container in index._containers.values()}
+    assert parents["z@example.it"] is None
+    # one of the two mails referencing each other stays a root
+    assert [parents["x@example.it"], parents["y@example.it"]].count(None) == 1
+
+
+def test_subject_threading():
+    mails = [
+        _mail("1@example.it", "R: Riunione"),
+        _mail("2@example.it", "Riunione"),
+        _mail("3@example.it", "Re: riunione "),
+        _mail("4@example.it", "Riunione"),
+        _mail("5@example.it", "Altro"),
+    ]
+    index = ThreadIndex()
+    index.add_mails(mails)
+    # the replies join the original, two originals with the same subject stay apart
+    assert _threads(index) == [["1@example.it", "2@example.it", "3@example.it"], ["4@example.it"], ["5@example.it"]]
+    assert mails[0].thread_id == "2@example.it"
+    assert len(thread_corpus(mails, subjects=False)) == 5
+
+
+def test_deduplicate():
+    text = "la fattura di marzo è in allegato come concordato durante la riunione di ieri " * 10
+    original = _mail("1@example.it", "Fattura", body=text)
+    copy = _mail("1@example.it", "Fattura", body=text)
+    near = _mail("2@example.it", "Fattura", body=text + " grazie")
+    index = ThreadIndex(deduplicate=True)
+    index.add_mails([original, copy, near, _mail("3@example.it", "Altro")])
+    assert index.duplicates == 2 and len(index) == 2
+    assert copy.thread_id == near.thread_id == original.thread_id == "1@example.it"
+    # without deduplication a copy with a known id is kept under a generated one
+    assert sum(len(thread.thread) for thread in thread_corpus([original, copy])) == 2
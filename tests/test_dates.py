@@ -0,0 +1,47 @@
+import math
+from datetime import datetime, timezone
+
+import pytest
+
+from parsed.dates import DateParser, parse_date, received_timestamp
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("lunedì 4 marzo 2024 10:15", datetime(2024, 3, 4, 10, 15)),
+    ("mardi 5 mars 2024 à 09:30", datetime(2024, 3, 5, 9, 30)),
+    ("Dienstag, 5. März 2024 um 09:30 Uhr", datetime(2024, 3, 5, 9, 30)),
+    ("martes, 5 de marzo de 2024 9:30", datetime(2024, 3, 5, 9, 30)),
+    ("Tuesday, March 5, 2024 9:30:12 PM", datetime(2024, 3, 5, 21, 30, 12)),
+    ("05/03/2024 09:30", datetime(2024, 3, 5, 9, 30)),
+    ("05.03.2024 09:30", datetime(2024, 3, 5, 9, 30)),
+    ("2024-03-05 09:30", datetime(2024, 3, 5, 9, 30)),
+    ("5 marzo 2024", datetime(2024, 3, 5)),
+])
+def test_formats(text, expected):
+    assert parse_date(text) == expected
+
+
+def test_rfc_2822_fallback():
+    assert parse_date("Mon, 4 Mar 2024 10:15:00 +0100") == datetime.fromisoformat("2024-03-04T10:15:00+01:00")
+
+
+def test_unparsable():
+    assert parse_date("non è una data") is None
+    assert parse_date(None) is None
+    assert parse_date("") is None
+
+
+def test_last_format_of_a_source():
+    parser = DateParser(["%d/%m/%Y %H:%M", "%m/%d/%Y %H:%M"])
+    assert parser.parse("13/03/2024 10:00", "europe") == datetime(2024, 3, 13, 10)
+    assert parser.parse("03/13/2024 10:00", "america") == datetime(2024, 3, 13, 10)
+    # an ambiguous date is read with the format of its source
+    assert parser.parse("03/04/2024 10:00", "america") == datetime(2024, 3, 4, 10)
+    assert parser.parse("03/04/2024 10:00", "europe") == datetime(2024, 4, 3, 10)
+
+
+def test_received_timestamp():
+    assert received_timestamp(datetime(2024, 3, 4, 10, 15)) == \
+        datetime(2024, 3, 4, 10, 15, tzinfo=timezone.utc).timestamp()
+    assert received_timestamp("4 marzo 2024 10:15") == received_timestamp(datetime(2024, 3, 4, 10, 15))
+    assert received_timestamp(None) == received_timestamp("non è una data") == math.inf
@@ -0,0 +1,63 @@
+import random
+
+import pytest
+
+from parsed.mail.parser import parse_mail_byte
+from parsed.thread.dedup import _bands, _word_hash, deduplicate, simhash
+
+WORDS = ("la fattura di marzo è in allegato come concordato durante la riunione di ieri con il "
+         "fornitore e il responsabile degli acquisti").split()
+
+
+def _reference_simhash(words, shingle_size=3):
+    size = min(shingle_size, len(words))
+    shingles = []
+    for start in range(len(words) - size + 1):
+        value = 0
+        for word in words[start:start + size]:
+            value = (value * 0x9E3779B97F4A7C15 + _word_hash(word)) % (1 << 64)
+        shingles.append(value ^ value >> 32)
+    return sum(1 << bit for bit in range(64) if sum(shingle >> bit & 1 for shingle in shingles) > len(shingles) / 2)
+
+
+@pytest.mark.parametrize("count", [1, 2, 3, 10, len(WORDS)])
+def test_simhash(count):
+    assert simhash(WORDS[:count]) == _reference_simhash(WORDS[:count])
+
+
+@pytest.mark.parametrize("max_distance", [1, 3, 7])
+def test_close_hashes_share_a_band(max_distance):
+    bands = _bands(max_distance)
+    assert sum(bin(mask).count("1") for _, mask in bands) == 64
+    generator = random.Random(max_distance)
+    for _ in range(200):
+        value = generator.getrandbits(64)
+        other = value
+        for bit in generator.sample(range(64), max_distance):
+            other ^= 1 << bit
+        assert any(value >> shift & mask == other >> shift & mask for shift, mask in bands)
+
+
+def _mail(body: str, message_id: str) -> bytes:
+    return (
+        "From: anna.verdi@example.it\n"
+        "To: luigi.bianchi@example.it\n"
+        "Subject: Fattura\n"
+        f"Message-ID: <{message_id}>\n"
+        "\n"
+        f"{body}\n"
+    ).encode()
+
+
+def test_deduplicate():
+    # long enough that a word added changes few of the SimHash bits
+    text = " ".join(WORDS * 10)
+    mails = [
+        parse_mail_byte(_mail(text, "1@example.it")),
+        parse_mail_byte(_mail(text, "1@example.it")),
+        parse_mail_byte(_mail(text.upper(), "2@example.it")),
+        parse_mail_byte(_mail(text + " grazie", "3@example.it")),
+        parse_mail_byte(_mail("tutt'altro testo, senza nulla in comune con gli altri", "4@example.it")),
+    ]
+    assert [mail.header.MessageID for mail in deduplicate(mails)] == ["1@example.it", "4@example.it"]
+    assert len(deduplicate(mails, max_distance=0)) == 3
@@ -0,0 +1,114 @@
+import pytest
+
+from benchmarks.corpus import generate_corpus
+from parsed.file.storage import PayloadStorage
+from parsed.limits import ParseLimits
+from parsed.mail import feed
+from parsed.mail.cache import MailCache
+from parsed.mail.feed import MailFeedParser
+from parsed.mail.filter import PartFilter
+from parsed.mail.parser import parse_mail_byte
+
+
+def _fed(mail_byte: bytes, size: int = 7, **kwargs):
+    parser = MailFeedParser(**kwargs)
+    for start in range(0, len(mail_byte), size):
+        parser.feed(mail_byte[start:start + size])
+    return parser, parser.close()
+
+
+@pytest.mark.parametrize("kind", ["plain", "alternative", "nested", "zip", "p7m"])
+@pytest.mark.parametrize("flatted", [False, True])
+def test_chunks_match_parse_mail_byte(kind, flatted):
+    for mail_byte in generate_corpus(kind, 5000, 3):
+        _, mail = _fed(mail_byte, flatted=flatted)
+        assert mail.model_dump() == parse_mail_byte(mail_byte, flatted=flatted).model_dump()
+
+
+def test_header_before_attachments():
+    events = []
+    mail_byte = generate_corpus("zip", 5000, 1)[0]
+    parser, mail = _fed(
+        mail_byte,
+        on_header=lambda header: events.append(("header", header.Subject)),
+        on_attachment=lambda attachment: events.append(("attachment", len(events)))
+    )
+    assert events[0] == ("header", mail.header.Subject)
+    assert [event for event, _ in events[1:]] == ["attachment"] * len(parser.attachments)
+    assert parser.attachments
+
+
+def test_attachment_emitted_before_the_end():
+    mail_byte = (
+        b"From: anna.verdi@example.it\n"
+        b"To: luigi.bianchi@example.it\n"
+        b"Subject: Allegato\n"
+        b"MIME-Version: 1.0\n"
+        b'Content-Type: multipart/mixed; boundary="B"\n'
+        b"\n"
+        b"--B\n"
+        b"Content-Type: application/pdf\n"
+        b'Content-Disposition: attachment; filename="fattura.pdf"\n'
+        b"Content-Transfer-Encoding: base64\n"
+        b"\n"
+        b"JVBERi0xLjQK\n"
+        b"--B\n"
+        b"Content-Type: text/plain\n"
+        b"\n"
+    )
+    emitted = []
+    parser = MailFeedParser(on_attachment=emitted.append)
+    parser.feed(mail_byte)
+    assert [file.filename for file in emitted] == ["fattura.pdf"]
+    parser.feed(b"In allegato.\n--B--\n")
+    mail = parser.close()
+    assert len(emitted) == 1 and mail.body.attachments[0].content == b"%PDF-1.4\n"
+
+
+def test_storage():
+    mail_byte = generate_corpus("zip", 5000, 1)[0]
+    storage = PayloadStorage(spill_threshold=0)
+    parser, mail = _fed(mail_byte, storage=storage)
+    expected = parse_mail_byte(mail_byte)
+    assert [file.content for file in mail.body.attachments] == [file.content for file in expected.body.attachments]
+    assert mail.model_dump() == expected.model_dump()
+
+
+def test_part_filter():
+    mail_byte = generate_corpus("zip", 5000, 1)[0]
+    emitted = []
+    part_filter = PartFilter(attachments=False)
+    _, mail = _fed(mail_byte, part_filter=part_filter, on_attachment=emitted.append)
+    assert emitted == [] and mail.body.attachments == []
+    assert mail.model_dump() == parse_mail_byte(mail_byte, part_filter=part_filter).model_dump()
+
+
+def test_cache():
+    mail_byte = generate_corpus("zip", 5000, 1)[0]
+    cache = MailCache()
+    with cache.activate():
+        _fed(mail_byte)
+        parse_mail_byte(mail_byte)
+        _, mail = _fed(mail_byte, size=100)
+    assert (cache.hits, cache.misses) == (2, 1)
+    assert mail.model_dump() == parse_mail_byte(mail_byte).model_dump()
+
+
+def test_degraded_attachment_is_not_cached():
+    mail_byte = generate_corpus("zip", 5000, 1)[0]
+    cache = MailCache()
+    with cache.activate(), ParseLimits(max_archive_members=0, strict=False).activate():
+        _, mail = _fed(mail_byte)
+    assert mail.body.attachments[0].extension == ".zip"
+    assert len(cache) == 0
+
+
+def test_missing_parser_internals(monkeypatch):
+    class Parser(feed.BytesFeedParser):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            del self._msgstack
+
+    monkeypatch.setattr(feed, "BytesFeedParser", Parser)
+    with pytest.raises(RuntimeError):
+        MailFeedParser()
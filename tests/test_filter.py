@@ -0,0 +1,111 @@
+import base64
+import io
+import pickle
+import zipfile
+from email import message_from_bytes
+from email.policy import default
+
+from parsed.mail.cache import MailCache
+from parsed.mail.filter import PartFilter
+from parsed.mail.parser import parse_mail_byte
+
+
+def _zip(members: dict) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+def _attachment(filename: str, content_type: str, data: bytes) -> bytes:
+    return (
+        b"--B\nContent-Type: %s\n" % content_type.encode()
+        + b'Content-Disposition: attachment; filename="%s"\n' % filename.encode()
+        + b"Content-Transfer-Encoding: base64\n\n"
+        + base64.encodebytes(data)
+    )
+
+
+MAIL = (
+    b"From: anna.verdi@example.it\n"
+    b"To: luigi.bianchi@example.it\n"
+    b"Subject: Documenti\n"
+    b"MIME-Version: 1.0\n"
+    b'Content-Type: multipart/mixed; boundary="B"\n'
+    b"\n"
+    b"--B\nContent-Type: text/plain\n\nIn allegato.\n"
+    b"--B\nContent-Type: text/html\n\n<p>In allegato.</p>\n"
+    + _attachment("bilancio.PDF", "application/pdf", b"%PDF-1.4 bilancio")
+    + _attachment("note.txt", "text/plain", b"note")
+    + _attachment("archivio.zip", "application/zip", _zip({"verbale.pdf": b"%PDF-1.4 verbale", "foto.jpg": b"jpg"}))
+    + b"--B--\n"
+)
+
+
+def _parts(part_filter: PartFilter) -> tuple:
+    mail = parse_mail_byte(MAIL, part_filter=part_filter)
+    return (
+        sorted(part.content_type for part in mail.body.content),
+        sorted(attachment.filename for attachment in mail.body.attachments)
+    )
+
+
+def _mime(content_type: str, filename: str = None):
+    if content_type.startswith("multipart/"):
+        mime = b'Content-Type: %s; boundary="X"\n\n--X\nContent-Type: text/plain\n\ndati\n--X--\n'
+        return message_from_bytes(mime % content_type.encode(), policy=default)
+    disposition = b'Content-Disposition: attachment; filename="%s"\n' % filename.encode() if filename else b""
+    return message_from_bytes(b"Content-Type: %s\n%s\ndati\n" % (content_type.encode(), disposition), policy=default)
+
+
+def test_include_patterns():
+    assert _parts(PartFilter(content_types=["text/*"], attachments=False)) == (["text/html", "text/plain"], [])
+    assert _parts(PartFilter(content_types=["TEXT/PLAIN"])) == (["text/plain"], ["note.txt"])
+    # extensions are compared lowercase, with or without the dot
+    assert _parts(PartFilter(extensions=["pdf"], body=False)) == ([], ["bilancio.PDF", "verbale.pdf"])
+
+
+def test_exclude_patterns():
+    assert _parts(PartFilter(exclude_content_types=["text/html", "application/*"])) == (["text/plain"], ["note.txt"])
+    assert _parts(PartFilter(exclude_extensions=[".JPG", "txt"])) == \
+        (["text/html", "text/plain"], ["bilancio.PDF", "verbale.pdf"])
+    # the exclusions win over the inclusions
+    assert _parts(PartFilter(extensions=[".pdf"], exclude_extensions=[".pdf"], body=False)) == ([], [])
+
+
+def test_containers_are_subject_only_to_exclusions():
+    part_filter = PartFilter(content_types=["image/*"], extensions=[".pdf"], min_size=1000)
+    assert part_filter.accepts(_mime("multipart/mixed"))
+    assert part_filter.accepts(_mime("application/zip", "archivio.zip"))
+    assert part_filter.accepts(_mime("message/rfc822", "inoltro.eml"))
+    assert not part_filter.accepts(_mime("application/pdf", "bilancio.pdf"))
+    assert not PartFilter(exclude_content_types=["multipart/*"]).accepts(_mime("multipart/mixed"))
+    assert not PartFilter(exclude_extensions=[".zip"]).accepts(_mime("application/zip", "archivio.zip"))
+    assert not PartFilter(max_size=1).accepts(_mime("application/zip", "archivio.zip"))
+    # the zip is not expanded when excluded
+    assert _parts(PartFilter(exclude_extensions=[".zip"], body=False)) == ([], ["bilancio.PDF", "note.txt"])
+
+
+def test_repr_is_stable():
+    part_filter = PartFilter(content_types=["text/plain", "TEXT/*"], exclude_extensions="EXE")
+    assert repr(part_filter) == (
+        "PartFilter(attachments=True, body=True, content_types=('text/*', 'text/plain'), "
+        "exclude_content_types=(), exclude_extensions=('.exe',), extensions=None, max_size=None, min_size=None)"
+    )
+    same = PartFilter(exclude_extensions=[".exe"], content_types=["text/*", "text/plain"])
+    assert repr(same) == repr(part_filter) and same == part_filter and hash(same) == hash(part_filter)
+    assert repr(pickle.loads(pickle.dumps(part_filter))) == repr(part_filter)
+
+
+def test_cache_key_follows_the_repr():
+    part_filter = PartFilter(content_types=["text/plain", "TEXT/*"])
+    same = PartFilter(content_types=["text/*", "text/plain"])
+    assert MailCache.key(MAIL, part_filter=part_filter) == MailCache.key(MAIL, part_filter=same)
+    assert MailCache.key(MAIL, part_filter=part_filter) != MailCache.key(MAIL, part_filter=PartFilter())
+    assert MailCache.key(MAIL, part_filter=PartFilter()) != MailCache.key(MAIL)
+    cache = MailCache()
+    with cache.activate():
+        parse_mail_byte(MAIL, part_filter=part_filter)
+        assert _parts(same) == _parts(part_filter)
+    assert cache.hits == 2 and cache.misses == 1
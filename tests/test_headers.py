@@ -0,0 +1,45 @@
+import io
+
+import pytest
+
+from benchmarks.corpus import generate_corpus
+from parsed.instrumentation import Instrumentation
+from parsed.limits import ParseLimits
+from parsed.mail.exceptions import PartLimitExceeded
+from parsed.mail.parser import (
+    header_block, parse_mail_byte, parse_mail_header_byte, parse_mail_header_file, parse_mail_header_string
+)
+
+MAILS = [
+    mail for kind in ("plain", "alternative", "zip", "p7m", "thread_ita") for mail in generate_corpus(kind, 3000, 2)
+]
+
+
+@pytest.mark.parametrize("mail_byte", MAILS)
+def test_same_header_as_the_full_parse(mail_byte):
+    expected = parse_mail_byte(mail_byte).header.model_dump()
+    assert parse_mail_header_byte(mail_byte).model_dump() == expected
+    assert parse_mail_header_string(mail_byte.decode("ascii")).model_dump() == expected
+    assert parse_mail_header_file(io.BytesIO(mail_byte)).model_dump() == expected
+
+
+def test_body_is_not_decoded():
+    mail_byte = MAILS[2]
+    stats = Instrumentation()
+    with stats.activate():
+        parse_mail_header_byte(mail_byte)
+    assert stats.stages["parse_mail_header"].calls == 1
+    assert "message_from_bytes" not in stats.stages and "mime_content" not in stats.stages
+    # the limits reject the body of the mail, not its header
+    with ParseLimits(max_parts=1).activate():
+        header = parse_mail_header_byte(mail_byte)
+        with pytest.raises(PartLimitExceeded):
+            parse_mail_byte(mail_byte)
+    assert header.model_dump() == parse_mail_byte(mail_byte).header.model_dump()
+
+
+def test_file_is_read_up_to_the_header_end():
+    mail_byte = MAILS[2]
+    fp = io.BytesIO(mail_byte)
+    parse_mail_header_file(fp)
+    assert fp.tell() == len(header_block(mail_byte)) < len(mail_byte)
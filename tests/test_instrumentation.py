@@ -0,0 +1,142 @@
+import pickle
+import threading
+
+import pytest
+
+from benchmarks.corpus import generate_corpus
+from parsed import instrumentation as instrumentation_module
+from parsed.instrumentation import Instrumentation, count, current_instrumentation, stage
+from parsed.limits import ParseLimits
+from parsed.mail.exceptions import PartLimitExceeded
+from parsed.mail.parser import parse_mail_byte
+
+ZIP_MAIL = generate_corpus("zip", 3000, 1)[0]
+
+
+@stage("test_recursion")
+def _recurse(depth: int) -> int:
+    return depth if depth <= 1 else _recurse(depth - 1)
+
+
+class _NoClock:
+    def __getattr__(self, name):
+        raise AssertionError("timed while no instrumentation is active")
+
+
+def test_stage_is_a_no_op_when_inactive(monkeypatch):
+    monkeypatch.setattr(instrumentation_module, "time", _NoClock())
+    stats = Instrumentation()
+    assert current_instrumentation() is None
+    assert _recurse(3) == 1
+    count("bytes_decoded", 10)
+    parse_mail_byte(ZIP_MAIL)
+    assert not stats.stages and not stats.counters
+
+
+def test_activation_does_not_leak_to_other_contexts():
+    stats, active, done = Instrumentation(), threading.Event(), threading.Event()
+
+    def other_thread():
+        with stats.activate():
+            active.set()
+            done.wait(5)
+
+    thread = threading.Thread(target=other_thread)
+    thread.start()
+    try:
+        assert active.wait(5)
+        assert current_instrumentation() is None
+        parse_mail_byte(ZIP_MAIL)
+    finally:
+        done.set()
+        thread.join()
+    assert not stats.stages and not stats.counters
+
+
+def test_stages_and_counters():
+    stats = Instrumentation()
+    with stats.activate():
+        assert current_instrumentation() is stats
+        parse_mail_byte(ZIP_MAIL)
+        assert _recurse(3) == 1
+        with ParseLimits(max_parts=1).activate(), pytest.raises(PartLimitExceeded):
+            parse_mail_byte(ZIP_MAIL)
+        with ParseLimits(max_parts=1, strict=False).activate():
+            parse_mail_byte(ZIP_MAIL)
+    assert current_instrumentation() is None
+    assert stats.stages["message_from_bytes"].calls == 3
+    assert stats.stages["unzip_attachments"].calls == 1
+    # a recursive stage counts every call and is timed once
+    assert stats.stages["test_recursion"].calls == 3
+    assert stats.counter("bytes_decoded") > 0
+    # the members of the zip are counted by their own extension, the degraded parse keeps none
+    assert stats.counter("attachments") == 3
+    assert stats.counter("attachments", extension=".pdf") == 1
+    # only the degraded parse is counted, the strict one raised
+    assert stats.counter("limits_exceeded") == stats.counter("limits_exceeded", limit="parts") == 1
+    assert stats.counter("missing") == 0
+
+
+def test_recursive_stage_is_timed_by_its_outer_call():
+    timings = []
+    stats = Instrumentation(on_stage=lambda name, wall, cpu: timings.append(wall))
+    with stats.activate():
+        _recurse(5)
+    assert stats.stages["test_recursion"].calls == len(timings) == 5
+    # the outermost call ends last, its time alone is the time of the stage
+    assert stats.stages["test_recursion"].wall == timings[-1] == max(timings)
+
+
+def test_callbacks():
+    stages, counters = [], []
+    stats = Instrumentation(on_stage=lambda name, wall, cpu: stages.append(name),
+                            on_count=lambda name, value, labels: counters.append((name, value, labels)))
+    with stats.activate():
+        _recurse(2)
+        count("attachments", 2, extension=".pdf")
+    assert stages == ["test_recursion", "test_recursion"]
+    assert counters == [("attachments", 2, {"extension": ".pdf"})]
+
+
+def test_merge_and_pickle():
+    first, second = Instrumentation(), Instrumentation()
+    first.add_stage("parse_mail_message", 1.0, 0.5)
+    first.count("attachments", extension=".pdf")
+    second.add_stage("parse_mail_message", 2.0, 1.5)
+    second.add_stage("build_models", 0.25, 0.25)
+    second.count("attachments", 3, extension=".pdf")
+    second.count("bytes_decoded", 100)
+    # the stats of a worker come back pickled
+    first.merge(pickle.loads(pickle.dumps(second)))
+    assert (first.stages["parse_mail_message"].calls, first.stages["parse_mail_message"].wall,
+            first.stages["parse_mail_message"].cpu) == (2, 3.0, 2.0)
+    assert first.stages["build_models"].calls == 1
+    assert first.counter("attachments", extension=".pdf") == 4
+    assert first.counter("bytes_decoded") == 100
+    assert second.stages["parse_mail_message"].calls == 1
+
+
+def test_prometheus_export():
+    stats = Instrumentation()
+    stats.add_stage("parse_mail_message", 1.5, 1.25)
+    stats.add_stage("build_models", 0.5, 0.25)
+    stats.count("attachments", 2, extension=".pdf")
+    stats.count("attachments", extension=".zip")
+    stats.count("bytes_decoded", 1024)
+    assert stats.to_prometheus() == (
+        "# TYPE parsed_stage_calls_total counter\n"
+        'parsed_stage_calls_total{stage="build_models"} 1\n'
+        'parsed_stage_calls_total{stage="parse_mail_message"} 1\n'
+        "# TYPE parsed_stage_wall_seconds_total counter\n"
+        'parsed_stage_wall_seconds_total{stage="build_models"} 0.5\n'
+        'parsed_stage_wall_seconds_total{stage="parse_mail_message"} 1.5\n'
+        "# TYPE parsed_stage_cpu_seconds_total counter\n"
+        'parsed_stage_cpu_seconds_total{stage="build_models"} 0.25\n'
+        'parsed_stage_cpu_seconds_total{stage="parse_mail_message"} 1.25\n'
+        "# TYPE parsed_attachments_total counter\n"
+        'parsed_attachments_total{extension=".pdf"} 2\n'
+        'parsed_attachments_total{extension=".zip"} 1\n'
+        "# TYPE parsed_bytes_decoded_total counter\n"
+        "parsed_bytes_decoded_total 1024\n"
+    )
+    assert stats.to_prometheus(prefix="mail_").startswith("# TYPE mail_stage_calls_total counter\n")
@@ -0,0 +1,166 @@
+import asyncio
+import base64
+import io
+import zipfile
+
+import pytest
+
+from benchmarks.corpus import generate_corpus
+from parsed.file.model import File
+from parsed.file.storage import PayloadStorage
+from parsed.file.store import AttachmentStore
+from parsed.instrumentation import Instrumentation
+from parsed.limits import ParseLimits
+from parsed.mail import MailFile
+from parsed.mail.aio import parse_mail_bytes
+from parsed.mail.cache import MailCache
+from parsed.mail.exceptions import AttachmentDefect, ExpansionRatioExceeded, MimeDepthExceeded, \
+    PartLimitExceeded, SubprocessTimeout
+from parsed.mail.parser import parse_mail_byte
+from parsed.thread.corpus import thread_corpus
+from parsed.thread.parser import thread_from_mail
+
+HEADER = b"From: anna.verdi@example.it\nTo: luigi.bianchi@example.it\nSubject: Limiti\nMIME-Version: 1.0\n"
+
+
+def _many_parts(count: int) -> bytes:
+    parts = b"".join(b"--B\nContent-Type: text/plain\n\npart %d\n" % index for index in range(count))
+    return HEADER + b'Content-Type: multipart/mixed; boundary="B"\n\n' + parts + b"--B--\n"
+
+
+def _nested(depth: int) -> bytes:
+    opening = b"".join(b'Content-Type: multipart/mixed; boundary="b%d"\n\n--b%d\n' % (level, level)
+                       for level in range(depth))
+    closing = b"".join(b"--b%d--\n" % level for level in reversed(range(depth)))
+    return HEADER + opening + b"Content-Type: text/plain\n\nfondo\n" + closing
+
+
+def _with_attachment(filename: str, data: bytes) -> bytes:
+    return (
+        HEADER
+        + b'Content-Type: multipart/mixed; boundary="B"\n\n'
+        + b"--B\nContent-Type: text/plain\n\nIn allegato.\n"
+        + b"--B\nContent-Type: application/zip\n"
+        + b'Content-Disposition: attachment; filename="%s"\n' % filename.encode()
+        + b"Content-Transfer-Encoding: base64\n\n"
+        + base64.encodebytes(data)
+        + b"--B--\n"
+    )
+
+
+def _zip_bomb() -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("zeros.bin", b"\0" * (4 << 20))
+    return buffer.getvalue()
+
+
+def test_part_limit():
+    with ParseLimits(max_parts=10).activate():
+        with pytest.raises(PartLimitExceeded):
+            parse_mail_byte(_many_parts(50))
+    with ParseLimits(max_parts=10, strict=False).activate():
+        assert len(parse_mail_byte(_many_parts(50)).body.content) < 10
+    assert len(parse_mail_byte(_many_parts(50)).body.content) == 50
+
+
+def test_mime_depth_limit():
+    with ParseLimits(max_mime_depth=5).activate():
+        with pytest.raises(MimeDepthExceeded):
+            parse_mail_byte(_nested(20))
+
+
+def test_recursion_surfaces_as_depth_error():
+    with pytest.raises(MimeDepthExceeded):
+        parse_mail_byte(_nested(500))
+
+
+def test_zip_ratio_limit():
+    mail = _with_attachment("bomba.zip", _zip_bomb())
+    with ParseLimits().activate():
+        with pytest.raises(ExpansionRatioExceeded):
+            parse_mail_byte(mail)
+    with ParseLimits().activate():
+        # the archive limits are still attachment defects
+        with pytest.raises(AttachmentDefect):
+            parse_mail_byte(mail)
+    with ParseLimits(strict=False).activate():
+        assert [file.filename for file in parse_mail_byte(mail).body.attachments] == ["bomba.zip"]
+
+
+def test_degraded_mail_is_not_cached():
+    cache = MailCache()
+    with cache.activate():
+        with ParseLimits(max_parts=10, strict=False).activate():
+            parse_mail_byte(_many_parts(50))
+        assert len(cache) == 0
+        with ParseLimits(max_parts=10).activate():
+            with pytest.raises(PartLimitExceeded):
+                parse_mail_byte(_many_parts(50))
+        assert len(parse_mail_byte(_many_parts(50)).body.content) == 50
+
+
+def test_degraded_expansion_is_not_stored(tmp_path):
+    mail = _with_attachment("bomba.zip", _zip_bomb())
+    store = AttachmentStore(str(tmp_path))
+    with store.activate():
+        with ParseLimits(strict=False).activate():
+            assert [file.filename for file in parse_mail_byte(mail).body.attachments] == ["bomba.zip"]
+        with ParseLimits().activate():
+            with pytest.raises(ExpansionRatioExceeded):
+                parse_mail_byte(mail)
+        assert [file.filename for file in parse_mail_byte(mail).body.attachments] == ["zeros.bin"]
+
+
+def test_expansion_is_keyed_by_limits():
+    mail = _with_attachment("bomba.zip", _zip_bomb())
+    store = AttachmentStore()
+    with store.activate():
+        assert [file.filename for file in parse_mail_byte(mail).body.attachments] == ["zeros.bin"]
+        with ParseLimits().activate():
+            with pytest.raises(ExpansionRatioExceeded):
+                parse_mail_byte(mail)
+
+
+def test_async_parse_is_bounded():
+    cache = MailCache()
+    with ParseLimits(max_parts=10).activate():
+        with pytest.raises(PartLimitExceeded):
+            asyncio.run(parse_mail_bytes(_many_parts(50)))
+    with cache.activate(), ParseLimits(max_parts=10, strict=False).activate():
+        assert len(asyncio.run(parse_mail_bytes(_many_parts(50))).body.content) < 10
+    assert len(cache) == 0
+    with ParseLimits(max_zip_ratio=None).activate():
+        assert [file.filename for file in
+                asyncio.run(parse_mail_bytes(_with_attachment("bomba.zip", _zip_bomb()))).body.attachments] == \
+            ["zeros.bin"]
+
+
+def test_async_openssl_timeout():
+    # the in process reader fails on it, so openssl is awaited
+    mail = _with_attachment("fattura.xml.p7m", b"not a cms structure")
+    with ParseLimits(subprocess_timeout=0).activate():
+        with pytest.raises(SubprocessTimeout):
+            asyncio.run(parse_mail_bytes(mail))
+    stats = Instrumentation()
+    with stats.activate(), ParseLimits(subprocess_timeout=0, strict=False).activate():
+        assert [file.filename for file in asyncio.run(parse_mail_bytes(mail)).body.attachments] == \
+            ["fattura.xml.p7m"]
+    assert stats.counter("limits_exceeded", limit="subprocess_timeout") == 1
+
+
+def test_attached_mail_past_the_depth_is_a_file():
+    mail_byte = generate_corpus("nested", 5000, 1)[0]
+    for storage in (None, PayloadStorage()):
+        with ParseLimits(max_attachment_depth=0, strict=False).activate():
+            if storage is None:
+                mail = parse_mail_byte(mail_byte)
+            else:
+                with storage.activate():
+                    mail = parse_mail_byte(mail_byte)
+        attached = [file for file in mail.body.attachments if file.content_type == "message/rfc822"]
+        assert attached and not any(isinstance(file, MailFile) for file in attached)
+        assert all(isinstance(file, File) and file.content.startswith(b"From:") for file in attached)
+        assert mail.body.mails() == []
+        assert len(thread_from_mail(mail).thread) == 1
+        assert len(thread_corpus([mail, *mail.body.mails()])) == 1
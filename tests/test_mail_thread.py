@@ -0,0 +1,109 @@
+from datetime import datetime, timedelta, timezone
+
+from parsed.mail import Body, EmailAddress, Header, MailFile, MailObject
+from parsed.thread.model import MailThread
+
+ROME = timezone(timedelta(hours=1))
+
+
+def _mail(subject: str, received=None, sender: str = "anna.verdi@example.it", to=("luigi.bianchi@example.it",),
+          cc=()) -> MailObject:
+    header = Header(
+        From=EmailAddress(address=sender),
+        To=[EmailAddress(address=address) for address in to],
+        Cc=[EmailAddress(address=address) for address in cc] or None,
+        Received=received,
+        Subject=subject
+    )
+    return MailObject.model_construct(header=header, body=Body.model_construct(content=[]))
+
+
+def _subjects(mails) -> list:
+    return [mail.header.Subject for mail in mails]
+
+
+def _mails() -> list:
+    return [
+        _mail("senza data"),
+        _mail("aware", datetime(2024, 3, 4, 10, 15, tzinfo=ROME)),
+        _mail("stringa", "4 marzo 2024 10:00"),
+        _mail("naive", datetime(2024, 3, 4, 9, 30)),
+        _mail("stringa rfc", "Mon, 04 Mar 2024 08:00:00 +0000"),
+        _mail("stessa data", datetime(2024, 3, 4, 9, 30)),
+    ]
+
+
+# the naive and the string dates are taken as UTC, 10:15 in Rome is 09:15 UTC
+ORDER = ["stringa rfc", "aware", "naive", "stessa data", "stringa", "senza data"]
+
+
+def test_sorted_insertion():
+    thread = MailThread()
+    for mail in _mails():
+        thread.add_mail(mail)
+    assert _subjects(thread.thread) == ORDER
+
+
+def test_batch_and_single_insertions_agree():
+    batch = MailThread()
+    batch.add_mails(_mails())
+    assert _subjects(batch.thread) == ORDER
+    mixed = MailThread()
+    mails = _mails()
+    mixed.add_mails(mails[:2])
+    mixed.add_mails(mails[2:])
+    assert _subjects(mixed.thread) == ORDER
+
+
+def test_str_and_datetime_received_compare():
+    thread = MailThread()
+    thread.add_mails([_mail("stringa", "4 marzo 2024 10:15"), _mail("datetime", datetime(2024, 3, 4, 10, 14))])
+    assert _subjects(thread.thread) == ["datetime", "stringa"]
+    assert _subjects(thread[datetime(2024, 3, 4, 10, 15):"4 marzo 2024 10:16"]) == ["stringa"]
+
+
+def test_time_slicing():
+    thread = MailThread()
+    thread.add_mails(_mails())
+    assert _subjects(thread[datetime(2024, 3, 4, 9, 15, tzinfo=timezone.utc):datetime(2024, 3, 4, 10)]) == \
+        ["aware", "naive", "stessa data"]
+    assert _subjects(thread.between(end="4 marzo 2024 09:30")) == ["stringa rfc", "aware"]
+    # the mails without date are left out of the time slices, not of the positional ones
+    assert _subjects(thread.between()) == ORDER[:-1]
+    assert _subjects(thread[-2:]) == ORDER[-2:]
+    assert thread[0].header.Subject == "stringa rfc"
+
+
+def test_sender_and_participant_indexes():
+    thread = MailThread()
+    thread.add_mails([
+        _mail("prima", datetime(2024, 3, 1), sender="Anna.Verdi@example.it"),
+        _mail("risposta", datetime(2024, 3, 2), sender="luigi.bianchi@example.it", to=["anna.verdi@example.it"],
+              cc=["carla.neri@example.it"]),
+        _mail("seconda", datetime(2024, 3, 3)),
+    ])
+    thread.add_mail(
+        _mail("inoltro", datetime(2024, 3, 4), sender="carla.neri@example.it", to=["mario.rossi@example.it"])
+    )
+    assert _subjects(thread.by_sender("ANNA.VERDI@example.it")) == ["prima", "seconda"]
+    assert _subjects(thread.by_sender("anna.verdi@example.it", start=datetime(2024, 3, 2))) == ["seconda"]
+    assert _subjects(thread.by_participant("carla.neri@example.it")) == ["risposta", "inoltro"]
+    assert _subjects(thread.by_participant("luigi.bianchi@example.it", end=datetime(2024, 3, 3))) == \
+        ["prima", "risposta"]
+    assert thread.by_sender("mario.rossi@example.it") == []
+    assert sorted(thread.senders()) == ["anna.verdi@example.it", "carla.neri@example.it", "luigi.bianchi@example.it"]
+    assert len(thread.participants()) == 4
+
+
+def test_edited_and_reversed_threads_are_sorted_again():
+    thread = MailThread(id="filo")
+    thread.add_mails(_mails())
+    thread.thread.append(_mail("aggiunta", datetime(2024, 3, 1)))
+    assert thread[0].header.Subject == "aggiunta"
+    assert _subjects(thread.by_sender("anna.verdi@example.it"))[0] == "aggiunta"
+    thread.sort(reverse=True)
+    assert thread.thread[0].header.Subject == "senza data"
+    attached = MailFile.model_construct(filename="allegata.eml", parsed_obj=_mail("allegata", datetime(2024, 2, 1)))
+    thread.add_mail(attached)
+    assert thread.thread[0] is attached and attached.parsed_obj.thread_id == "filo"
+    assert _subjects(thread.thread[1:]) == ["aggiunta"] + ORDER
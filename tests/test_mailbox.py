@@ -0,0 +1,70 @@
+import mailbox
+
+from benchmarks.corpus import generate_corpus
+from parsed.mail.mailbox import iter_mbox, iter_mbox_messages
+from parsed.mail.parser import parse_mail_byte
+
+QUOTED = (
+    b"From anna.verdi@example.it Mon Mar  4 10:15:00 2024\n"
+    b"From: anna.verdi@example.it\n"
+    b"To: luigi.bianchi@example.it\n"
+    b"Subject: Citazioni\n"
+    b"\n"
+    b">From the minutes:\n"
+    b">>From a quoted reply\n"
+    b" >From is not quoted here\n"
+    b"\n"
+    b"From luigi.bianchi@example.it Mon Mar  4 10:16:00 2024\n"
+    b"From: luigi.bianchi@example.it\n"
+    b"To: anna.verdi@example.it\n"
+    b"Subject: Re: Citazioni\n"
+    b"\n"
+    b"Senza a capo finale"
+)
+
+
+def _stdlib_messages(path) -> list:
+    box = mailbox.mbox(path, create=False)
+    try:
+        return [box.get_bytes(key) for key in box.keys()]
+    finally:
+        box.close()
+
+
+def test_same_messages_as_stdlib(tmp_path):
+    path = str(tmp_path / "corpus.mbox")
+    box = mailbox.mbox(path)
+    for mail in generate_corpus("alternative", 2000, 3) + generate_corpus("zip", 2000, 2):
+        box.add(mail)
+    box.close()
+    assert list(iter_mbox_messages(path)) == _stdlib_messages(path)
+
+
+def test_quoted_from_lines_and_last_message_without_newline(tmp_path):
+    path = tmp_path / "quoted.mbox"
+    path.write_bytes(QUOTED)
+    messages = list(iter_mbox_messages(str(path)))
+    stdlib = _stdlib_messages(str(path))
+    # the stdlib keeps the mboxrd quoting, the boundaries are the same
+    assert messages == [message.replace(b"\n>From", b"\nFrom").replace(b"\n>>From", b"\n>From")
+                        for message in stdlib]
+    assert messages[0].endswith(b"\nFrom the minutes:\n>From a quoted reply\n >From is not quoted here\n")
+    assert messages[1].endswith(b"\n\nSenza a capo finale")
+
+
+def test_empty_and_without_separator(tmp_path):
+    empty = tmp_path / "empty.mbox"
+    empty.write_bytes(b"")
+    garbage = tmp_path / "garbage.mbox"
+    garbage.write_bytes(b"no mbox here\n")
+    assert list(iter_mbox_messages(str(empty))) == []
+    assert list(iter_mbox_messages(str(garbage))) == []
+
+
+def test_iter_mbox(tmp_path):
+    path = tmp_path / "quoted.mbox"
+    path.write_bytes(QUOTED)
+    mails = list(iter_mbox(str(path)))
+    assert [mail.model_dump() for mail in mails] == \
+        [parse_mail_byte(message).model_dump() for message in iter_mbox_messages(str(path))]
+    assert [mail.header.Subject for mail in mails] == ["Citazioni", "Re: Citazioni"]
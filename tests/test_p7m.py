@@ -0,0 +1,80 @@
+import asyncio
+import base64
+
+import pytest
+
+from benchmarks.corpus import signed_data
+from parsed.mail.aio import parse_mail_bytes
+from parsed.mail.parser import parse_mail_byte
+from parsed.pkcs7 import PKCS7Error, signed_content
+from parsed.utils import openssl_fallback, unwrap_p7m
+
+XML = b"<?xml version='1.0'?><FatturaElettronica/>"
+
+
+def _signed_mail(p7m: bytes) -> bytes:
+    return (
+        b"From: anna.verdi@example.it\n"
+        b"To: luigi.bianchi@example.it\n"
+        b"Subject: Firmato\n"
+        b"MIME-Version: 1.0\n"
+        b'Content-Type: multipart/mixed; boundary="B"\n'
+        b"\n"
+        b"--B\n"
+        b"Content-Type: text/plain\n"
+        b"\n"
+        b"In allegato.\n"
+        b"--B\n"
+        b"Content-Type: application/pkcs7-mime\n"
+        b'Content-Disposition: attachment; filename="fattura.xml.p7m"\n'
+        b"Content-Transfer-Encoding: base64\n"
+        b"\n"
+        + base64.encodebytes(p7m)
+        + b"--B--\n"
+    )
+
+
+def test_signed_content():
+    assert signed_content(signed_data(XML)) == XML
+    assert signed_content(base64.encodebytes(signed_data(XML))) == XML
+    with pytest.raises(PKCS7Error):
+        signed_content(b"not a cms structure")
+
+
+def test_p7m_is_unwrapped():
+    attachment = parse_mail_byte(_signed_mail(signed_data(XML))).body.attachments[0]
+    assert (attachment.filename, attachment.content) == ("fattura.xml", XML.decode())
+
+
+def test_openssl_failure_raises_pkcs7_error():
+    with pytest.raises(PKCS7Error):
+        unwrap_p7m(b"not a cms structure")
+    with openssl_fallback(False):
+        with pytest.raises(PKCS7Error):
+            unwrap_p7m(b"not a cms structure")
+
+
+@pytest.mark.parametrize("fallback", [True, False])
+def test_p7m_that_cannot_be_unwrapped_is_left_signed(fallback):
+    mail_byte = _signed_mail(b"not a cms structure")
+    with openssl_fallback(fallback):
+        attachment = parse_mail_byte(mail_byte).body.attachments[0]
+    assert (attachment.filename, attachment.content) == ("fattura.xml.p7m", b"not a cms structure")
+    attachment = asyncio.run(parse_mail_bytes(mail_byte)).body.attachments[0]
+    assert (attachment.filename, attachment.content) == ("fattura.xml.p7m", b"not a cms structure")
+
+
+def test_lazy_p7m_that_cannot_be_unwrapped():
+    attachment = parse_mail_byte(_signed_mail(b"not a cms structure"), lazy=True).body.attachments[0]
+    assert attachment.filename == "fattura.xml.p7m"
+    assert attachment.content == b"not a cms structure"
+    assert attachment.filename == "fattura.xml.p7m"
+
+
+def test_lazy_p7m_is_renamed_once_unwrapped():
+    mail_byte = _signed_mail(signed_data(XML))
+    attachment = parse_mail_byte(mail_byte, lazy=True).body.attachments[0]
+    assert attachment.filename == "fattura.xml.p7m"
+    assert attachment.content == XML.decode()
+    assert attachment.filename == "fattura.xml"
+    assert parse_mail_byte(mail_byte, lazy=True).model_dump() == parse_mail_byte(mail_byte).model_dump()
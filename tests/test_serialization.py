@@ -0,0 +1,49 @@
+import io
+
+import pytest
+
+from benchmarks.corpus import generate_corpus
+from parsed.mail.exceptions import SerializationDefect
+from parsed.mail.parser import parse_mail_byte
+from parsed.serialization import dump, dumps, load, load_header, loads
+from parsed.thread.parser import thread_from_mail
+
+
+@pytest.mark.parametrize("kind", ["plain", "alternative", "nested", "zip", "p7m"])
+@pytest.mark.parametrize("flatted", [False, True])
+def test_mail_round_trip(kind, flatted):
+    for mail_byte in generate_corpus(kind, 5000, 3):
+        mail = parse_mail_byte(mail_byte, flatted=flatted)
+        assert loads(dumps(mail)).model_dump() == mail.model_dump()
+
+
+def test_thread_round_trip():
+    thread = thread_from_mail(parse_mail_byte(generate_corpus("thread_ita", 5000, 1)[0]))
+    again = loads(dumps(thread))
+    assert [mail.model_dump() for mail in again.thread] == [mail.model_dump() for mail in thread.thread]
+    assert [header.model_dump() for header in load_header(dumps(thread))] == \
+        [mail.header.model_dump() for mail in thread.thread]
+
+
+def test_lazy_load(tmp_path):
+    mail = parse_mail_byte(generate_corpus("zip", 5000, 1)[0])
+    path = tmp_path / "mail.prsd"
+    with open(path, "wb") as fp:
+        dump(mail, fp)
+    again = load(path, lazy=True)
+    assert not again.body.attachments[0].loaded
+    assert again.model_dump() == mail.model_dump()
+
+
+def test_mails_on_a_stream():
+    mails = [parse_mail_byte(mail_byte) for mail_byte in generate_corpus("plain", 5000, 3)]
+    stream = io.BytesIO(b"".join(dumps(mail) for mail in mails))
+    assert [load(stream).model_dump() for _ in mails] == [mail.model_dump() for mail in mails]
+
+
+def test_invalid_data():
+    data = dumps(parse_mail_byte(generate_corpus("plain", 5000, 1)[0]))
+    with pytest.raises(SerializationDefect):
+        loads(b"XXXX" + data[4:])
+    with pytest.raises(SerializationDefect):
+        loads(data[:-10])
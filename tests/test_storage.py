@@ -0,0 +1,45 @@
+from parsed.file.storage import PayloadStorage
+from parsed.file.store import AttachmentStore
+from parsed.mail.parser import parse_mail_byte
+
+TEXT_ATTACHMENT = (
+    b"From: anna.verdi@example.it\n"
+    b"To: luigi.bianchi@example.it\n"
+    b"Subject: Note\n"
+    b"MIME-Version: 1.0\n"
+    b'Content-Type: multipart/mixed; boundary="B"\n'
+    b"\n"
+    b"--B\n"
+    b"Content-Type: text/plain\n"
+    b"\n"
+    b"Le note.\n"
+    b"--B\n"
+    b"Content-Type: text/plain; charset=iso-8859-1\n"
+    b'Content-Disposition: attachment; filename="notes.txt"\n'
+    b"Content-Transfer-Encoding: quoted-printable\n"
+    b"\n"
+    b"some notes =E8\n"
+    b"--B--\n"
+)
+
+
+def _notes(**kwargs):
+    return parse_mail_byte(TEXT_ATTACHMENT, **kwargs).body.attachments[0].content
+
+
+def test_text_attachment_is_str_in_every_mode():
+    expected = _notes()
+    assert expected == "some notes è"
+    assert _notes(lazy=True) == expected
+    with AttachmentStore().activate():
+        assert _notes() == expected
+    with PayloadStorage().activate():
+        assert _notes() == expected
+    with PayloadStorage(spill_threshold=0).activate():
+        assert _notes() == expected
+
+
+def test_binary_attachment_stays_bytes():
+    mail_byte = TEXT_ATTACHMENT.replace(b"text/plain; charset=iso-8859-1", b"application/octet-stream")
+    with PayloadStorage().activate():
+        assert parse_mail_byte(mail_byte).body.attachments[0].content == b"some notes \xe8"
@@ -0,0 +1,52 @@
+import base64
+import os
+
+from benchmarks.corpus import generate_corpus
+from parsed.file.store import AttachmentStore
+from parsed.mail.parser import parse_mail_byte
+from parsed.utils import openssl_fallback
+
+SIGNED_MAIL = (
+    b"From: anna.verdi@example.it\n"
+    b"To: luigi.bianchi@example.it\n"
+    b"Subject: Firmato\n"
+    b"MIME-Version: 1.0\n"
+    b'Content-Type: multipart/mixed; boundary="B"\n'
+    b"\n"
+    b"--B\n"
+    b"Content-Type: text/plain\n"
+    b"\n"
+    b"In allegato.\n"
+    b"--B\n"
+    b"Content-Type: application/pkcs7-mime\n"
+    b'Content-Disposition: attachment; filename="fattura.xml.p7m"\n'
+    b"Content-Transfer-Encoding: base64\n"
+    b"\n"
+    + base64.encodebytes(b"not a cms structure")
+    + b"--B--\n"
+)
+
+
+def _expansions(directory: str) -> list:
+    return [name for _, _, names in os.walk(os.path.join(directory, "expansions")) for name in names]
+
+
+def test_identical_attachments_hit(tmp_path):
+    store = AttachmentStore(str(tmp_path))
+    mail_byte = generate_corpus("zip", 5000, 1)[0]
+    with store.activate():
+        first = parse_mail_byte(mail_byte)
+        second = parse_mail_byte(mail_byte)
+    assert store.hits == 1
+    assert second.model_dump() == first.model_dump()
+    assert len(_expansions(str(tmp_path))) == 1
+
+
+def test_p7m_left_signed_is_not_stored(tmp_path):
+    store = AttachmentStore(str(tmp_path))
+    with store.activate(), openssl_fallback(False):
+        mail = parse_mail_byte(SIGNED_MAIL)
+        parse_mail_byte(SIGNED_MAIL)
+    assert mail.body.attachments[0].filename == "fattura.xml.p7m"
+    assert store.hits == 0
+    assert _expansions(str(tmp_path)) == []
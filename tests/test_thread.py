@@ -0,0 +1,54 @@
+from datetime import datetime
+
+import pytest
+
+from benchmarks.corpus import generate_corpus
+from parsed import dates
+from parsed.dates import DateParser
+from parsed.mail.parser import parse_mail_byte
+from parsed.thread.parser import thread_from_mail
+
+
+def _subjects(thread) -> list:
+    return [mail.header.Subject for mail in thread.thread]
+
+
+@pytest.mark.parametrize("kind", ["thread_ita", "thread_eng", "nested"])
+def test_thread_from_flatted_mail(kind):
+    for mail_byte in generate_corpus(kind, 5000, 3):
+        thread = thread_from_mail(parse_mail_byte(mail_byte))
+        assert len(thread.thread) > 1
+        assert _subjects(thread_from_mail(parse_mail_byte(mail_byte, flatted=True))) == _subjects(thread)
+
+
+QUOTING_MAIL = b"""From: replier@example.com
+To: first@example.com
+Subject: Re: plan
+Date: Mon, 18 Mar 2024 10:00:00 +0000
+Content-Type: text/plain; charset="utf-8"
+
+Fine.
+
+From: first@example.com
+Sent: 03/13/2024 10:00
+To: replier@example.com
+Subject: Re: plan
+
+Moved.
+
+From: second@example.com
+Sent: 03/04/2024 09:00
+To: first@example.com
+Subject: plan
+
+The plan.
+"""
+
+
+def test_quoted_dates_follow_the_client_of_the_replier(monkeypatch):
+    monkeypatch.setattr(dates, "default_date_parser", DateParser(["%d/%m/%Y %H:%M", "%m/%d/%Y %H:%M"]))
+    thread = thread_from_mail(parse_mail_byte(QUOTING_MAIL))
+    received = {mail.header.From.address: mail.header.Received for mail in thread.thread}
+    # the client of the replier wrote both quoted dates month first, the ambiguous one too
+    assert received["first@example.com"] == datetime(2024, 3, 13, 10)
+    assert received["second@example.com"] == datetime(2024, 3, 4, 9)
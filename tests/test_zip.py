@@ -0,0 +1,98 @@
+import io
+import zipfile
+
+import pytest
+
+from parsed.file.model import File
+from parsed.file.storage import PayloadStorage
+from parsed.limits import ParseLimits
+from parsed.mail.exceptions import ArchiveLimitExceeded, AttachmentDepthExceeded, ExpansionRatioExceeded
+from parsed.utils import unzip_attachments
+
+BOMB_MEMBER = b"\0" * (4 << 20)
+
+
+def _zip(members: dict, compression: int = zipfile.ZIP_DEFLATED) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression) as archive:
+        for name, data in members.items():
+            if name.endswith("/"):
+                archive.mkdir(name)
+            else:
+                archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+def _archive(members: dict, compression: int = zipfile.ZIP_DEFLATED) -> File:
+    return File.model_construct(filename="archivio.zip", content=_zip(members, compression))
+
+
+def _files(attachments) -> dict:
+    return {attachment.filename: attachment.content for attachment in attachments}
+
+
+MEMBERS = {"verbale.txt": b"Verbale della riunione.\n", "docs/": b"", "docs/bilancio.pdf": b"%PDF-1.4 bilancio"}
+
+
+def test_members_in_memory_without_directories():
+    files = {name: data for name, data in MEMBERS.items() if not name.endswith("/")}
+    attachments = unzip_attachments(_archive(MEMBERS))
+    assert _files(attachments) == files
+    assert [attachment.content_type for attachment in attachments] == ["application/txt", "application/pdf"]
+    assert [attachment.size for attachment in attachments] == [len(data) for data in files.values()]
+
+
+def test_lazy_members():
+    attachments = unzip_attachments(_archive(MEMBERS), lazy=True)
+    assert not any(attachment.loaded for attachment in attachments)
+    assert _files(attachments) == _files(unzip_attachments(_archive(MEMBERS)))
+
+
+def test_members_in_the_payload_storage():
+    with PayloadStorage().activate():
+        attachments = unzip_attachments(_archive(MEMBERS))
+        assert not any(attachment.loaded for attachment in attachments)
+        assert _files(attachments) == _files(unzip_attachments(_archive(MEMBERS)))
+
+
+def test_nested_archives_are_flattened():
+    inner = _zip({"interno.txt": b"dentro"})
+    outer = _archive({"esterno.txt": b"fuori", "interno.zip": inner, "vuota/": b""})
+    assert _files(unzip_attachments(outer)) == {"esterno.txt": b"fuori", "interno.txt": b"dentro"}
+    with pytest.raises(AttachmentDepthExceeded):
+        unzip_attachments(outer, max_depth=0)
+    deeper = _archive({"livello.zip": _zip({"interno.zip": inner})})
+    assert _files(unzip_attachments(deeper, max_depth=2)) == {"interno.txt": b"dentro"}
+    with pytest.raises(AttachmentDepthExceeded):
+        unzip_attachments(deeper, max_depth=1)
+
+
+def test_member_and_size_limits_include_nested_archives():
+    outer = _archive({"uno.txt": b"1" * 100, "interno.zip": _zip({"due.txt": b"2" * 100, "tre.txt": b"3" * 100})})
+    # the nested archive counts as a member too
+    assert len(unzip_attachments(outer, max_members=4)) == 3
+    with pytest.raises(ArchiveLimitExceeded):
+        unzip_attachments(outer, max_members=3)
+    nested_size = len(_zip({"due.txt": b"2" * 100, "tre.txt": b"3" * 100}))
+    assert len(unzip_attachments(outer, max_size=300 + nested_size)) == 3
+    with pytest.raises(ArchiveLimitExceeded):
+        unzip_attachments(outer, max_size=300 + nested_size - 1)
+
+
+def test_ratio_limit():
+    bomb = _archive({"zeri.bin": BOMB_MEMBER})
+    with pytest.raises(ExpansionRatioExceeded):
+        unzip_attachments(bomb, max_ratio=100)
+    assert _files(unzip_attachments(bomb)) == {"zeri.bin": BOMB_MEMBER}
+    # small members compressing well are not bombs
+    assert len(unzip_attachments(_archive({"zeri.txt": b"\0" * 100_000}), max_ratio=100)) == 1
+
+
+def test_ratio_limit_of_a_nested_bomb():
+    # the outer archive stores the inner one, so only the inner member shows the ratio
+    nested = _archive({"interno.zip": _zip({"zeri.bin": BOMB_MEMBER})}, zipfile.ZIP_STORED)
+    with pytest.raises(ExpansionRatioExceeded):
+        unzip_attachments(nested, max_ratio=100)
+    with ParseLimits().activate():
+        with pytest.raises(ExpansionRatioExceeded):
+            unzip_attachments(nested)